@@ -9,3 +9,5 @@ from .rooms import *
 from .exceptions import *
 from .event_builders import *
 from .monitors import *
+from .schemas import ValidationLevel
+from .json_backend import JsonBackend, set_json_backend
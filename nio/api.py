@@ -29,6 +29,7 @@ from enum import Enum, unique
 from typing import (Any, DefaultDict, Dict, Iterable, List,
                     Optional, Set, Sequence, Tuple, Union)
 
+from . import json_backend
 from .exceptions import LocalProtocolError
 from .http import Http2Request, HttpRequest, TransportRequest
 
@@ -107,19 +108,18 @@ class Api:
     @staticmethod
     def to_json(content_dict):
         # type: (Dict[Any, Any]) -> str
-        """Turn a dictionary into a json string."""
-        return json.dumps(content_dict, separators=(",", ":"))
+        """Turn a dictionary into a json string.
+
+        The string is encoded using the selected JSON backend, see
+        nio.json_backend.
+        """
+        return json_backend.dumps(content_dict)
 
     @staticmethod
     def to_canonical_json(content_dict):
         # type: (Dict[Any, Any]) -> str
         """Turn a dictionary into a canonical json string."""
-        return json.dumps(
-            content_dict,
-            ensure_ascii=False,
-            separators=(",", ":"),
-            sort_keys=True,
-        )
+        return json_backend.canonical_dumps(content_dict)
 
     @staticmethod
     def mimetype_to_msgtype(mimetype):
@@ -433,6 +433,30 @@ class Api:
 
         return "GET", Api._build_path("sync", query_parameters)
 
+    @staticmethod
+    def upload_filter(access_token, user_id, filter):
+        # type: (str, str, Dict[Any, Any]) -> Tuple[str, str, str]
+        """Upload a filter definition to the homeserver.
+
+        Returns the HTTP method, HTTP path and data for the request.
+
+        Args:
+            access_token (str): The access token to be used with the request.
+            user_id (str): The id of the user the filter should be created
+                for.
+            filter (Dict[Any, Any]): The filter definition, the returned
+                filter id can be used in place of it for sync and room
+                messages requests.
+        """
+        query_parameters = {"access_token": access_token}
+        path = "user/{user}/filter".format(user=user_id)
+
+        return (
+            "POST",
+            Api._build_path(path, query_parameters),
+            Api.to_json(filter)
+        )
+
     @staticmethod
     def room_send(
         access_token,  # type: str
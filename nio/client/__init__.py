@@ -4,3 +4,5 @@ from .base_client import Client, ClientConfig
 from .http_client import HttpClient, TransportType, RequestInfo
 if sys.version_info >= (3, 5):
     from .async_client import AsyncClient, AsyncClientConfig, DataProvider
+    from .dispatcher import CallbackDispatcher
+    from .sync_tuner import SyncMetrics, SyncTuner
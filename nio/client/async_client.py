@@ -16,10 +16,16 @@
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 import asyncio
+import hashlib
+import inspect
 import io
+import time
 import warnings
 from asyncio import Event as AsyncioEvent
+from asyncio import Lock as AsyncioLock
+from concurrent.futures import Executor, ProcessPoolExecutor
 from functools import partial, wraps
+from itertools import chain
 from json.decoder import JSONDecodeError
 from pathlib import Path
 from typing import (
@@ -30,6 +36,7 @@ from typing import (
     Set,
     Coroutine,
     Dict,
+    Hashable,
     Iterable,
     List,
     Optional,
@@ -40,7 +47,7 @@ from typing import (
 )
 from uuid import UUID, uuid4
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 from aiofiles.threadpool.binary import AsyncBufferedReader
 from aiohttp import (
     ClientResponse,
@@ -51,9 +58,18 @@ from aiohttp import (
 )
 from aiohttp.client_exceptions import ClientConnectionError
 from aiohttp.connector import Connection
+from jsonschema.exceptions import SchemaError, ValidationError
 
 from . import Client, ClientConfig
-from .base_client import logged_in, store_loaded
+from .base_client import (
+    CallbackIndex,
+    ClientCallback,
+    logged_in,
+    logger,
+    store_loaded,
+)
+from .dispatcher import CallbackDispatcher
+from .sync_tuner import SyncTuner
 from ..api import (
     _FilterT,
     Api,
@@ -82,9 +98,13 @@ from ..events import (
     RoomKeyRequestCancellation,
     ToDeviceEvent,
     MegolmEvent,
+    parse_lazy_state_event,
 )
+from ..events.registry import registered_event_types
 from ..event_builders import ToDeviceMessage
-from ..monitors import TransferMonitor
+from .. import json_backend, schemas
+from ..json_stream import iter_object_members
+from ..monitors import LoopStallMonitor, TransferMonitor
 from ..responses import (
     ContentRepositoryConfigError,
     SyncType,
@@ -161,6 +181,9 @@ from ..responses import (
     RoomReadMarkersError,
     RoomUnbanError,
     RoomUnbanResponse,
+    RoomInfo,
+    Rooms,
+    InviteInfo,
     ShareGroupSessionError,
     ShareGroupSessionResponse,
     SyncError,
@@ -172,6 +195,10 @@ from ..responses import (
     ToDeviceResponse,
     UploadError,
     UploadResponse,
+    UploadFilterError,
+    UploadFilterResponse,
+    JoinedRoomType,
+    parse_joined_rooms,
 )
 
 _ShareGroupSessionT = Union[ShareGroupSessionError, ShareGroupSessionResponse]
@@ -185,14 +212,28 @@ _ProfileSetDisplayNameT = Union[
 
 DataProvider = Callable[[int, int], AsyncDataT]
 
+# The objects of a sync response whose rooms are parsed one at a time if the
+# sync response is streamed.
+_STREAMED_SYNC_PATHS = (
+    ("rooms", "invite"),
+    ("rooms", "join"),
+    ("rooms", "leave"),
+)
+
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+# How many joined rooms of a sync response are parsed in one executor job.
+_SYNC_BATCH_ROOMS = 64
+
+# The dispatcher ordering key of to-device callbacks, room ids are used for
+# room events.
+_TO_DEVICE_KEY = ("to_device", )
+
 
 @dataclass
-class ResponseCb:
+class ResponseCb(ClientCallback):
     """Response callback."""
 
-    func: Callable = field()
-    filter: Union[Tuple[Type], Type, None] = None
-
 
 async def on_request_chunk_sent(session, context, params):
     """TraceConfig callback to run when a chunk is sent for client uploads."""
@@ -265,6 +306,67 @@ class AsyncClientConfig(ClientConfig):
             `timeout` argument.
             The `download()`, `thumbnail()` and `upload()` methods ignore
             this option and use `0`.
+
+        streaming_sync (bool): Parse sync responses incrementally while they
+            are being received. Every room is parsed as soon as it is
+            decoded, so neither the raw response body nor the decoded
+            dictionary of the whole response are kept. The parsed rooms are
+            still collected until the response was received completely, only
+            then is it handled and are the event callbacks run.
+            Defaults to False.
+
+        sync_executor (Executor, optional): An executor, e.g. a
+            `concurrent.futures.ProcessPoolExecutor`, that the joined rooms of
+            large sync responses are parsed in. The rooms are split into
+            batches which are parsed in parallel while the event loop keeps
+            running, the resulting `SyncResponse` is the same as if the rooms
+            were parsed one by one. Lazy event parsing is turned off for
+            process pools, lazy events can't be sent between processes.
+            The validation level, the classes registered with
+            `nio.events.register_event_type()` and the compiled validator
+            mode are sent to the worker processes with every batch, the
+            registered classes need to be importable in the workers. The
+            JSON backend isn't used by the workers, they get the already
+            decoded rooms.
+            Isn't used for streamed sync responses.
+            Defaults to None, parsing the whole response on the event loop.
+
+        offload_sync (bool): Run the CPU heavy parts of sync processing,
+            decoding and parsing the response, applying room state,
+            decrypting events and storing the results, in the default
+            executor of the event loop. Event callbacks still run on the
+            event loop, in the same order as before. The client state is
+            modified from a worker thread while a sync is processed, the
+            client mustn't be used from other threads. Requests that change
+            the Olm account or the store, e.g. the key uploads, key queries
+            and to-device messages of `sync_forever()`, wait until the
+            running step is done before they handle their response.
+            Defaults to False.
+
+        callback_workers (int): How many event, ephemeral, to-device and
+            response callbacks may run concurrently. If this is set the
+            callbacks run on the `CallbackDispatcher` of the client instead
+            of being awaited one after the other. Callbacks for events of the
+            same room, and to-device callbacks, still run in order, callbacks
+            for different rooms run in parallel. The room that is passed to
+            an event callback may already contain the state of later events.
+            Exceptions raised by callbacks are logged instead of being
+            raised from `sync()`.
+            Defaults to 0, running the callbacks one after the other.
+
+        callback_queue_size (int): How many callbacks may be queued on the
+            dispatcher. Handling of a sync response, and with that the next
+            sync, waits until its callbacks fit into the queue.
+            Defaults to 1000.
+
+        upload_filters (bool): Upload the filter definitions that are passed
+            to `sync()` and `sync_forever()` to the server and sync with the
+            returned filter ids instead of sending the whole filter with every
+            request. The ids are cached in `AsyncClient.filter_ids`, and
+            persisted in the store, keyed by a hash of the filter. If the
+            server rejects the upload the filter is sent inline, and it
+            isn't uploaded again by this client.
+            Defaults to False.
     """
 
     max_limit_exceeded: Optional[int] = None
@@ -272,6 +374,12 @@ class AsyncClientConfig(ClientConfig):
     backoff_factor: float = 0.1
     max_timeout_retry_wait_time: float = 60
     request_timeout: float = 60
+    streaming_sync: bool = False
+    sync_executor: Optional[Executor] = None
+    offload_sync: bool = False
+    callback_workers: int = 0
+    callback_queue_size: int = 1000
+    upload_filters: bool = False
 
 
 class AsyncClient(Client):
@@ -297,6 +405,12 @@ class AsyncClient(Client):
     Attributes:
         synced (Event): An asyncio event that is fired every time the client
             successfully syncs with the server.
+        sync_loop_stall (float): The longest time in seconds that the event
+            loop was blocked while the last sync response was parsed and
+            handled, see the `offload_sync` config option.
+        callback_dispatcher (CallbackDispatcher, optional): The dispatcher
+            that runs the callbacks if the `callback_workers` config option
+            is set. Its `join()` method waits for all queued callbacks.
 
     A simple example can be found bellow.
 
@@ -350,7 +464,15 @@ class AsyncClient(Client):
         self.proxy = proxy
 
         self.synced = AsyncioEvent()
+        self.sync_loop_stall = 0.0
+        # Held while a sync step runs in the executor, the Olm account and the
+        # store mustn't be changed on the event loop at the same time.
+        self._sync_step_lock = AsyncioLock()
+        self.callback_dispatcher: Optional[CallbackDispatcher] = None
         self.response_callbacks: List[ResponseCb] = []
+        self._response_callback_index = CallbackIndex()
+        # Hashes of the filters that the server refused to store.
+        self._rejected_filters: Set[str] = set()
 
         self.sharing_session: Dict[str, AsyncioEvent] = dict()
 
@@ -394,6 +516,7 @@ class AsyncClient(Client):
         """
         cb = ResponseCb(func, cb_filter)  # type: ignore
         self.response_callbacks.append(cb)
+        self._response_callback_index.invalidate()
 
     async def parse_body(
         self, transport_response: ClientResponse
@@ -407,7 +530,7 @@ class AsyncClient(Client):
         Returns a dictionary representing the response.
         """
         try:
-            return await transport_response.json()
+            return await transport_response.json(loads=json_backend.loads)
         except (JSONDecodeError, ContentTypeError):
             return {}
 
@@ -446,6 +569,21 @@ class AsyncClient(Client):
             body = await transport_response.read()
             resp = response_class.from_data(body, content_type, name)
 
+        elif (
+            response_class is SyncResponse
+            and self.config.streaming_sync
+            and transport_response.status == 200
+            and is_json
+        ):
+            resp = await self._stream_sync_response(transport_response)
+
+        elif (
+            response_class is SyncResponse
+            and (self.config.sync_executor or self.config.offload_sync)
+            and transport_response.status == 200
+        ):
+            resp = await self._parse_sync_response(transport_response, is_json)
+
         elif (
             transport_response.status == 401
             and response_class == DeleteDevicesResponse
@@ -455,21 +593,162 @@ class AsyncClient(Client):
 
         else:
             parsed_dict = await self.parse_body(transport_response)
-            resp = response_class.from_dict(parsed_dict, *data)
+
+            with self._parse_options():
+                resp = response_class.from_dict(parsed_dict, *data)
 
         resp.transport_response = transport_response
         return resp
 
+    async def _run_sync_step(
+        self, func: Callable, *args, offload: bool = False
+    ) -> Any:
+        """Run a CPU heavy step of sync processing.
+
+        The step runs in the default executor of the event loop if sync
+        processing should be offloaded, otherwise it runs right away.
+
+        Args:
+            func (Callable): The step that should run.
+            *args: The arguments for the step.
+            offload (bool): Run the step in the executor even if sync
+                processing isn't offloaded, e.g. because it waits for a
+                thread pool.
+        """
+        if not self.config.offload_sync and not offload:
+            return func(*args)
+
+        loop = asyncio.get_event_loop()
+
+        async with self._sync_step_lock:
+            return await loop.run_in_executor(None, partial(func, *args))
+
+    @staticmethod
+    def _decode_body(body: bytes, is_json: bool) -> Dict[Any, Any]:
+        if not is_json:
+            return {}
+
+        try:
+            return json_backend.loads(body)
+        except JSONDecodeError:
+            return {}
+
+    def _parse_sync(
+        self,
+        parsed_dict: Dict[Any, Any],
+        joined_rooms: Optional[Iterable[JoinedRoomType]] = None,
+    ) -> Union[SyncResponse, SyncError]:
+        with self._parse_options():
+            return SyncResponse.from_dict(parsed_dict, 0, joined_rooms)
+
+    async def _parse_sync_response(
+        self, transport_response: ClientResponse, is_json: bool
+    ) -> Union[SyncResponse, SyncError]:
+        """Parse a sync response off the event loop.
+
+        The response is decoded and parsed in the default executor if sync
+        processing is offloaded. The joined rooms are spread over the sync
+        executor, if one is configured, unless the response contains only a
+        few of them or parsing the rooms in the executor fails, e.g. because
+        the response is invalid.
+        """
+        if self.config.offload_sync:
+            body = await transport_response.read()
+            parsed_dict = await self._run_sync_step(
+                self._decode_body, body, is_json
+            )
+        else:
+            parsed_dict = await self.parse_body(transport_response)
+
+        executor = self.config.sync_executor
+
+        try:
+            rooms = list(parsed_dict["rooms"]["join"].items())
+        except (KeyError, TypeError, AttributeError):
+            rooms = []
+
+        joined_rooms = None
+
+        if executor and len(rooms) > _SYNC_BATCH_ROOMS:
+            loop = asyncio.get_event_loop()
+            lazy = self.config.lazy_events
+            event_types = None
+            compiled_validators = None
+
+            # Worker processes don't share the global settings of this
+            # process, send them along with every batch.
+            if isinstance(executor, ProcessPoolExecutor):
+                lazy = False
+                event_types = registered_event_types()
+                compiled_validators = schemas._use_compiled_checks
+
+            batches = [
+                loop.run_in_executor(
+                    executor,
+                    parse_joined_rooms,
+                    rooms[start:start + _SYNC_BATCH_ROOMS],
+                    0,
+                    self.config.validation_level,
+                    lazy,
+                    event_types,
+                    compiled_validators,
+                )
+                for start in range(0, len(rooms), _SYNC_BATCH_ROOMS)
+            ]
+
+            try:
+                results = await asyncio.gather(*batches)
+                joined_rooms = chain.from_iterable(results)
+            except Exception as e:
+                logger.warn(
+                    "Error parsing sync rooms in the executor, parsing "
+                    "them serially: {!r}".format(e)
+                )
+
+        return await self._run_sync_step(
+            self._parse_sync, parsed_dict, joined_rooms
+        )
+
+    async def _run_callback(
+        self, key: Optional[Hashable], func: Callable, *args
+    ) -> None:
+        """Run a callback, or queue it on the callback dispatcher.
+
+        Args:
+            key (Hashable, optional): The ordering key for the dispatcher,
+                callbacks with the same key run in order.
+            func (Callable): The callback.
+            *args: The arguments for the callback.
+        """
+        if not self.config.callback_workers:
+            result = func(*args)
+
+            if inspect.isawaitable(result):
+                await result
+
+            return
+
+        if not self.callback_dispatcher:
+            self.callback_dispatcher = CallbackDispatcher(
+                self.config.callback_workers,
+                self.config.callback_queue_size,
+            )
+
+        await self.callback_dispatcher.dispatch(key, func, *args)
+
     async def _run_to_device_callbacks(self, event: Union[ToDeviceEvent]):
-        for cb in self.to_device_callbacks:
-            if cb.filter is None or isinstance(event, cb.filter):
-                await asyncio.coroutine(cb.func)(event)
+        for cb in self._to_device_callback_index.lookup(
+            self.to_device_callbacks, event
+        ):
+            await self._run_callback(_TO_DEVICE_KEY, cb.func, event)
 
     async def _handle_to_device(self, response: SyncType):
         decrypted_to_device = []
 
         for index, to_device_event in enumerate(response.to_device_events):
-            decrypted_event = self._handle_decrypt_to_device(to_device_event)
+            decrypted_event = await self._run_sync_step(
+                self._handle_decrypt_to_device, to_device_event
+            )
 
             if decrypted_event:
                 decrypted_to_device.append((index, decrypted_event))
@@ -485,67 +764,182 @@ class AsyncClient(Client):
 
             await self._run_to_device_callbacks(to_device_event)
 
+        if self.olm:
+            await self._run_sync_step(self.olm.flush_sessions)
+
         self._replace_decrypted_to_device(decrypted_to_device, response)
 
-    async def _handle_invited_rooms(self, response: SyncType):
-        for room_id, info in response.rooms.invite.items():
-            room = self._get_invited_room(room_id)
+    async def _handle_invited_room(self, room_id: str, info: InviteInfo):
+        room = self._get_invited_room(room_id)
 
-            for event in info.invite_state:
-                room.handle_event(event)
+        for event in info.invite_state:
+            parse_lazy_state_event(event)
+            room.handle_event(event)
 
-                for cb in self.event_callbacks:
-                    if cb.filter is None or isinstance(event, cb.filter):
-                        await asyncio.coroutine(cb.func)(room, event)
+            for cb in self._event_callback_index.lookup(
+                self.event_callbacks, event
+            ):
+                await self._run_callback(room_id, cb.func, room, event)
 
-    async def _handle_joined_rooms(self, response: SyncType) -> None:
-        encrypted_rooms: Set[str] = set()
+    async def _handle_invited_rooms(self, response: SyncType):
+        for room_id, info in response.rooms.invite.items():
+            await self._handle_invited_room(room_id, info)
 
-        for room_id, join_info in response.rooms.join.items():
-            self._handle_joined_state(room_id, join_info, encrypted_rooms)
+    async def _handle_joined_room(
+        self, room_id: str, join_info: RoomInfo, encrypted_rooms: Set[str]
+    ) -> None:
+        await self._run_sync_step(
+            self._handle_joined_state, room_id, join_info, encrypted_rooms
+        )
 
-            room = self.rooms[room_id]
-            decrypted_events: List[Tuple[int, Union[Event, BadEventType]]] = []
+        room = self.rooms[room_id]
+        decrypted_events: List[Tuple[int, Union[Event, BadEventType]]] = []
+
+        # Decrypt the whole timeline in one go if decryption is offloaded or
+        # runs in a thread pool, the rest of the timeline handling is
+        # interleaved with the callbacks and stays on the loop.
+        predecrypted: Optional[
+            List[Optional[Union[Event, BadEventType]]]
+        ] = None
+
+        if (
+            self.config.offload_sync or self.config.decryption_workers
+        ) and self.olm:
+            # The decryption waits for the decryption pool, which mustn't
+            # block the loop.
+            predecrypted = await self._run_sync_step(
+                self._decrypt_timeline,
+                room_id,
+                join_info.timeline.events,
+                offload=bool(self.config.decryption_workers),
+            )
 
-            for index, event in enumerate(join_info.timeline.events):
+        for index, event in enumerate(join_info.timeline.events):
+            if predecrypted is None:
                 decrypted_event = self._handle_timeline_event(
                     event, room_id, room, encrypted_rooms
                 )
+            else:
+                decrypted_event = predecrypted[index]
+                self._handle_timeline_event(
+                    decrypted_event or event,
+                    room_id,
+                    room,
+                    encrypted_rooms,
+                    decrypt=False,
+                )
+
+            if decrypted_event:
+                event = decrypted_event
+                decrypted_events.append((index, decrypted_event))
 
-                if decrypted_event:
-                    event = decrypted_event
-                    decrypted_events.append((index, decrypted_event))
+            for cb in self._event_callback_index.lookup(
+                self.event_callbacks, event
+            ):
+                await self._run_callback(room_id, cb.func, room, event)
 
-                for cb in self.event_callbacks:
-                    if cb.filter is None or isinstance(event, cb.filter):
-                        await asyncio.coroutine(cb.func)(room, event)
+        # Replace the Megolm events with decrypted ones
+        for index, event in decrypted_events:
+            join_info.timeline.events[index] = event
 
-            # Replace the Megolm events with decrypted ones
-            for index, event in decrypted_events:
-                join_info.timeline.events[index] = event
+        self._cache_timeline(room, join_info.timeline)
 
-            for event in join_info.ephemeral:
-                room.handle_ephemeral_event(event)
+        for event in join_info.ephemeral:
+            room.handle_ephemeral_event(event)
 
-                for cb in self.ephemeral_callbacks:
-                    if cb.filter is None or isinstance(event, cb.filter):
-                        await asyncio.coroutine(cb.func)(room, event)
+            for cb in self._ephemeral_callback_index.lookup(
+                self.ephemeral_callbacks, event
+            ):
+                await self._run_callback(room_id, cb.func, room, event)
 
-            if room.encrypted and self.olm is not None:
-                self.olm.update_tracked_users(room)
+        if room.encrypted and self.olm is not None:
+            self.olm.update_tracked_users(room)
 
+    def _save_encrypted_rooms(self, encrypted_rooms: Set[str]) -> None:
         self.encrypted_rooms.update(encrypted_rooms)
 
         if self.store:
             self.store.save_encrypted_rooms(encrypted_rooms)
 
+    async def _handle_joined_rooms(self, response: SyncType) -> None:
+        encrypted_rooms: Set[str] = set()
+
+        for room_id, join_info in response.rooms.join.items():
+            await self._handle_joined_room(room_id, join_info, encrypted_rooms)
+
+        await self._run_sync_step(self._save_encrypted_rooms, encrypted_rooms)
+
+    async def _stream_sync_response(
+        self, transport_response: ClientResponse
+    ) -> Union[SyncResponse, SyncError]:
+        """Parse a sync response while it's being received.
+
+        Every room of the response is validated and parsed as soon as it is
+        decoded, the decoded dictionary of the room is dropped right after.
+        This saves holding the raw body and a decoded copy of it, the parsed
+        rooms themselves are kept until the response is complete. Nothing is
+        handled here, the client state is changed and the callbacks are run
+        when the complete response is received, like for any other sync
+        response.
+
+        Returns a SyncResponse, or a SyncError if the response is invalid.
+        """
+        parsed_dict: Dict[str, Any] = {}
+        rooms = Rooms({}, {}, {})
+
+        chunks = transport_response.content.iter_chunked(_STREAM_CHUNK_SIZE)
+
+        try:
+            async for path, value in iter_object_members(
+                chunks, _STREAMED_SYNC_PATHS
+            ):
+                if path[:-1] in _STREAMED_SYNC_PATHS:
+                    membership, room_id = path[1], path[2]
+
+                    with self._parse_options():
+                        room = SyncResponse._get_single_room(
+                            membership, room_id, value
+                        )
+
+                    getattr(rooms, membership).update(
+                        getattr(room, membership)
+                    )
+
+                else:
+                    parent = parsed_dict
+
+                    for key in path[:-1]:
+                        parent = parent.setdefault(key, {})
+
+                    parent[path[-1]] = value
+
+        except JSONDecodeError as e:
+            logger.warn("Error decoding streamed sync response: {}".format(e))
+            return SyncError("Invalid sync response: {}".format(e))
+
+        except (ValidationError, SchemaError) as e:
+            logger.warn(
+                "Error validating streamed sync response: " + str(e.message)
+            )
+            return SyncError("Invalid sync response: {}".format(e.message))
+
+        parsed_dict.setdefault("rooms", {}).update(
+            invite={}, join={}, leave={}
+        )
+
+        with self._parse_options():
+            response = SyncResponse.from_dict(parsed_dict)
+
+        if isinstance(response, SyncResponse):
+            response.rooms = rooms
+
+        return response
+
     async def _handle_expired_verifications(self):
         expired_verifications = self.olm.clear_verifications()
 
         for event in expired_verifications:
-            for cb in self.to_device_callbacks:
-                if cb.filter is None or isinstance(event, cb.filter):
-                    await asyncio.coroutine(cb.func)(event)
+            await self._run_to_device_callbacks(event)
 
     async def _handle_sync(self, response: SyncType) -> None:
         # We already recieved such a sync response, do nothing in that case.
@@ -555,18 +949,31 @@ class AsyncClient(Client):
         if isinstance(response, SyncResponse):
             self.next_batch = response.next_batch
 
-            if self.config.store_sync_tokens and self.store:
-                self.store.save_sync_token(self.next_batch)
-
         await self._handle_to_device(response)
 
         await self._handle_invited_rooms(response)
 
         await self._handle_joined_rooms(response)
 
+        self._evict_lazy_members()
+
+        await self._run_sync_step(self._save_room_state)
+
+        # The sync token is only stored once the sessions and the room state
+        # this response changed are stored. If the process dies before that,
+        # the response is requested and handled again.
+        if (
+            isinstance(response, SyncResponse)
+            and self.config.store_sync_tokens
+            and self.store
+        ):
+            await self._run_sync_step(
+                self.store.save_sync_token, response.next_batch
+            )
+
         if self.olm:
             await self._handle_expired_verifications()
-            self._handle_olm_events(response)
+            await self._run_sync_step(self._handle_olm_events, response)
             await self._collect_key_requests()
 
     async def _collect_key_requests(self):
@@ -590,7 +997,8 @@ class AsyncClient(Client):
         if isinstance(response, (SyncResponse, PartialSyncResponse)):
             await self._handle_sync(response)
         else:
-            super().receive_response(response)
+            async with self._sync_step_lock:
+                super().receive_response(response)
 
     async def get_timeout_retry_wait_time(self, got_timeouts: int) -> float:
         if got_timeouts < 2:
@@ -613,6 +1021,7 @@ class AsyncClient(Client):
         data_provider: Optional[DataProvider] = None,
         timeout: Optional[float] = None,
         content_length: Optional[int] = None,
+        receive: bool = True,
     ):
         headers = (
             {"Content-Type": content_type}
@@ -629,43 +1038,69 @@ class AsyncClient(Client):
         got_timeouts = 0
         max_timeouts = self.config.max_timeouts
 
-        while True:
-            if data_provider:
-                data = data_provider(got_429, got_timeouts)
+        stall_monitor = (
+            LoopStallMonitor() if response_class is SyncResponse else None
+        )
 
-            try:
-                transport_resp = await self.send(
-                    method, path, data, headers, trace_context, timeout,
-                )
+        try:
+            while True:
+                if data_provider:
+                    data = data_provider(got_429, got_timeouts)
 
-                resp = await self.create_matrix_response(
-                    response_class, transport_resp, response_data,
-                )
+                try:
+                    start_time = time.time()
+                    transport_resp = await self.send(
+                        method, path, data, headers, trace_context, timeout,
+                    )
 
-                if (
-                    isinstance(resp, ErrorResponse) and
-                    resp.status_code in ("M_LIMIT_EXCEEDED", 429)
-                ):
-                    got_429 += 1
+                    if stall_monitor:
+                        stall_monitor.start()
+
+                    resp = await self.create_matrix_response(
+                        response_class, transport_resp, response_data,
+                    )
+                    resp.start_time = start_time
+                    resp.end_time = time.time()
 
-                    if max_429 is not None and got_429 > max_429:
+                    if (
+                        isinstance(resp, ErrorResponse) and
+                        resp.status_code in ("M_LIMIT_EXCEEDED", 429)
+                    ):
+                        got_429 += 1
+
+                        if max_429 is not None and got_429 > max_429:
+                            break
+
+                        await self.run_response_callbacks([resp])
+                        await asyncio.sleep(
+                            (resp.retry_after_ms or 5000) / 1000
+                        )
+                    else:
                         break
 
-                    await self.run_response_callbacks([resp])
-                    await asyncio.sleep((resp.retry_after_ms or 5000) / 1000)
-                else:
-                    break
+                except (
+                    ClientConnectionError,
+                    TimeoutError,
+                    asyncio.TimeoutError,
+                ):
+                    got_timeouts += 1
+
+                    if (
+                        max_timeouts is not None
+                        and got_timeouts > max_timeouts
+                    ):
+                        raise
 
-            except (ClientConnectionError, TimeoutError, asyncio.TimeoutError):
-                got_timeouts += 1
+                    wait = await self.get_timeout_retry_wait_time(got_timeouts)
+                    await asyncio.sleep(wait)
 
-                if max_timeouts is not None and got_timeouts > max_timeouts:
-                    raise
+            if receive:
+                await self.receive_response(resp)
 
-                wait = await self.get_timeout_retry_wait_time(got_timeouts)
-                await asyncio.sleep(wait)
+        finally:
+            if stall_monitor:
+                self.sync_loop_stall = stall_monitor.stop()
 
-        await self.receive_response(resp)
         return resp
 
     @client_session
@@ -852,6 +1287,26 @@ class AsyncClient(Client):
         a `SyncError` if there was an error with the request.
         """
 
+        response = await self._sync_request(
+            timeout, sync_filter, since, full_state
+        )
+
+        self.synced.set()
+        self.synced.clear()
+
+        return response
+
+    async def _sync_request(
+        self,
+        timeout: Optional[int],
+        sync_filter: _FilterT,
+        since: Optional[str],
+        full_state: Optional[bool],
+        receive: bool = True,
+    ) -> Union[SyncResponse, SyncError]:
+        if self.config.upload_filters and isinstance(sync_filter, dict):
+            sync_filter = await self._get_filter_id(sync_filter)
+
         sync_token = since or self.next_batch
         method, path = Api.sync(
             self.access_token,
@@ -861,7 +1316,7 @@ class AsyncClient(Client):
             full_state=full_state,
         )
 
-        response = await self._send(
+        return await self._send(
             SyncResponse,
             method,
             path,
@@ -871,12 +1326,71 @@ class AsyncClient(Client):
                 0 if full_state else
                 timeout / 1000 + 15 if timeout else
                 timeout,
+            receive=receive,
         )
 
-        self.synced.set()
-        self.synced.clear()
+    @staticmethod
+    def _filter_hash(filter: Dict[Any, Any]) -> str:
+        """Get the hash of the canonical JSON form of a filter."""
+        content = Api.to_canonical_json(filter).encode("utf-8")
+        return hashlib.sha256(content).hexdigest()
 
-        return response
+    async def _get_filter_id(self, filter: Dict[Any, Any]) -> _FilterT:
+        """Get the id of a filter, uploading the filter if it has none yet.
+
+        Returns the filter itself if it was rejected by the server.
+        """
+        if not filter:
+            return filter
+
+        filter_hash = self._filter_hash(filter)
+        filter_id = self.filter_ids.get(filter_hash)
+
+        if filter_id:
+            return filter_id
+
+        if filter_hash in self._rejected_filters:
+            return filter
+
+        response = await self.upload_filter(filter)
+
+        if isinstance(response, UploadFilterError):
+            logger.warn(
+                "Error uploading sync filter, sending it inline: {}".format(
+                    response
+                )
+            )
+            self._rejected_filters.add(filter_hash)
+            return filter
+
+        self.filter_ids[filter_hash] = response.filter_id
+
+        if self.store:
+            self.store.save_filter_id(filter_hash, response.filter_id)
+
+        return response.filter_id
+
+    @logged_in
+    async def upload_filter(
+        self, filter: Dict[Any, Any],
+    ) -> Union[UploadFilterResponse, UploadFilterError]:
+        """Upload a filter definition to the server.
+
+        The returned filter id can be passed to `sync()` or `room_messages()`
+        in place of the filter definition.
+
+        Returns either a `UploadFilterResponse` if the request was successful
+        or a `UploadFilterError` if there was an error with the request.
+
+        Args:
+            filter (Dict[Any, Any]): The filter definition, see the
+                specification for the format of filters.
+        """
+        method, path, data = Api.upload_filter(
+            self.access_token, self.user_id, filter
+        )
+
+        return await self._send(UploadFilterResponse, method, path, data)
 
     @logged_in
     async def send_to_device_messages(
@@ -899,9 +1413,10 @@ class AsyncClient(Client):
     ):
         """Run the configured response callbacks for the given responses."""
         for response in responses:
-            for cb in self.response_callbacks:
-                if cb.filter is None or isinstance(response, cb.filter):
-                    await asyncio.coroutine(cb.func)(response)
+            for cb in self._response_callback_index.lookup(
+                self.response_callbacks, response
+            ):
+                await self._run_callback(None, cb.func, response)
 
     @logged_in
     async def sync_forever(
@@ -912,6 +1427,8 @@ class AsyncClient(Client):
         full_state: Optional[bool] = None,
         loop_sleep_time: Optional[int] = None,
         first_sync_filter: _FilterT = None,
+        pipeline: bool = False,
+        tuner: Optional[SyncTuner] = None,
     ):
         """Continuously sync with the configured homeserver.
 
@@ -957,39 +1474,59 @@ class AsyncClient(Client):
                 is used.
                 To have no filtering for the first sync regardless of
                 `sync_filter`'s value, pass `{}`.
+
+            pipeline (bool, optional): Request the next sync as soon as the
+                sync token of the previous response is known, while the
+                previous response is still being handled and its callbacks
+                run. Responses are still handled one after the other, in the
+                order they were received.
+
+            tuner (SyncTuner, optional): A tuner that picks the timeout and
+                filter of every sync after the first one, depending on the
+                traffic of the previous syncs. The `timeout` argument is only
+                used as the starting point and `sync_filter` as the full
+                filter of the tuner. The tuner's metrics show its decisions.
         """
 
+        if pipeline:
+            await self._sync_forever_pipelined(
+                timeout,
+                sync_filter,
+                since,
+                full_state,
+                loop_sleep_time,
+                first_sync_filter,
+                tuner,
+            )
+            return
+
         first_sync = True
 
         while True:
             try:
-                use_filter = first_sync_filter if first_sync else sync_filter
-                use_timeout = 0 if first_sync else timeout
+                use_timeout, use_filter = self._sync_parameters(
+                    first_sync, timeout, sync_filter, first_sync_filter, tuner
+                )
 
                 tasks = [
-                    asyncio.ensure_future(coro)
-                    for coro in (
-                        self.sync(use_timeout, use_filter, since, full_state),
-                        self.send_to_device_messages(),
+                    asyncio.ensure_future(
+                        self.sync(use_timeout, use_filter, since, full_state)
                     )
                 ]
-
-                if self.should_upload_keys:
-                    tasks.append(asyncio.ensure_future(self.keys_upload()))
-
-                if self.should_query_keys:
-                    tasks.append(asyncio.ensure_future(self.keys_query()))
-
-                if self.should_claim_keys:
-                    tasks.append(
-                        asyncio.ensure_future(
-                            self.keys_claim(self.get_users_for_key_claiming()),
-                        )
-                    )
+                tasks.extend(self._start_sync_side_requests())
 
                 for response in asyncio.as_completed(tasks):
                     await self.run_response_callbacks([await response])
 
+                sync_response = tasks[0].result()
+
+                if (
+                    tuner
+                    and not first_sync
+                    and isinstance(sync_response, SyncResponse)
+                ):
+                    tuner.update(sync_response)
+
                 first_sync = False
                 full_state = None
                 since = None
@@ -1003,6 +1540,116 @@ class AsyncClient(Client):
 
                 break
 
+    @staticmethod
+    def _sync_parameters(
+        first_sync: bool,
+        timeout: Optional[int],
+        sync_filter: _FilterT,
+        first_sync_filter: _FilterT,
+        tuner: Optional[SyncTuner],
+    ) -> Tuple[Optional[int], _FilterT]:
+        """Get the timeout and filter of the next sync of sync_forever()."""
+        if first_sync:
+            return 0, first_sync_filter
+
+        if tuner:
+            return tuner.timeout(timeout), tuner.sync_filter(sync_filter)
+
+        return timeout, sync_filter
+
+    def _start_sync_side_requests(self) -> List[asyncio.Future]:
+        """Start the requests that sync_forever() makes next to every sync."""
+        tasks = [asyncio.ensure_future(self.send_to_device_messages())]
+
+        if self.should_upload_keys:
+            tasks.append(asyncio.ensure_future(self.keys_upload()))
+
+        if self.should_query_keys:
+            tasks.append(asyncio.ensure_future(self.keys_query()))
+
+        if self.should_claim_keys:
+            tasks.append(
+                asyncio.ensure_future(
+                    self.keys_claim(self.get_users_for_key_claiming()),
+                )
+            )
+
+        return tasks
+
+    async def _handle_pipelined_sync(
+        self, response: Union[SyncResponse, SyncError]
+    ) -> None:
+        await self.receive_response(response)
+
+        self.synced.set()
+        self.synced.clear()
+
+        # The side requests depend on the state of the handled response, e.g.
+        # the keys that need to be queried.
+        tasks = self._start_sync_side_requests()
+
+        try:
+            await self.run_response_callbacks([response])
+
+            for side_response in asyncio.as_completed(tasks):
+                await self.run_response_callbacks([await side_response])
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+
+            raise
+
+    async def _sync_forever_pipelined(
+        self,
+        timeout: Optional[int],
+        sync_filter: _FilterT,
+        since: Optional[str],
+        full_state: Optional[bool],
+        loop_sleep_time: Optional[int],
+        first_sync_filter: _FilterT,
+        tuner: Optional[SyncTuner],
+    ) -> None:
+        """Sync forever, overlapping every sync request with the handling of
+        the previous response.
+        """
+        first_sync = True
+        handling: Optional[asyncio.Future] = None
+
+        try:
+            while True:
+                use_timeout, use_filter = self._sync_parameters(
+                    first_sync, timeout, sync_filter, first_sync_filter, tuner
+                )
+
+                response = await self._sync_request(
+                    use_timeout, use_filter, since, full_state, receive=False
+                )
+
+                # Responses need to be handled in order, wait for the
+                # previous one before this one is handled.
+                if handling:
+                    await handling
+
+                handling = asyncio.ensure_future(
+                    self._handle_pipelined_sync(response)
+                )
+
+                # Failed syncs are retried with the same token.
+                if isinstance(response, SyncResponse):
+                    if tuner and not first_sync:
+                        tuner.update(response)
+
+                    since = response.next_batch
+                    first_sync = False
+                    full_state = None
+
+                if loop_sleep_time:
+                    await asyncio.sleep(loop_sleep_time / 1000)
+
+        except asyncio.CancelledError:
+            if handling:
+                handling.cancel()
+
     @logged_in
     @store_loaded
     async def start_key_verification(
@@ -1143,7 +1790,9 @@ class AsyncClient(Client):
             raise LocalProtocolError("No key upload needed.")
 
         assert self.olm
-        keys_dict = self.olm.share_keys()
+
+        async with self._sync_step_lock:
+            keys_dict = self.olm.share_keys()
 
         method, path, data = Api.keys_upload(self.access_token, keys_dict)
 
@@ -1238,6 +1887,47 @@ class AsyncClient(Client):
             JoinedMembersResponse, method, path, response_data=(room_id,)
         )
 
+    @logged_in
+    async def fetch_room_members(
+        self,
+        room_id: str,
+        user_ids: Iterable[str],
+        batch_size: int = 20,
+    ) -> List[str]:
+        """Fetch the members of a room that are missing due to lazy loading.
+
+        Only the members out of the given users that aren't known yet are
+        fetched, e.g. the senders of timeline events that should be displayed.
+        The member state events are requested concurrently, `batch_size` at a
+        time. Fetched members are added to the room and are evicted again
+        after the `lazy_member_ttl` config option.
+
+        Use `joined_members()` to load the full member list of a room.
+
+        Returns the ids of the users that were added to the room.
+
+        Args:
+            room_id (str): The room id of the room the users are members of.
+            user_ids (Iterable[str]): The ids of the users that are needed.
+            batch_size (int): How many members should be requested at once.
+        """
+        try:
+            room = self.rooms[room_id]
+        except KeyError:
+            raise LocalProtocolError(
+                "No such room with id {} found.".format(room_id)
+            )
+
+        missing = room.missing_members(user_ids)
+
+        for i in range(0, len(missing), batch_size):
+            await asyncio.gather(*(
+                self.room_get_state_event(room_id, "m.room.member", user_id)
+                for user_id in missing[i:i + batch_size]
+            ))
+
+        return [user_id for user_id in missing if user_id in room.users]
+
     @logged_in
     async def joined_rooms(
         self,
@@ -1633,7 +2323,16 @@ class AsyncClient(Client):
         )
 
     async def close(self):
-        """Close the underlying http session."""
+        """Close the underlying http session.
+
+        Callbacks that are still queued on the callback dispatcher are
+        dropped.
+        """
+        if self.callback_dispatcher:
+            await self.callback_dispatcher.close()
+
+        self._shutdown_decryption_executor()
+
         if self.client_session:
             await self.client_session.close()
             self.client_session = None
@@ -1696,11 +2395,11 @@ class AsyncClient(Client):
         import_keys = partial(self.olm.import_keys_static, infile, passphrase)
         sessions = await loop.run_in_executor(None, import_keys)
 
-        for session in sessions:
-            # This could be improved by writing everything to db at once at
-            # the end
-            if self.olm.inbound_group_store.add(session):
-                self.store.save_inbound_group_session(session)
+        new_sessions = [
+            session for session in sessions
+            if self.olm.inbound_group_store.add(session)
+        ]
+        self.store.save_inbound_group_sessions(new_sessions)
 
     @logged_in
     async def room_create(
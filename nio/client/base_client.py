@@ -14,6 +14,9 @@
 # CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import wraps
 from typing import (
     Any,
@@ -21,11 +24,13 @@ from typing import (
     Dict,
     List,
     Optional,
+    Sequence,
     Set,
     Tuple,
     Type,
     Union,
     Coroutine,
+    Iterator,
 )
 
 from dataclasses import dataclass, field
@@ -39,13 +44,27 @@ from ..events import (
     UnknownBadEvent,
     Event,
     MegolmEvent,
+    PowerLevelsEvent,
+    RoomAliasEvent,
+    RoomAvatarEvent,
+    RoomCreateEvent,
     RoomEncryptionEvent,
+    RoomGuestAccessEvent,
+    RoomHistoryVisibilityEvent,
+    RoomJoinRulesEvent,
     RoomMemberEvent,
+    RoomNameEvent,
+    RoomTopicEvent,
     ToDeviceEvent,
     RoomKeyRequest,
     RoomKeyRequestCancellation,
+    LazyEvent,
+    lazy_events,
+    parse_lazy_event,
+    parse_lazy_state_event,
 )
 from ..exceptions import LocalProtocolError, MembersSyncError
+from ..json_backend import JsonBackend, set_json_backend
 from ..log import logger_group
 from ..responses import (
     ErrorResponse,
@@ -61,14 +80,17 @@ from ..responses import (
     Response,
     RoomContextResponse,
     RoomForgetResponse,
+    RoomGetStateEventResponse,
     RoomKeyRequestResponse,
     RoomMessagesResponse,
     ShareGroupSessionResponse,
     SyncResponse,
     SyncType,
+    Timeline,
     ToDeviceResponse,
 )
-from ..rooms import MatrixInvitedRoom, MatrixRoom
+from ..rooms import MatrixInvitedRoom, MatrixRoom, TimelineCache
+from ..schemas import ValidationLevel, validation_level
 
 from ..crypto import DeviceStore, OlmDevice, OutgoingKeyRequest
 
@@ -90,6 +112,21 @@ except ImportError:
 logger = Logger("nio.client")
 logger_group.add_logger(logger)
 
+# The state events that change the persisted state of a room, member events
+# are tracked separately.
+ROOM_STATE_EVENTS = (
+    PowerLevelsEvent,
+    RoomAliasEvent,
+    RoomAvatarEvent,
+    RoomCreateEvent,
+    RoomEncryptionEvent,
+    RoomGuestAccessEvent,
+    RoomHistoryVisibilityEvent,
+    RoomJoinRulesEvent,
+    RoomNameEvent,
+    RoomTopicEvent,
+)
+
 
 def logged_in(func):
     @wraps(func)
@@ -121,6 +158,85 @@ class ClientCallback:
     filter: Union[Tuple[Type], Type, None] = None
 
 
+class CallbackIndex:
+    """Routing table from event classes to the callbacks that handle them.
+
+    The filters of all callbacks are checked once per event class, using
+    issubclass() so the whole MRO and virtual subclasses are taken into
+    account, and the matching callbacks are cached.
+
+    The cache belongs to a version of the callbacks. The add_*_callback()
+    methods of the client bump the version with invalidate(), code that
+    changes a callback list in place must call invalidate() as well. The
+    cache is also rebuilt if the callback list is replaced or its length
+    changes.
+
+    Attributes:
+        version (int): The version of the callbacks, bumped by invalidate().
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._cached_version = 0
+        self._callbacks: Optional[Sequence[ClientCallback]] = None
+        self._length = 0
+        self._routes: Dict[Type, List[ClientCallback]] = {}
+
+    def invalidate(self) -> None:
+        """Bump the version of the callbacks, dropping the cached routes."""
+        self.version += 1
+
+    def lookup(
+        self, callbacks: Sequence[ClientCallback], event: Any
+    ) -> List[ClientCallback]:
+        """Get the callbacks that should be run for an event.
+
+        Args:
+            callbacks (Sequence[ClientCallback]): All the registered
+                callbacks.
+            event (Any): The event, or response, the callbacks are for.
+
+        Lazy events that have callbacks are parsed before the callbacks are
+        looked up. An event that turns out to be invalid is only handed to the
+        callbacks for bad events, never to the ones for its event class.
+
+        Returns the matching callbacks in the order they were registered.
+        """
+        if (
+            self.version != self._cached_version
+            or callbacks is not self._callbacks
+            or len(callbacks) != self._length
+        ):
+            self._cached_version = self.version
+            self._callbacks = callbacks
+            self._length = len(callbacks)
+            self._routes.clear()
+
+        routes = self._lookup_class(callbacks, type(event))
+
+        if routes and isinstance(event, LazyEvent):
+            parse_lazy_event(event)
+            routes = self._lookup_class(callbacks, type(event))
+
+        return routes
+
+    def _lookup_class(
+        self, callbacks: Sequence[ClientCallback], event_class: Type
+    ) -> List[ClientCallback]:
+        try:
+            return self._routes[event_class]
+        except KeyError:
+            pass
+
+        routes = [
+            cb for cb in callbacks
+            if cb.filter is None or issubclass(event_class, cb.filter)
+        ]
+        self._routes[event_class] = routes
+
+        return routes
+
+
 @dataclass(frozen=True)
 class ClientConfig:
     """nio client configuration.
@@ -136,6 +252,62 @@ class ClientConfig:
             end to end encryption keys.
         store_sync_tokens (bool, optional): Should the client store and restore
             sync tokens.
+        validation_level (ValidationLevel, optional): How thoroughly received
+            events should be validated. Skipping validation speeds up sync
+            parsing, but should only be done if the homeserver is trusted.
+            Defaults to full validation.
+        lazy_events (bool, optional): Should room events in responses be
+            parsed lazily. Lazy events are only fully parsed and validated once
+            one of their content attributes is accessed, events that fail
+            validation at that point turn into a BadEvent. State events are
+            validated before the room state is updated. Defaults to False.
+        json_backend (JsonBackend, optional): The JSON backend that should be
+            used to encode requests and decode responses. The backend is
+            shared by all clients of the process. Defaults to None, which
+            keeps the backend that is currently selected, the standard
+            library unless set_json_backend() was called.
+        lazy_member_ttl (float, optional): How many seconds room members that
+            were fetched on demand, because they were missing due to member
+            lazy loading, are kept. Stale members are evicted after every
+            sync, members of encrypted rooms are always kept. Defaults to
+            None, keeping fetched members forever.
+        compact_members (bool, optional): Should the members of joined rooms
+            be stored in a compact `MemberTable`, which saves a lot of memory
+            for rooms with many members. Defaults to False.
+        store_room_state (bool, optional): Should the client store the state
+            of joined rooms, their members, power levels, name, topic,
+            encryption and summary, and restore the rooms when the store is
+            loaded. Together with store_sync_tokens this allows resuming with
+            an incremental sync that doesn't need to request the full room
+            state. Defaults to False.
+        timeline_max_events (int, optional): How many of the latest events of
+            every joined room should be kept in the `timeline` of the room.
+            The timelines are fed from sync responses. Room messages and room
+            context responses are only added if they overlap the buffered
+            events, or continue them backwards from the `prev_batch` token of
+            the timeline. Defaults to None, the timelines are only kept if
+            this or timeline_max_bytes is set.
+        timeline_max_bytes (int, optional): How many bytes of event sources
+            the timeline of a room may hold. Defaults to None.
+        timeline_max_total_events (int, optional): How many events the
+            timelines of all rooms may hold together. The timelines of the
+            rooms that were least recently updated are dropped once the limit
+            is exceeded. Defaults to None.
+        group_session_cache_size (int, optional): How many Megolm sessions
+            should be kept in memory. If set the sessions are loaded from the
+            store when they are first needed instead of loading all of them
+            when the store is loaded. Defaults to None.
+        session_cache_size (int, optional): For how many devices the Olm
+            sessions should be kept in memory. If set the sessions of a device
+            are loaded from the store when they are first needed instead of
+            loading all of them when the store is loaded. Defaults to None.
+        decryption_workers (int, optional): How many threads should decrypt
+            the Megolm events of a room timeline. If set the encrypted events
+            of a room are decrypted in one batch, grouped by their session,
+            before the timeline is handled. The AsyncClient waits for the
+            threads in the default executor of the event loop. The threads are
+            stopped when an AsyncClient is closed or a HttpClient disconnects.
+            Defaults to None.
 
     Raises an ImportWarning if encryption_enabled is true but the dependencies
     for encryption aren't installed.
@@ -150,6 +322,18 @@ class ClientConfig:
     store_name: str = ""
     pickle_key: str = "DEFAULT_KEY"
     store_sync_tokens: bool = False
+    validation_level: ValidationLevel = ValidationLevel.full
+    lazy_events: bool = False
+    json_backend: Optional[JsonBackend] = None
+    lazy_member_ttl: Optional[float] = None
+    compact_members: bool = False
+    store_room_state: bool = False
+    timeline_max_events: Optional[int] = None
+    timeline_max_bytes: Optional[int] = None
+    timeline_max_total_events: Optional[int] = None
+    group_session_cache_size: Optional[int] = None
+    session_cache_size: Optional[int] = None
+    decryption_workers: Optional[int] = None
 
     def __post_init__(self):
         if not ENCRYPTION_ENABLED and self.encryption_enabled:
@@ -175,6 +359,9 @@ class Client:
        invited_rooms (Dict[str, MatrixInvitedRoom)): A dictionary containing
            a mapping of room ids to MatrixInvitedRoom objects. All the rooms
            a user is invited to will be here after a sync.
+       filter_ids (Dict[str, str]): A mapping of filter hashes to the ids of
+           filters that were uploaded to the server. The ids are persisted in
+           the store if one is loaded.
 
     Args:
        user (str): User that will be used to log in.
@@ -201,6 +388,9 @@ class Client:
         self.store: Optional[MatrixStore] = None
         self.config = config or ClientConfig()
 
+        if self.config.json_backend:
+            set_json_backend(self.config.json_backend)
+
         self.user_id = ""
         # TODO Turn this into a optional string.
         self.access_token = ""  # type: str
@@ -210,11 +400,31 @@ class Client:
         self.rooms: Dict[str, MatrixRoom] = dict()
         self.invited_rooms: Dict[str, MatrixInvitedRoom] = dict()
         self.encrypted_rooms: Set[str] = set()
+        self.filter_ids: Dict[str, str] = dict()
+        # Room ids mapped to the ids of their members that changed since the
+        # room state was last stored, None if all members need to be stored.
+        self._room_state_changes: Dict[str, Optional[Set[str]]] = dict()
+        self._timeline_cache: Optional[TimelineCache] = None
+        self._decryption_executor: Optional[ThreadPoolExecutor] = None
+
+        if (
+            self.config.timeline_max_events is not None
+            or self.config.timeline_max_bytes is not None
+        ):
+            self._timeline_cache = TimelineCache(
+                self.config.timeline_max_events,
+                self.config.timeline_max_bytes,
+                self.config.timeline_max_total_events,
+            )
 
         self.event_callbacks: List[ClientCallback] = []
         self.ephemeral_callbacks: List[ClientCallback] = []
         self.to_device_callbacks: List[ClientCallback] = []
 
+        self._event_callback_index = CallbackIndex()
+        self._ephemeral_callback_index = CallbackIndex()
+        self._to_device_callback_index = CallbackIndex()
+
     @property
     def logged_in(self) -> bool:
         """Check if we are logged in.
@@ -311,6 +521,14 @@ class Client:
         """To-device messages that we need to send out."""
         return self.olm.outgoing_to_device_messages if self.olm else []
 
+    @contextmanager
+    def _parse_options(self):
+        # type: () -> Iterator[None]
+        """Apply the event parsing options of the client config."""
+        with validation_level(self.config.validation_level):
+            with lazy_events(self.config.lazy_events):
+                yield
+
     def get_active_sas(self, user_id, device_id):
         # type (str, str) -> Optional[Sas]
         """Find a non-canceled SAS verification object for the provided user.
@@ -361,12 +579,25 @@ class Client:
             )
             assert self.store
 
-            self.olm = Olm(self.user_id, self.device_id, self.store)
+            self.olm = Olm(
+                self.user_id,
+                self.device_id,
+                self.store,
+                self.config.group_session_cache_size,
+                self.config.session_cache_size,
+            )
             self.encrypted_rooms = self.store.load_encrypted_rooms()
+            self.filter_ids.update(self.store.load_filter_ids())
 
             if self.config.store_sync_tokens:
                 self.loaded_sync_token = self.store.load_sync_token()
 
+            if self.config.store_room_state:
+                rooms = self.store.load_rooms(self.config.compact_members)
+
+                for room_id, room in rooms.items():
+                    self.rooms.setdefault(room_id, room)
+
     def room_contains_unverified(self, room_id: str) -> bool:
         """Check if a room contains unverified devices.
 
@@ -619,9 +850,10 @@ class Client:
             response.to_device_events[index] = event
 
     def _run_to_device_callbacks(self, event: ToDeviceEvent):
-        for cb in self.to_device_callbacks:
-            if cb.filter is None or isinstance(event, cb.filter):
-                cb.func(event)
+        for cb in self._to_device_callback_index.lookup(
+            self.to_device_callbacks, event
+        ):
+            cb.func(event)
 
     def _handle_to_device(self, response: SyncType):
         decrypted_to_device = []
@@ -643,6 +875,9 @@ class Client:
 
             self._run_to_device_callbacks(to_device_event)
 
+        if self.olm:
+            self.olm.flush_sessions()
+
         self._replace_decrypted_to_device(decrypted_to_device, response)
 
     def _get_invited_room(self, room_id: str) -> MatrixInvitedRoom:
@@ -659,11 +894,13 @@ class Client:
             room = self._get_invited_room(room_id)
 
             for event in info.invite_state:
+                parse_lazy_state_event(event)
                 room.handle_event(event)
 
-                for cb in self.event_callbacks:
-                    if cb.filter is None or isinstance(event, cb.filter):
-                        cb.func(room, event)
+                for cb in self._event_callback_index.lookup(
+                    self.event_callbacks, event
+                ):
+                    cb.func(room, event)
 
     def _handle_joined_state(
         self, room_id: str, join_info: RoomInfo, encrypted_rooms: Set[str]
@@ -674,12 +911,21 @@ class Client:
         if room_id not in self.rooms:
             logger.info("New joined room {}".format(room_id))
             self.rooms[room_id] = MatrixRoom(
-                room_id, self.user_id, room_id in self.encrypted_rooms
+                room_id,
+                self.user_id,
+                room_id in self.encrypted_rooms,
+                self.config.compact_members,
             )
+            self._mark_room_state_changed(room_id, None)
+
+        elif self.config.store_room_state:
+            self._track_room_state(room_id, join_info)
 
         room = self.rooms[room_id]
 
         for event in join_info.state:
+            parse_lazy_state_event(event)
+
             if isinstance(event, RoomEncryptionEvent):
                 encrypted_rooms.add(room_id)
 
@@ -692,16 +938,90 @@ class Client:
         if join_info.summary:
             room.update_summary(join_info.summary)
 
+    def _mark_room_state_changed(
+        self, room_id: str, members: Optional[Set[str]] = None
+    ):
+        """Remember that the state of a room needs to be stored.
+
+        Args:
+            room_id (str): The id of the room that changed.
+            members (Set[str], optional): The ids of the members that changed,
+                None if all the members of the room should be stored.
+        """
+        if not self.config.store_room_state:
+            return
+
+        if members is None:
+            self._room_state_changes[room_id] = None
+            return
+
+        changed = self._room_state_changes.get(room_id, set())
+
+        if changed is not None:
+            changed.update(members)
+            self._room_state_changes[room_id] = changed
+
+    def _track_room_state(self, room_id: str, join_info: RoomInfo):
+        members = set()
+        changed = bool(join_info.summary)
+
+        for events in (join_info.state, join_info.timeline.events):
+            for event in events:
+                if isinstance(event, RoomMemberEvent):
+                    members.add(event.state_key)
+                elif isinstance(event, ROOM_STATE_EVENTS):
+                    changed = True
+
+        if changed or members:
+            self._mark_room_state_changed(room_id, members)
+
+    def _save_room_state(self):
+        if not self._room_state_changes:
+            return
+
+        changes = self._room_state_changes
+        self._room_state_changes = dict()
+
+        if not self.store:
+            return
+
+        rooms = [self.rooms[r] for r in changes if r in self.rooms]
+        changed_members = {
+            room_id: members for room_id, members in changes.items()
+            if members is not None
+        }  # type: Dict[str, Set[str]]
+
+        self.store.save_rooms(rooms, changed_members)
+
+    def _cache_timeline(self, room: MatrixRoom, timeline: Timeline):
+        if self._timeline_cache is not None:
+            self._timeline_cache.add_events(
+                room, timeline.events, timeline.limited, timeline.prev_batch
+            )
+
+    def _cache_history(
+        self,
+        room: MatrixRoom,
+        events: List[Union[Event, BadEventType]],
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+    ):
+        if self._timeline_cache is not None:
+            self._timeline_cache.add_history(room, events, start, end)
+
     def _handle_timeline_event(
         self,
         event: Union[Event, BadEventType],
         room_id: str,
         room: MatrixRoom,
         encrypted_rooms: Set[str],
+        decrypt: bool = True,
     ) -> Optional[Union[Event, BadEventType]]:
         decrypted_event = None
 
-        if isinstance(event, MegolmEvent) and self.olm:
+        parse_lazy_state_event(event)
+
+        if isinstance(event, MegolmEvent) and self.olm and decrypt:
             event.room_id = room_id
             decrypted_event = self.olm._decrypt_megolm_no_error(event)
 
@@ -723,6 +1043,48 @@ class Client:
 
         return decrypted_event
 
+    def _get_decryption_executor(self) -> Optional[ThreadPoolExecutor]:
+        """Get the thread pool that decrypts the timelines of rooms.
+
+        The pool is created when it's first needed. Returns None if the
+        client isn't configured to use decryption workers.
+        """
+        if self.config.decryption_workers and not self._decryption_executor:
+            self._decryption_executor = ThreadPoolExecutor(
+                self.config.decryption_workers
+            )
+
+        return self._decryption_executor
+
+    def _shutdown_decryption_executor(self) -> None:
+        """Stop the threads of the decryption thread pool.
+
+        A new pool is created if a timeline needs to be decrypted again.
+        """
+        if self._decryption_executor:
+            self._decryption_executor.shutdown(wait=False)
+            self._decryption_executor = None
+
+    def _decrypt_timeline(
+        self, room_id: str, events: List[Union[Event, BadEventType]]
+    ) -> List[Optional[Union[Event, BadEventType]]]:
+        assert self.olm
+        megolm_events = []
+
+        for event in events:
+            if isinstance(event, MegolmEvent):
+                event.room_id = room_id
+                megolm_events.append(event)
+
+        decrypted = iter(self.olm.decrypt_megolm_events(
+            megolm_events, room_id, self._get_decryption_executor()
+        ))
+
+        return [
+            next(decrypted) if isinstance(event, MegolmEvent) else None
+            for event in events
+        ]
+
     def _handle_joined_rooms(self, response: SyncType):
         encrypted_rooms: Set[str] = set()
 
@@ -731,30 +1093,52 @@ class Client:
 
             room = self.rooms[room_id]
             decrypted_events: List[Tuple[int, Union[Event, BadEventType]]] = []
+            predecrypted: Optional[
+                List[Optional[Union[Event, BadEventType]]]
+            ] = None
 
-            for index, event in enumerate(join_info.timeline.events):
-                decrypted_event = self._handle_timeline_event(
-                    event, room_id, room, encrypted_rooms
+            if self.config.decryption_workers and self.olm:
+                predecrypted = self._decrypt_timeline(
+                    room_id, join_info.timeline.events
                 )
 
+            for index, event in enumerate(join_info.timeline.events):
+                if predecrypted is None:
+                    decrypted_event = self._handle_timeline_event(
+                        event, room_id, room, encrypted_rooms
+                    )
+                else:
+                    decrypted_event = predecrypted[index]
+                    self._handle_timeline_event(
+                        decrypted_event or event,
+                        room_id,
+                        room,
+                        encrypted_rooms,
+                        decrypt=False,
+                    )
+
                 if decrypted_event:
                     event = decrypted_event
                     decrypted_events.append((index, decrypted_event))
 
-                for cb in self.event_callbacks:
-                    if cb.filter is None or isinstance(event, cb.filter):
-                        cb.func(room, event)
+                for cb in self._event_callback_index.lookup(
+                    self.event_callbacks, event
+                ):
+                    cb.func(room, event)
 
             # Replace the Megolm events with decrypted ones
             for index, event in decrypted_events:
                 join_info.timeline.events[index] = event
 
+            self._cache_timeline(room, join_info.timeline)
+
             for event in join_info.ephemeral:
                 room.handle_ephemeral_event(event)
 
-                for cb in self.ephemeral_callbacks:
-                    if cb.filter is None or isinstance(event, cb.filter):
-                        cb.func(room, event)
+                for cb in self._ephemeral_callback_index.lookup(
+                    self.ephemeral_callbacks, event
+                ):
+                    cb.func(room, event)
 
             if room.encrypted and self.olm is not None:
                 self.olm.update_tracked_users(room)
@@ -768,9 +1152,7 @@ class Client:
         expired_verifications = self.olm.clear_verifications()
 
         for event in expired_verifications:
-            for cb in self.to_device_callbacks:
-                if cb.filter is None or isinstance(event, cb.filter):
-                    cb.func(event)
+            self._run_to_device_callbacks(event)
 
     def _handle_olm_events(self, response: SyncType):
         assert self.olm
@@ -808,15 +1190,26 @@ class Client:
         if isinstance(response, SyncResponse):
             self.next_batch = response.next_batch
 
-            if self.config.store_sync_tokens and self.store:
-                self.store.save_sync_token(self.next_batch)
-
         self._handle_to_device(response)
 
         self._handle_invited_rooms(response)
 
         self._handle_joined_rooms(response)
 
+        self._evict_lazy_members()
+
+        self._save_room_state()
+
+        # The sync token is only stored once the sessions and the room state
+        # this response changed are stored. If the process dies before that,
+        # the response is requested and handled again.
+        if (
+            isinstance(response, SyncResponse)
+            and self.config.store_sync_tokens
+            and self.store
+        ):
+            self.store.save_sync_token(response.next_batch)
+
         if self.olm:
             self._handle_expired_verifications()
             self._handle_olm_events(response)
@@ -824,6 +1217,20 @@ class Client:
 
         return None
 
+    def _evict_lazy_members(self):
+        if self.config.lazy_member_ttl is None:
+            return
+
+        now = time.time()
+
+        for room in self.rooms.values():
+            evicted = room.evict_lazy_members(
+                self.config.lazy_member_ttl, now
+            )
+
+            if evicted:
+                self._mark_room_state_changed(room.room_id, set(evicted))
+
     def _collect_key_requests(self):
         events = self.olm.collect_key_requests()
         for event in events:
@@ -856,6 +1263,17 @@ class Client:
         self._decrypt_event_array(response.events_after)
         self._decrypt_event_array(response.events_before)
 
+        room = self.rooms.get(response.room_id)
+
+        if room:
+            events = response.events_before + response.events_after
+
+            # The event is None if it couldn't be decrypted.
+            if response.event:
+                events.append(response.event)
+
+            self._cache_history(room, events)
+
     def _handle_messages_response(self, response: RoomMessagesResponse):
         decrypted_events = []
 
@@ -868,6 +1286,13 @@ class Client:
         for index, event in decrypted_events:
             response.chunk[index] = event
 
+        room = self.rooms.get(response.room_id)
+
+        if room:
+            self._cache_history(
+                room, response.chunk, response.start, response.end
+            )
+
     def _handle_olm_response(
         self,
         response: Union[
@@ -927,9 +1352,35 @@ class Client:
                 member.user_id, member.display_name, member.avatar_url
             )
 
+        self._mark_room_state_changed(
+            room.room_id, {member.user_id for member in response.members}
+        )
+
         if room.encrypted and self.olm is not None:
             self.olm.update_tracked_users(room)
 
+    def _handle_member_state(self, response: RoomGetStateEventResponse):
+        if response.event_type != "m.room.member":
+            return
+
+        room = self.rooms.get(response.room_id)
+
+        if not room:
+            return
+
+        membership = response.content.get("membership")
+
+        if membership not in ("join", "invite"):
+            return
+
+        room.add_lazy_member(
+            response.state_key,
+            response.content.get("displayname"),
+            response.content.get("avatar_url"),
+            membership == "invite",
+        )
+        self._mark_room_state_changed(room.room_id, {response.state_key})
+
     def _handle_room_forget_response(self, response: RoomForgetResponse):
         self.encrypted_rooms.discard(response.room_id)
 
@@ -939,6 +1390,14 @@ class Client:
             if room.encrypted and self.store:
                 self.store.delete_encrypted_room(room.room_id)
 
+            self._room_state_changes.pop(room.room_id, None)
+
+            if self._timeline_cache is not None:
+                self._timeline_cache.drop(room.room_id)
+
+            if self.config.store_room_state and self.store:
+                self.store.delete_room(room.room_id)
+
         elif response.room_id in self.invited_rooms:
             del self.invited_rooms[response.room_id]
 
@@ -979,6 +1438,8 @@ class Client:
             self._handle_olm_response(response)
         elif isinstance(response, JoinedMembersResponse):
             self._handle_joined_members(response)
+        elif isinstance(response, RoomGetStateEventResponse):
+            self._handle_member_state(response)
         elif isinstance(response, RoomKeyRequestResponse):
             self._handle_olm_response(response)
         elif isinstance(response, RoomForgetResponse):
@@ -1143,6 +1604,7 @@ class Client:
         """
         cb = ClientCallback(callback, filter)
         self.event_callbacks.append(cb)
+        self._event_callback_index.invalidate()
 
     def add_ephemeral_callback(
         self,
@@ -1161,6 +1623,7 @@ class Client:
         """
         cb = ClientCallback(callback, filter)
         self.ephemeral_callbacks.append(cb)
+        self._ephemeral_callback_index.invalidate()
 
     def add_to_device_callback(
         self,
@@ -1180,6 +1643,7 @@ class Client:
         """
         cb = ClientCallback(callback, filter)
         self.to_device_callbacks.append(cb)
+        self._to_device_callback_index.invalidate()
 
     @store_loaded
     def create_key_verification(self, device: OlmDevice) -> ToDeviceMessage:
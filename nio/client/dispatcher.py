@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018-2019 Damir Jelić <poljar@termina.org.uk>
+#
+# Permission to use, copy, modify, and/or distribute this software for
+# any purpose with or without fee is hereby granted, provided that the
+# above copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER
+# RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF
+# CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""nio callback dispatcher.
+
+The AsyncClient awaits its callbacks one after the other by default, a slow
+callback holds up the handling of all following events and the next sync.
+The dispatcher runs callbacks on a bounded number of worker tasks instead.
+
+Callbacks are dispatched with an ordering key, callbacks that share a key run
+one after the other in the order they were dispatched while callbacks with
+different keys run concurrently. The client uses the room id as the key for
+room events, so events of a room are handled in order while different rooms
+are handled in parallel.
+
+"""
+
+import asyncio
+import inspect
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from logbook import Logger
+
+from ..log import logger_group
+
+logger = Logger("nio.client.dispatcher")
+logger_group.add_logger(logger)
+
+_Job = Tuple[Callable, Tuple[Any, ...]]
+
+
+class CallbackDispatcher:
+    """Run callbacks concurrently on a bounded pool of worker tasks.
+
+    Args:
+        max_workers (int): How many callbacks may run at the same time.
+        max_queued (int): How many callbacks may be queued, or running, before
+            dispatch() waits for a free slot. This is what creates
+            backpressure, the client doesn't continue handling a sync response
+            until its callbacks fit into the queue.
+
+    Exceptions raised by callbacks are logged, they can't be propagated to
+    the code that dispatched the callback.
+
+    """
+
+    def __init__(self, max_workers=8, max_queued=1000):
+        # type: (int, int) -> None
+        if max_workers < 1 or max_queued < 1:
+            raise ValueError(
+                "The dispatcher needs at least one worker and queue slot"
+            )
+
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+
+        self._pending = {}  # type: Dict[Hashable, Deque[_Job]]
+        self._ready = None  # type: Optional[asyncio.Queue]
+        self._slots = None  # type: Optional[asyncio.Semaphore]
+        self._idle = None   # type: Optional[asyncio.Event]
+        self._workers = []  # type: List[asyncio.Future]
+        self._queued = 0
+
+    @property
+    def queued(self):
+        # type: () -> int
+        """The number of callbacks that are queued or running."""
+        return self._queued
+
+    def _start(self):
+        # type: () -> None
+        self._ready = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_queued)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers = [
+            asyncio.ensure_future(self._work())
+            for _ in range(self.max_workers)
+        ]
+
+    async def dispatch(self, key, func, *args):
+        # type: (Optional[Hashable], Callable, Any) -> None
+        """Queue a callback.
+
+        Waits until there is a free slot in the queue, the callback itself
+        runs later on one of the workers.
+
+        Args:
+            key (Hashable, optional): The ordering key of the callback.
+                Callbacks with the same key run one after the other, None
+                means that the callback doesn't need to be ordered.
+            func (Callable): The callback, a coroutine function or a plain
+                function.
+            *args: The arguments for the callback.
+
+        """
+        if not self._workers:
+            self._start()
+
+        assert self._slots and self._ready and self._idle
+
+        await self._slots.acquire()
+
+        self._queued += 1
+        self._idle.clear()
+
+        job = (func, args)
+
+        if key is None:
+            self._ready.put_nowait((None, job))
+            return
+
+        pending = self._pending.get(key)
+
+        if pending is not None:
+            # A worker is busy with this key, it picks the job up once the
+            # jobs queued before it are done.
+            pending.append(job)
+            return
+
+        self._pending[key] = deque()
+        self._ready.put_nowait((key, job))
+
+    async def _run(self, job):
+        # type: (_Job) -> None
+        func, args = job
+
+        try:
+            result = func(*args)
+
+            if inspect.isawaitable(result):
+                await result
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error running callback {}".format(func))
+
+    async def _work(self):
+        # type: () -> None
+        assert self._ready and self._slots and self._idle
+
+        while True:
+            key, job = await self._ready.get()
+
+            while True:
+                await self._run(job)
+
+                self._queued -= 1
+                self._slots.release()
+
+                if key is None:
+                    break
+
+                pending = self._pending[key]
+
+                if not pending:
+                    del self._pending[key]
+                    break
+
+                job = pending.popleft()
+
+            if not self._queued:
+                self._idle.set()
+
+    async def join(self):
+        # type: () -> None
+        """Wait until all queued callbacks ran."""
+        if self._idle:
+            await self._idle.wait()
+
+    async def close(self):
+        # type: () -> None
+        """Stop the workers, callbacks that didn't run yet are dropped."""
+        for worker in self._workers:
+            worker.cancel()
+
+        if self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
+
+        self._workers = []
+        self._pending = {}
+        self._queued = 0
+
+        if self._idle:
+            self._idle.set()
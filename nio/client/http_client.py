@@ -15,7 +15,6 @@
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 import cgi
-import json
 import pprint
 from builtins import str, super
 from collections import deque
@@ -43,6 +42,7 @@ from ..events import MegolmEvent
 from ..exceptions import LocalProtocolError, RemoteTransportError
 from ..http import (Http2Connection, Http2Request, HttpConnection, HttpRequest,
                     TransportRequest, TransportResponse, TransportType)
+from .. import json_backend
 from ..log import logger_group
 from ..responses import (DeleteDevicesAuthResponse, DeleteDevicesResponse,
                          DownloadResponse, DevicesResponse, FileResponse,
@@ -219,6 +219,7 @@ class HttpClient(Client):
 
         data = self.connection.disconnect()
         self._clear_queues()
+        self._shutdown_decryption_executor()
         self.connection = None
         return data
 
@@ -1217,7 +1218,7 @@ class HttpClient(Client):
         Returns a dictionary representing the response.
         """
         try:
-            return json.loads(transport_response.text)
+            return json_backend.loads(transport_response.content)
         except JSONDecodeError:
             return {}
 
@@ -1261,7 +1262,8 @@ class HttpClient(Client):
                     and request_class == DeleteDevicesResponse):
                 response = DeleteDevicesAuthResponse.from_dict(parsed_dict)
 
-            response = request_class.from_dict(parsed_dict, *extra_data)
+            with self._parse_options():
+                response = request_class.from_dict(parsed_dict, *extra_data)
 
         assert response
 
@@ -1326,7 +1328,8 @@ class HttpClient(Client):
             return None
 
         if self.partial_sync:
-            sync_response = self.partial_sync.next_part(max_events)
+            with self._parse_options():
+                sync_response = self.partial_sync.next_part(max_events)
             self.receive_response(sync_response)
 
             if isinstance(sync_response, PartialSyncResponse):
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018-2019 Damir Jelić <poljar@termina.org.uk>
+#
+# Permission to use, copy, modify, and/or distribute this software for
+# any purpose with or without fee is hereby granted, provided that the
+# above copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER
+# RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF
+# CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""nio sync tuner.
+
+A long-polling sync returns as soon as the server has new events for the
+client, or once the timeout runs out. Idle accounts mostly receive empty
+responses, every one of them is a wasted round trip, while busy accounts
+rarely run into the timeout at all.
+
+The tuner watches the sync responses that `AsyncClient.sync_forever()`
+receives and picks the timeout and filter of the next sync. The timeout grows
+while syncs come back empty. It isn't lowered again once there is traffic, a
+sync returns as soon as there are events, so a shorter timeout wouldn't
+deliver them any sooner. An optional light filter is used while the account
+is idle, the full filter as soon as there is activity again.
+
+"""
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+from logbook import Logger
+
+from ..api import _FilterT
+from ..log import logger_group
+from ..responses import SyncResponse
+
+logger = Logger("nio.client.sync_tuner")
+logger_group.add_logger(logger)
+
+
+@dataclass
+class SyncMetrics:
+    """Statistics about the observed syncs and the decisions of a SyncTuner.
+
+    Attributes:
+        syncs (int): The number of sync responses that were observed.
+        idle_syncs (int): The number of consecutive syncs without activity.
+        events (int): The number of events the last sync contained, timeline
+            events, invites and to-device events are counted.
+        timeout (int): The timeout in milliseconds picked for the next sync.
+        light_filter (bool): Whether the next sync uses the light filter.
+        timeout_changes (int): How often the timeout was changed.
+        filter_switches (int): How often the tuner switched between the light
+            and the full filter.
+    """
+
+    syncs: int = 0
+    idle_syncs: int = 0
+    events: int = 0
+    timeout: int = 0
+    light_filter: bool = False
+    timeout_changes: int = 0
+    filter_switches: int = 0
+
+
+@dataclass
+class SyncTuner:
+    """Adapt the sync timeout and filter of sync_forever() to the traffic.
+
+    A tuner can be passed to `AsyncClient.sync_forever()`, which then asks it
+    for the timeout and filter of every sync and reports every sync response
+    back to it.
+
+    Args:
+        min_timeout (int): The smallest timeout in milliseconds, the
+            timeout of the first sync isn't allowed to be lower.
+        max_timeout (int): The largest timeout in milliseconds, the timeout
+            grows up to it while syncs come back empty.
+        light_filter (str, Dict, optional): A filter, or filter id, that is
+            used while the account is idle, e.g. one that leaves out presence
+            and ephemeral events. It should still let timeline events through,
+            otherwise the tuner can't notice that the account became active.
+            If None, the filter given to sync_forever() is always used.
+        idle_threshold (int): After how many consecutive syncs without
+            activity the light filter is used.
+
+    Attributes:
+        metrics (SyncMetrics): The statistics and decisions of the tuner.
+
+    """
+
+    min_timeout: int = 10000
+    max_timeout: int = 60000
+    light_filter: _FilterT = None
+    idle_threshold: int = 3
+    metrics: SyncMetrics = field(default_factory=SyncMetrics, init=False)
+
+    def __post_init__(self):
+        if not 0 < self.min_timeout <= self.max_timeout:
+            raise ValueError("Invalid sync timeout bounds")
+
+    def timeout(self, default: Optional[int] = None) -> int:
+        """Get the timeout for the next sync.
+
+        Args:
+            default (int, optional): The timeout that is used, clamped to the
+                bounds of the tuner, before the first sync was observed.
+        """
+        if not self.metrics.timeout:
+            timeout = self.max_timeout if default is None else default
+            self.metrics.timeout = min(
+                max(timeout, self.min_timeout), self.max_timeout
+            )
+
+        return self.metrics.timeout
+
+    def sync_filter(self, full_filter: _FilterT) -> _FilterT:
+        """Get the filter for the next sync.
+
+        Args:
+            full_filter (str, Dict, optional): The filter that is used while
+                the account is active.
+        """
+        if self.metrics.light_filter:
+            return self.light_filter
+
+        return full_filter
+
+    @staticmethod
+    def count_events(response: SyncResponse) -> int:
+        """Count the events of a sync response that show activity.
+
+        Presence, ephemeral and account data events aren't counted, those
+        arrive for idle accounts as well.
+        """
+        rooms = response.rooms
+        events = len(rooms.invite) + len(response.to_device_events)
+
+        for info in rooms.join.values():
+            events += len(info.timeline.events)
+
+        for info in rooms.leave.values():
+            events += len(info.timeline.events)
+
+        return events
+
+    def update(self, response: SyncResponse) -> None:
+        """Take a sync response into account for the next decisions.
+
+        Args:
+            response (SyncResponse): The sync response that was received.
+        """
+        metrics = self.metrics
+
+        events = self.count_events(response)
+
+        metrics.syncs += 1
+        metrics.events = events
+
+        timeout = self.timeout()
+
+        if events:
+            metrics.idle_syncs = 0
+        else:
+            metrics.idle_syncs += 1
+            timeout = min(timeout * 2, self.max_timeout)
+
+        if timeout != metrics.timeout:
+            logger.debug(
+                "Changing the sync timeout from {} to {} ms after {} idle "
+                "syncs".format(metrics.timeout, timeout, metrics.idle_syncs)
+            )
+            metrics.timeout = timeout
+            metrics.timeout_changes += 1
+
+        use_light_filter = (
+            self.light_filter is not None
+            and metrics.idle_syncs >= self.idle_threshold
+        )
+
+        if use_light_filter != metrics.light_filter:
+            logger.debug(
+                "Switching to the {} sync filter after {} idle syncs".format(
+                    "light" if use_light_filter else "full",
+                    metrics.idle_syncs,
+                )
+            )
+            metrics.light_filter = use_light_filter
+            metrics.filter_switches += 1
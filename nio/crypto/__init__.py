@@ -34,6 +34,8 @@ if package_installed("olm"):
     from .memorystores import (
         SessionStore,
         GroupSessionStore,
+        LazyGroupSessionStore,
+        LazySessionStore,
     )
 
     from .log import logger
@@ -15,20 +15,49 @@
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 from collections import defaultdict
-from typing import DefaultDict, Dict, Iterator, List, Optional, KeysView
+from typing import (Any, DefaultDict, Dict, Iterator, List, Optional,
+                    KeysView, MutableMapping, Tuple)
+
+from cachetools import LRUCache
+
 from .sessions import InboundGroupSession, Session
 
 
+def _insort(sessions: List[Session], session: Session) -> None:
+    """Insert a session keeping the list ordered by the use time.
+
+    The most recently used session comes first. Using a session updates its
+    use time, if the list isn't ordered anymore it is sorted again.
+    """
+    if any(
+        a.use_time < b.use_time for a, b in zip(sessions, sessions[1:])
+    ):
+        sessions.sort(key=lambda x: x.use_time, reverse=True)
+
+    low, high = 0, len(sessions)
+
+    while low < high:
+        middle = (low + high) // 2
+
+        if sessions[middle].use_time >= session.use_time:
+            low = middle + 1
+        else:
+            high = middle
+
+    sessions.insert(low, session)
+
+
 class SessionStore:
     def __init__(self):
-        self._entries: DefaultDict[str, List[Session]] = defaultdict(list)
+        self._entries: MutableMapping[str, List[Session]] = defaultdict(list)
 
     def add(self, sender_key: str, session: Session) -> bool:
-        if session in self._entries[sender_key]:
+        sessions = self._entries[sender_key]
+
+        if session in sessions:
             return False
 
-        self._entries[sender_key].append(session)
-        self._entries[sender_key].sort(key=lambda x: x.use_time, reverse=True)
+        _insort(sessions, session)
         return True
 
     def __iter__(self) -> Iterator[Session]:
@@ -52,6 +81,80 @@ class SessionStore:
         return self._entries[sender_key]
 
 
+class LazySessionStore(SessionStore):
+    """A SessionStore that loads sessions from the database on demand.
+
+    The sessions of a curve25519 key are loaded from the database the first
+    time the key is accessed and kept in a least recently used cache, so only
+    the sessions of a bounded number of keys are held in memory. Iterating
+    over the store only covers the cached sessions.
+
+    Args:
+        database (MatrixStore): The store the sessions are loaded from.
+        max_keys (int): For how many curve25519 keys the sessions are kept in
+            memory.
+        unsaved (Dict[str, Tuple[str, Session]], optional): Sessions that
+            weren't saved to the database yet, keyed by session id, with the
+            curve25519 key that owns them. These replace the stored copies
+            when the sessions of a key are loaded, so changes to sessions that
+            were evicted before they were saved aren't lost.
+    """
+
+    def __init__(
+        self,
+        database: Any,
+        max_keys: int = 1000,
+        unsaved: Optional[Dict[str, Tuple[str, Session]]] = None,
+    ):
+        self._database = database
+        self._unsaved = unsaved if unsaved is not None else {}
+        self._entries = LRUCache(maxsize=max_keys)
+
+    def _load(self, sender_key: str) -> List[Session]:
+        sessions = self._entries.get(sender_key)
+
+        if sessions is not None:
+            return sessions
+
+        loaded = {
+            session.id: session
+            for session in self._database.load_sessions_for_key(sender_key)
+        }
+
+        for curve_key, session in list(self._unsaved.values()):
+            if curve_key == sender_key:
+                loaded[session.id] = session
+
+        sessions = sorted(
+            loaded.values(), key=lambda x: x.use_time, reverse=True
+        )
+        self._entries[sender_key] = sessions
+        return sessions
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, sender_key: str, session: Session) -> bool:
+        sessions = self._load(sender_key)
+
+        if any(s.id == session.id for s in sessions):
+            return False
+
+        _insort(sessions, session)
+        return True
+
+    def get(self, sender_key: str) -> Optional[Session]:
+        sessions = self._load(sender_key)
+
+        if sessions:
+            return sessions[0]
+
+        return None
+
+    def __getitem__(self, sender_key: str) -> List[Session]:
+        return self._load(sender_key)
+
+
 class GroupSessionStore:
     def __init__(self):
         self._entries = defaultdict(lambda: defaultdict(dict))
@@ -79,3 +182,102 @@ class GroupSessionStore:
 
     def __getitem__(self, room_id: str) -> DefaultDict[str, Dict[str, InboundGroupSession]]:
         return self._entries[room_id]
+
+
+class LazyGroupSessionStore(GroupSessionStore):
+    """A GroupSessionStore that loads sessions from the database on demand.
+
+    Sessions are loaded from the database the first time they are requested
+    and kept in a least recently used cache, so only a bounded number of
+    sessions is held in memory. Iterating over the store or indexing it by a
+    room id only covers the cached sessions.
+
+    Args:
+        database (MatrixStore): The store the sessions are loaded from.
+        max_sessions (int): How many sessions are kept in memory.
+        unsaved (Dict[str, InboundGroupSession], optional): Sessions that
+            weren't saved to the database yet, keyed by session id. These are
+            looked up before the database, so sessions that were evicted
+            before they were saved can still be found.
+    """
+
+    def __init__(
+        self,
+        database: Any,
+        max_sessions: int = 1000,
+        unsaved: Optional[Dict[str, InboundGroupSession]] = None,
+    ):
+        self._database = database
+        self._unsaved = unsaved if unsaved is not None else {}
+        self._cache: LRUCache[Tuple[str, str, str], InboundGroupSession] = (
+            LRUCache(maxsize=max_sessions)
+        )
+        # Sessions that we know aren't in the database, many undecryptable
+        # events may need the same missing session.
+        self._missing: LRUCache[Tuple[str, str, str], bool] = LRUCache(
+            maxsize=max_sessions
+        )
+
+    def __iter__(self) -> Iterator[InboundGroupSession]:
+        return iter(list(self._cache.values()))
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def add(self, session: InboundGroupSession) -> bool:
+        key = (session.room_id, session.sender_key, session.id)
+
+        if self._cache.get(key) is session:
+            return False
+
+        self._missing.pop(key, None)
+        self._cache[key] = session
+        return True
+
+    def get(
+        self, room_id: str, sender_key: str, session_id: str
+    ) -> Optional[InboundGroupSession]:
+        key = (room_id, sender_key, session_id)
+        session = self._cache.get(key)
+
+        if session:
+            return session
+
+        session = self._unsaved.get(session_id)
+
+        if (
+            session
+            and session.room_id == room_id
+            and session.sender_key == sender_key
+        ):
+            self._cache[key] = session
+            return session
+
+        if self._missing.get(key):
+            return None
+
+        session = self._database.load_inbound_group_session(
+            room_id, sender_key, session_id
+        )
+
+        if not session:
+            self._missing[key] = True
+            return None
+
+        self._cache[key] = session
+        return session
+
+    def __getitem__(
+        self, room_id: str
+    ) -> DefaultDict[str, Dict[str, InboundGroupSession]]:
+        sessions: DefaultDict[str, Dict[str, InboundGroupSession]] = (
+            defaultdict(dict)
+        )
+
+        for key, session in list(self._cache.items()):
+            session_room, sender_key, session_id = key
+
+            if session_room == room_id:
+                sessions[sender_key][session_id] = session
+
+        return sessions
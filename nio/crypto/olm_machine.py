@@ -20,6 +20,7 @@ import json
 # pylint: disable=redefined-builtin
 from builtins import str
 from collections import defaultdict
+from concurrent.futures import Executor
 from datetime import datetime, timedelta
 from typing import Any, DefaultDict, Dict, List, Optional, Set, Tuple, Union
 
@@ -30,9 +31,10 @@ from olm import (OlmGroupSessionError, OlmMessage, OlmPreKeyMessage,
 from cachetools import LRUCache
 
 from . import (DeviceStore, GroupSessionStore, InboundGroupSession,
-               InboundSession, OlmAccount, OlmDevice, OutboundGroupSession,
-               OutboundSession, Session, SessionStore, logger,
-               OutgoingKeyRequest)
+               InboundSession, LazyGroupSessionStore, LazySessionStore,
+               OlmAccount, OlmDevice, OutboundGroupSession, OutboundSession,
+               Session, SessionStore, logger, OutgoingKeyRequest)
+from .. import json_backend
 from ..api import Api
 from ..events import (BadEvent, BadEventType, Event,
                       ForwardedRoomKeyEvent, KeyVerificationAccept,
@@ -97,6 +99,8 @@ class Olm:
         user_id,    # type: str
         device_id,  # type: str
         store,      # type: MatrixStore
+        group_session_cache_size=None,  # type: Optional[int]
+        session_cache_size=None,  # type: Optional[int]
     ):
         # type: (...) -> None
 
@@ -120,12 +124,31 @@ class Olm:
         # A store holding all our 1on1 Olm sessions. These sessions are used to
         # exchange encrypted messages between two devices (e.g. encryption keys
         # for room message encryption are shared this way).
+        # If a cache size is given the sessions of a curve25519 key are loaded
+        # from the store when the key is first needed and only the sessions of
+        # that many keys are kept in memory.
+        self.session_cache_size = session_cache_size
         self.session_store = SessionStore()
 
+        # Olm sessions that changed since they were last saved, keyed by the
+        # session id. Decrypting a to-device message advances the session,
+        # instead of saving it right away the session is marked here and all
+        # of them are saved at once by flush_sessions().
+        self._dirty_sessions = dict()  # type: Dict[str, Tuple[str, Session]]
+
+        # Megolm sessions that were received in room keys but weren't saved
+        # yet, keyed by the session id. They are saved by flush_sessions() as
+        # well.
+        self._dirty_group_sessions = {}  # type: Dict[str, InboundGroupSession]
+
         # This store holds all the encryption keys that are used to decrypt
         # room messages. An encryption key gets added to the store either if we
         # add our own locally or if it gets shared usin 1on1 Olm sessions with
         # a to-device message with the m.room.encrypted type.
+        # If a cache size is given the sessions are loaded from the store on
+        # demand and only that many are kept in memory, otherwise all of them
+        # are loaded when the account is loaded.
+        self.group_session_cache_size = group_session_cache_size
         self.inbound_group_store = GroupSessionStore()
 
         # This dictionary holds the current encryption key that will be used to
@@ -214,6 +237,10 @@ class Olm:
                 self.user_id, self.device_id))
             account = OlmAccount()
             self.save_account(account)
+            # A new account doesn't have any stored sessions yet, but the
+            # lazy stores need to be set up if a cache size is configured.
+            self.session_store = self._load_sessions()
+            self.inbound_group_store = self._load_inbound_group_sessions()
         else:
             self.load()
 
@@ -1072,6 +1099,17 @@ class Olm:
         self, sender_key, sender_fp_key, room_id, session_id, session_key
     ):
         # type: (str, str, str, str, str) -> None
+        session = self._create_group_session(
+            sender_key, sender_fp_key, room_id, session_id, session_key
+        )
+
+        if session:
+            self.save_inbound_group_session(session)
+
+    def _create_group_session(
+        self, sender_key, sender_fp_key, room_id, session_id, session_key
+    ):
+        # type: (str, str, str, str, str) -> Optional[InboundGroupSession]
         logger.info(
             "Creating inbound group session for {} from {}".format(
                 room_id, sender_key
@@ -1093,10 +1131,11 @@ class Olm:
 
         except OlmSessionError as e:
             logger.warn(e)
-            return
+            return None
 
         self.inbound_group_store.add(session)
-        self.save_inbound_group_session(session)
+
+        return session
 
     def create_outbound_group_session(self, room_id):
         # type: (str) -> None
@@ -1217,7 +1256,7 @@ class Olm:
                 )
 
                 plaintext = session.decrypt(message)
-                self.save_session(sender_key, session)
+                self._defer_session_save(sender_key, session)
 
                 logger.info(
                     "Successfully decrypted olm message "
@@ -1304,7 +1343,7 @@ class Olm:
         if not sender_fp_key:
             return None
 
-        self.create_group_session(
+        session = self._create_group_session(
             sender_key,
             sender_fp_key,
             content["room_id"],
@@ -1312,6 +1351,9 @@ class Olm:
             content["session_key"],
         )
 
+        if session:
+            self._dirty_group_sessions[session.id] = session
+
         return event
 
     # This function is copyrighted under the Apache 2.0 license Zil0
@@ -1372,7 +1414,7 @@ class Olm:
             return None
 
         if self.inbound_group_store.add(session):
-            self.save_inbound_group_session(session)
+            self._dirty_group_sessions[session.id] = session
 
         key_request = self.outgoing_key_requests.pop(key_request.request_id)
         self.store.remove_outgoing_key_request(key_request)
@@ -1497,11 +1539,116 @@ class Olm:
     def decrypt_megolm_event(self, event, room_id=None):
         # type (MegolmEvent, Optional[str]) -> Union[Event, BadEvent]
         room_id = room_id or event.room_id
+        session = self._get_megolm_session(event, room_id)
+        message_index, payload = self._decrypt_megolm_payload(session, event)
+
+        return self._parse_megolm_payload(
+            event, room_id, session, message_index, payload
+        )
+
+    def decrypt_megolm_events(
+        self,
+        events,         # type: List[MegolmEvent]
+        room_id=None,   # type: Optional[str]
+        executor=None,  # type: Optional[Executor]
+    ):
+        # type: (...) -> List[Optional[Union[Event, BadEventType]]]
+        """Decrypt multiple Megolm events.
+
+        The events are grouped by the session that encrypted them. The libolm
+        decryption and the JSON decoding of the payloads run for every group
+        on the given executor, libolm releases the GIL while it decrypts. A
+        session is only used by one thread and decrypts its events in order.
+
+        The replay attack check, the verification and the parsing of the
+        decrypted events happen on the calling thread in the order of the
+        events.
+
+        Args:
+            events (List[MegolmEvent]): The events that should be decrypted.
+            room_id (str, optional): The room the events belong to, defaults
+                to the room id of every event.
+            executor (Executor, optional): A thread pool that decrypts the
+                groups of events. If not given the events are decrypted on
+                the calling thread.
+
+        Returns a list containing the decrypted event for every event, or None
+        if the event couldn't be decrypted.
+        """
+        sessions = []  # type: List[Optional[InboundGroupSession]]
+        groups = defaultdict(list)  # type: DefaultDict[str, List[int]]
+
+        for index, event in enumerate(events):
+            try:
+                session = self._get_megolm_session(
+                    event, room_id or event.room_id
+                )
+            except EncryptionError:
+                sessions.append(None)
+                continue
+
+            groups[session.id].append(index)
+            sessions.append(session)
+
+        def decrypt_group(group):
+            # type: (List[int]) -> List[Tuple[int, Any]]
+            payloads = []
+
+            for index in group:
+                session = sessions[index]
+                assert session
+
+                try:
+                    payload = self._decrypt_megolm_payload(
+                        session, events[index]
+                    )
+                except EncryptionError:
+                    payload = None
+
+                payloads.append((index, payload))
+
+            return payloads
+
+        if executor and len(groups) > 1:
+            results = executor.map(decrypt_group, groups.values())
+        else:
+            results = map(decrypt_group, groups.values())
 
+        payloads = [None] * len(events)  # type: List[Any]
+
+        for group_payloads in results:
+            for index, payload in group_payloads:
+                payloads[index] = payload
+
+        decrypted = []  # type: List[Optional[Union[Event, BadEventType]]]
+
+        for event, group_session, payload in zip(events, sessions, payloads):
+            if not group_session or not payload:
+                decrypted.append(None)
+                continue
+
+            message_index, parsed_dict = payload
+
+            try:
+                decrypted.append(self._parse_megolm_payload(
+                    event,
+                    room_id or event.room_id,
+                    group_session,
+                    message_index,
+                    parsed_dict,
+                ))
+            except EncryptionError:
+                decrypted.append(None)
+
+        return decrypted
+
+    def _get_megolm_session(self, event, room_id):
+        # type: (MegolmEvent, Optional[str]) -> InboundGroupSession
         if not room_id:
             raise EncryptionError("Event doesn't contain a room id")
 
-        verified = False
+        if not event.sender_key or not event.session_id:
+            raise EncryptionError("Event doesn't contain a session id")
 
         session = self.inbound_group_store.get(
             room_id,
@@ -1521,6 +1668,17 @@ class Olm:
             logger.warn(message)
             raise EncryptionError(message)
 
+        return session
+
+    @staticmethod
+    def _decrypt_megolm_payload(session, event):
+        # type: (InboundGroupSession, MegolmEvent) -> Tuple[int, Any]
+        """Decrypt and decode the payload of a Megolm event.
+
+        This doesn't touch the state of the Olm machine and may run in a
+        worker thread. Returns the message index and the decoded payload, or
+        the JSONDecodeError if the payload isn't valid JSON.
+        """
         try:
             plaintext, message_index = session.decrypt(event.ciphertext)
         except OlmGroupSessionError as e:
@@ -1528,6 +1686,22 @@ class Olm:
             logger.warn(message)
             raise EncryptionError(message)
 
+        try:
+            return message_index, json_backend.loads(plaintext)
+        except JSONDecodeError as e:
+            return message_index, e
+
+    def _parse_megolm_payload(
+        self,
+        event,          # type: MegolmEvent
+        room_id,        # type: str
+        session,        # type: InboundGroupSession
+        message_index,  # type: int
+        payload,        # type: Any
+    ):
+        # type: (...) -> Union[Event, BadEventType]
+        verified = False
+
         if not self.message_index_ok(message_index, event):
             raise EncryptionError(
                 "Duplicate message index, possible replay attack from {} {} "
@@ -1567,10 +1741,12 @@ class Olm:
                         event.event_id))
                     verified = True
 
-        try:
-            parsed_dict = json.loads(plaintext)  # type: Dict[Any, Any]
-        except JSONDecodeError as e:
-            raise EncryptionError("Error parsing payload: {}".format(str(e)))
+        if isinstance(payload, JSONDecodeError):
+            raise EncryptionError(
+                "Error parsing payload: {}".format(str(payload))
+            )
+
+        parsed_dict = payload  # type: Dict[Any, Any]
 
         bad = validate_or_badevent(
             parsed_dict,
@@ -1598,7 +1774,7 @@ class Olm:
         new_event.verified = verified
         new_event.sender_key = event.sender_key
         new_event.session_id = event.session_id
-        new_event.room_id = room_id
+        new_event.room_id = room_id  # type: ignore
 
         return new_event
 
@@ -1673,6 +1849,9 @@ class Olm:
                 plaintext = s.decrypt(message)
                 # Store the new session
                 self.session_store.add(sender_key, s)
+                # Creating the session removed a one-time key from the saved
+                # account, save the session right away as well so the prekey
+                # message can still be decrypted if it's received again.
                 self.save_session(sender_key, s)
             except OlmSessionError as e:
                 logger.error(
@@ -1690,7 +1869,7 @@ class Olm:
 
         # The plaintext should be valid json, let's parse it and verify it.
         try:
-            parsed_payload = json.loads(plaintext)
+            parsed_payload = json_backend.loads(plaintext)
         except JSONDecodeError as e:
             # Failed parsing the payload, return early.
             logger.error(
@@ -1866,15 +2045,65 @@ class Olm:
 
     def load(self):
         # type: () -> None
-        self.session_store = self.store.load_sessions()
-        self.inbound_group_store = self.store.load_inbound_group_sessions()
+        self.session_store = self._load_sessions()
+        self.inbound_group_store = self._load_inbound_group_sessions()
         self.device_store = self.store.load_device_keys()
         self.outgoing_key_requests = self.store.load_outgoing_key_requests()
 
+    def _load_sessions(self):
+        # type: () -> SessionStore
+        if self.session_cache_size is None:
+            return self.store.load_sessions()
+
+        return LazySessionStore(
+            self.store,
+            self.session_cache_size,
+            self._dirty_sessions
+        )
+
+    def _load_inbound_group_sessions(self):
+        # type: () -> GroupSessionStore
+        if self.group_session_cache_size is None:
+            return self.store.load_inbound_group_sessions()
+
+        return LazyGroupSessionStore(
+            self.store,
+            self.group_session_cache_size,
+            self._dirty_group_sessions
+        )
+
     def save_session(self, curve_key, session):
         # type: (str, Session) -> None
         self.store.save_session(curve_key, session)
 
+    def _defer_session_save(self, curve_key, session):
+        # type: (str, Session) -> None
+        self._dirty_sessions[session.id] = (curve_key, session)
+
+    def flush_sessions(self):
+        # type: () -> None
+        """Save the sessions that changed since the last flush.
+
+        Olm sessions that were used to decrypt to-device messages and Megolm
+        sessions that were received in room keys are only marked as changed,
+        this saves them in a single transaction each. The client flushes the
+        sessions after the to-device messages of every sync response are
+        handled and stores the sync token only after that. If the process dies
+        before the flush, the to-device messages are received again with the
+        next sync and the saved sessions can still decrypt them. Sessions that
+        are created from prekey messages are saved right away since they use
+        up a one-time key of the account.
+        """
+        if self._dirty_sessions:
+            self.store.save_sessions(list(self._dirty_sessions.values()))
+            self._dirty_sessions.clear()
+
+        if self._dirty_group_sessions:
+            self.store.save_inbound_group_sessions(
+                list(self._dirty_group_sessions.values())
+            )
+            self._dirty_group_sessions.clear()
+
     def save_inbound_group_session(self, session):
         # type: (InboundGroupSession) -> None
         self.store.save_inbound_group_session(session)
@@ -2060,11 +2289,11 @@ class Olm:
         """
         sessions = Olm.import_keys_static(infile, passphrase)
 
-        for session in sessions:
-            # This could be improved by writing everything to db at once at
-            # the end
-            if self.inbound_group_store.add(session):
-                self.save_inbound_group_session(session)
+        new_sessions = [
+            session for session in sessions
+            if self.inbound_group_store.add(session)
+        ]
+        self.store.save_inbound_group_sessions(new_sessions)
 
         logger.info(
             "Successfully imported encryption keys from {}".format(infile)
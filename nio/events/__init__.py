@@ -12,4 +12,6 @@ from .to_device import *
 from .ephemeral import *
 from .account_data import *
 from .invite_events import *
+from .registry import *
+from .compact import *
 from .misc import *
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018-2019 Damir Jelić <poljar@termina.org.uk>
+#
+# Permission to use, copy, modify, and/or distribute this software for
+# any purpose with or without fee is hereby granted, provided that the
+# above copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER
+# RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF
+# CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""nio compact events.
+
+Room events are dataclasses which keep their attributes in a per-instance
+dictionary, and they keep the whole source dictionary of the event around.
+Clients that hold on to a lot of events, e.g. while paginating the room
+history, can convert them into compact events. Compact events store their
+attributes in slots and keep the source as JSON encoded bytes, or drop it
+completely.
+
+Compact event classes subclass the event class they were created from,
+isinstance() checks keep working as before.
+
+"""
+
+import json
+from enum import Enum, unique
+from typing import Any, Dict, Optional, Type, Union
+
+from dataclasses import fields
+
+from .misc import LazyEvent
+from .room_events import Event
+
+__all__ = ["SourceRetention", "CompactEvent", "compact_event"]
+
+
+@unique
+class SourceRetention(Enum):
+    """How compact events should retain the source of the event.
+
+    Attributes:
+        keep (str): Keep the source dictionary as it is.
+        compact (str): Keep the source as JSON encoded bytes, the dictionary is
+            decoded every time the source attribute is accessed.
+        drop (str): Don't keep the source, the source attribute will be None.
+
+    """
+
+    keep = "keep"
+    compact = "compact"
+    drop = "drop"
+
+
+class CompactEvent:
+    """Base class for slotted compact events.
+
+    Compact event classes are created by compact_event() for every event
+    class that gets compacted.
+    """
+
+    __slots__ = ("_source",)
+
+    _source: Optional[Union[bytes, Dict[str, Any]]]
+
+    @property
+    def source(self):
+        # type: () -> Optional[Dict[str, Any]]
+        if isinstance(self._source, bytes):
+            return json.loads(self._source.decode("utf-8"))
+
+        return self._source
+
+
+_compact_classes = {}  # type: Dict[Type[Event], Type[CompactEvent]]
+
+
+def _compact_class(event_class):
+    # type: (Type[Event]) -> Type[CompactEvent]
+    try:
+        return _compact_classes[event_class]
+    except KeyError:
+        pass
+
+    # The compact class subclasses the event class, the fields of the event
+    # class are stored in slots of the compact class. Instances never create
+    # their dictionary since every field is found in a slot.
+    namespace = {
+        "__slots__": tuple(
+            f.name for f in fields(event_class) if f.name != "source"
+        ),
+        "__qualname__": event_class.__qualname__,
+        "__module__": event_class.__module__,
+        "__doc__": event_class.__doc__,
+    }  # type: Dict[str, Any]
+
+    compact_class = type(
+        event_class.__name__, (CompactEvent, event_class), namespace
+    )
+    _compact_classes[event_class] = compact_class
+
+    return compact_class
+
+
+def compact_event(event, source=SourceRetention.compact):
+    # type: (Any, SourceRetention) -> Any
+    """Convert a room event into a compact event.
+
+    Args:
+        event (Event): The room event that should be converted.
+        source (SourceRetention): How the source of the event should be
+            retained. Defaults to JSON encoded bytes.
+
+    Returns a compact copy of the event. Events that aren't room events, e.g.
+    BadEvents, and events that are already compact are returned unchanged.
+
+    """
+    if isinstance(event, LazyEvent):
+        event._parse_lazy_event()
+
+    if isinstance(event, CompactEvent) or not isinstance(event, Event):
+        return event
+
+    event_class = type(event)  # type: Type[Event]
+
+    if isinstance(event, LazyEvent) and event._lazy_base is not None:
+        event_class = event._lazy_base
+
+    compact_class = _compact_class(event_class)
+    compact = object.__new__(compact_class)  # type: Any
+
+    for f in fields(event_class):
+        if f.name != "source":
+            setattr(compact, f.name, getattr(event, f.name))
+
+    if source is SourceRetention.keep:
+        compact._source = event.source
+    elif source is SourceRetention.compact:
+        compact._source = json.dumps(
+            event.source,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+    else:
+        compact._source = None
+
+    return compact
@@ -29,7 +29,7 @@ be displayed to users if they are invited to a room.
 """
 
 
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, Optional, Type, Union
 
 from dataclasses import dataclass, field
 
@@ -80,12 +80,10 @@ class InviteEvent:
             if "redacted_because" in event_dict["unsigned"]:
                 return None
 
-        if event_dict["type"] == "m.room.member":
-            return InviteMemberEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.canonical_alias":
-            return InviteAliasEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.name":
-            return InviteNameEvent.from_dict(event_dict)
+        event_class = _invite_event_classes.get(event_dict["type"])
+
+        if event_class:
+            return event_class.from_dict(event_dict)
 
         return None
 
@@ -197,3 +195,12 @@ class InviteNameEvent(InviteEvent):
         canonical_alias = parsed_dict["content"]["name"]
 
         return cls(parsed_dict, sender, canonical_alias)
+
+
+# Lookup table used by InviteEvent.parse_event() to pick the class of an event,
+# use register_event_type() to add custom event classes to it.
+_invite_event_classes = {
+    "m.room.member": InviteMemberEvent,
+    "m.room.canonical_alias": InviteAliasEvent,
+    "m.room.name": InviteNameEvent,
+}  # type: Dict[str, Type[InviteEvent]]
@@ -14,15 +14,18 @@
 # CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
+import threading
+from contextlib import contextmanager
 from functools import wraps
-from typing import Any, Dict, Optional, Union
+from typing import Any, Callable, Dict, Iterator, Optional, Type, Union
 
 from dataclasses import dataclass, field
 from jsonschema.exceptions import SchemaError, ValidationError
 from logbook import Logger
 
 from ..log import logger_group
-from ..schemas import validate_json
+from ..schemas import (ValidationLevel, get_validation_level, validate_event,
+                       validation_level)
 
 logger = Logger("nio.events")
 logger_group.add_logger(logger)
@@ -34,17 +37,27 @@ def validate_or_badevent(
 ):
     # type: (...) -> Optional[Union[BadEvent, UnknownBadEvent]]
     try:
-        validate_json(parsed_dict, schema)
+        validate_event(parsed_dict, schema)
     except (ValidationError, SchemaError) as e:
         logger.warn("Error validating event: {}".format(str(e)))
-        try:
-            return BadEvent.from_dict(parsed_dict)
-        except KeyError:
-            return UnknownBadEvent(parsed_dict)
+        return _bad_event(parsed_dict)
 
     return None
 
 
+def _bad_event(parsed_dict):
+    # type: (Dict[Any, Any]) -> Union[BadEvent, UnknownBadEvent]
+    try:
+        return BadEvent.from_dict(parsed_dict)
+    except (KeyError, TypeError):
+        return UnknownBadEvent(parsed_dict)
+
+
+# Errors that the event parsers raise on malformed events if the events
+# weren't fully validated.
+_PARSE_ERRORS = (KeyError, TypeError, AttributeError, ValueError)
+
+
 def verify(schema):
     def decorator(f):
         @wraps(f)
@@ -55,7 +68,15 @@ def verify(schema):
             if bad:
                 return bad
 
-            return f(*args, **kwargs)
+            if get_validation_level() is ValidationLevel.full:
+                return f(*args, **kwargs)
+
+            try:
+                return f(*args, **kwargs)
+            except _PARSE_ERRORS as e:
+                logger.warn("Error parsing event: {!r}".format(e))
+                return _bad_event(event_dict)
+
         return wrapper
     return decorator
 
@@ -67,16 +88,228 @@ def verify_or_none(schema):
             event_dict = args[1]
 
             try:
-                validate_json(event_dict, schema)
+                validate_event(event_dict, schema)
             except (ValidationError, SchemaError) as e:
                 logger.error("Error validating event: {}".format(str(e)))
                 return None
 
-            return f(*args, **kwargs)
+            if get_validation_level() is ValidationLevel.full:
+                return f(*args, **kwargs)
+
+            try:
+                return f(*args, **kwargs)
+            except _PARSE_ERRORS as e:
+                logger.error("Error parsing event: {!r}".format(e))
+                return None
+
         return wrapper
     return decorator
 
 
+_local = threading.local()
+
+
+def get_lazy_events():
+    # type: () -> bool
+    """Check if events are currently parsed lazily.
+
+    Returns True if lazy event parsing was enabled for the current thread
+    using the lazy_events() context manager, False otherwise.
+    """
+    return getattr(_local, "lazy_events", False)
+
+
+@contextmanager
+def lazy_events(enabled=True):
+    # type: (bool) -> Iterator[None]
+    """Enable or disable lazy event parsing for the current thread.
+
+    Room events that are parsed while lazy parsing is enabled only have their
+    source, event_id, sender and server_timestamp set. The rest of the event
+    is parsed, and validated, the first time one of the other attributes is
+    accessed. The events are still instances of their event class, so
+    isinstance() checks work as before.
+
+    If the deferred validation fails the event turns into a BadEvent.
+
+    Args:
+        enabled (bool): Should events be parsed lazily.
+
+    """
+    previous = get_lazy_events()
+    _local.lazy_events = enabled
+
+    try:
+        yield
+    finally:
+        _local.lazy_events = previous
+
+
+# The fields of lazy events that are set when the event is created, all other
+# fields are parsed on first access.
+_EAGER_FIELDS = ("source", "event_id", "sender", "server_timestamp")
+
+
+class _LazyField:
+    """Descriptor that parses a lazy event when one of its fields is read.
+
+    This is a non-data descriptor, once the event is parsed the fields are
+    stored in the instance dictionary and are found without going through the
+    descriptor.
+    """
+
+    def __init__(self, name):
+        # type: (str) -> None
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+
+        instance._parse_lazy_event()
+
+        try:
+            return instance.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+
+class LazyEvent:
+    """Mixin class for events that are parsed on first access.
+
+    Lazy event classes are created by lazy_event_class() and subclass the
+    event class they stand in for.
+    """
+
+    _lazy_base = None    # type: Optional[Type]
+    _lazy_parser = None  # type: Optional[Callable]
+
+    def _parse_lazy_event(self):
+        # type: () -> None
+        state = self.__dict__
+        level = state.pop("_lazy_level", None)
+
+        # The event was already parsed.
+        if level is None:
+            return
+
+        base = self._lazy_base
+        parser = self._lazy_parser
+        assert base is not None and parser is not None
+
+        with validation_level(level):
+            event = parser(state["source"])
+
+        # Keep the attributes that were set on the lazy event in the meantime.
+        for key, value in vars(event).items():
+            state.setdefault(key, value)
+
+        if not isinstance(event, base):
+            self.__class__ = type(event)
+            return
+
+        # Fields that keep their default value are class attributes of the
+        # event class, those are hidden by our descriptors.
+        for name in base.__dataclass_fields__:
+            if name not in state and hasattr(base, name):
+                state[name] = getattr(base, name)
+
+
+_lazy_classes = {}  # type: Dict[Type, Type]
+
+
+def lazy_event_class(event_class, parser):
+    # type: (Type, Callable) -> Type
+    """Get the lazy variant of an event class.
+
+    Args:
+        event_class (type): The dataclass based event class that the lazy
+            class should subclass.
+        parser (Callable): The function that parses the source dictionary of
+            the event into an event of the event class.
+
+    """
+    try:
+        return _lazy_classes[event_class]
+    except KeyError:
+        pass
+
+    namespace = {
+        name: _LazyField(name)
+        for name in event_class.__dataclass_fields__
+        if name not in _EAGER_FIELDS
+    }  # type: Dict[str, Any]
+    namespace["_lazy_base"] = event_class
+    namespace["_lazy_parser"] = staticmethod(parser)
+    namespace["__qualname__"] = event_class.__qualname__
+    namespace["__module__"] = event_class.__module__
+
+    lazy_class = type(event_class.__name__, (LazyEvent, event_class),
+                      namespace)
+    _lazy_classes[event_class] = lazy_class
+
+    return lazy_class
+
+
+def parse_lazy_event(event):
+    # type: (Any) -> None
+    """Parse and validate a lazy event right away.
+
+    An event that fails the validation turns into a BadEvent, or an
+    UnknownBadEvent. Events that aren't lazy are left alone.
+
+    Args:
+        event: The event that should be parsed.
+
+    """
+    if isinstance(event, LazyEvent):
+        event._parse_lazy_event()
+
+
+def parse_lazy_state_event(event):
+    # type: (Any) -> None
+    """Parse and validate a lazy state event right away.
+
+    State events change the state of a room, an invalid one needs to turn
+    into a BadEvent before the room looks at its class. Other events are left
+    alone.
+
+    Args:
+        event: The event that should be parsed.
+
+    """
+    if not isinstance(event, LazyEvent):
+        return
+
+    if "state_key" in event.__dict__["source"]:
+        event._parse_lazy_event()
+
+
+def create_lazy_event(event_class, parser, event_dict):
+    # type: (Type, Callable, Dict[Any, Any]) -> Any
+    """Create an event that is parsed on first access.
+
+    Args:
+        event_class (type): The class of the event.
+        parser (Callable): The function that parses the event dictionary.
+        event_dict (dict): The dictionary representation of the event, it
+            needs to be validated against the room event schema.
+
+    Returns an instance of the lazy variant of the event class.
+    """
+    lazy_class = lazy_event_class(event_class, parser)
+    event = object.__new__(lazy_class)
+    event.__dict__.update(
+        source=event_dict,
+        event_id=event_dict["event_id"],
+        sender=event_dict["sender"],
+        server_timestamp=event_dict["origin_server_ts"],
+        _lazy_level=get_validation_level(),
+    )
+
+    return event
+
+
 @dataclass
 class UnknownBadEvent:
     """An event that doesn't have the minimal necessary structure.
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018-2019 Damir Jelić <poljar@termina.org.uk>
+#
+# Permission to use, copy, modify, and/or distribute this software for
+# any purpose with or without fee is hereby granted, provided that the
+# above copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER
+# RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF
+# CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""nio event type registry.
+
+The parse methods of the event base classes pick the class of an event by
+looking up the event type, or the msgtype for m.room.message events, in a
+dictionary. Custom event classes can be added to these lookup tables so that
+they get created instead of an UnknownEvent.
+
+"""
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type
+
+from .invite_events import InviteEvent, _invite_event_classes
+from .room_events import (CallEvent, Event, RoomMessage, _call_event_classes,
+                          _encrypted_message_classes, _event_parsers,
+                          _message_classes)
+from .to_device import ToDeviceEvent, _to_device_parsers
+
+__all__ = ["register_event_type", "unregister_event_type"]
+
+# The lookup tables that are keyed by the event type, together with a copy of
+# their built-in entries.
+_type_tables = [
+    (_event_parsers, dict(_event_parsers)),
+    (_call_event_classes, dict(_call_event_classes)),
+    (_to_device_parsers, dict(_to_device_parsers)),
+    (_invite_event_classes, dict(_invite_event_classes)),
+]  # type: List[Tuple[Dict[str, Any], Dict[str, Any]]]
+
+# The lookup tables that are keyed by the msgtype of m.room.message events.
+_msgtype_tables = [
+    (_message_classes, dict(_message_classes)),
+    (_encrypted_message_classes, dict(_encrypted_message_classes)),
+]  # type: List[Tuple[Dict[str, Any], Dict[str, Any]]]
+
+# The classes registered with register_event_type(), keyed by the event type
+# and msgtype.
+_registrations = {}  # type: Dict[Tuple[str, Optional[str]], Type]
+
+
+def register_event_type(event_type, event_class, msgtype=None):
+    # type: (str, Type, Optional[str]) -> None
+    """Register a class that should be used to parse events of a given type.
+
+    The lookup table that is updated depends on the base class of the event
+    class: Event subclasses are used for room events, RoomMessage subclasses
+    for m.room.message events with the given msgtype, ToDeviceEvent subclasses
+    for to-device events and InviteEvent subclasses for events in invited
+    rooms.
+
+    Registering a type that nio already knows about replaces the built-in
+    class. A RoomMessage class that is registered for a msgtype is used for
+    decrypted messages of that msgtype as well, e.g. a class for m.image
+    replaces RoomEncryptedImage too.
+
+    Args:
+        event_type (str): The type of the event, e.g. "org.example.poll".
+        event_class (type): The class that should be created for events of
+            this type. The class needs to provide a from_dict() classmethod
+            that takes the event dictionary and returns the event.
+        msgtype (str, optional): The msgtype that the class handles. Needs to
+            be given for RoomMessage subclasses, and only for those.
+
+    Raises a ValueError if the class isn't a subclass of one of the event
+    base classes or if the msgtype doesn't fit the class.
+
+    """
+    if not isinstance(event_class, type):
+        raise ValueError("Event class {} isn't a class".format(event_class))
+
+    if issubclass(event_class, RoomMessage):
+        if event_type != "m.room.message" or not msgtype:
+            raise ValueError(
+                "RoomMessage classes need to be registered for the "
+                "m.room.message type with a msgtype"
+            )
+
+        _message_classes[msgtype] = event_class
+        _encrypted_message_classes.pop(msgtype, None)
+        _registrations[(event_type, msgtype)] = event_class
+        return
+
+    if msgtype:
+        raise ValueError(
+            "A msgtype can only be given for RoomMessage classes"
+        )
+
+    if issubclass(event_class, CallEvent) and event_type.startswith("m.call"):
+        _call_event_classes[event_type] = event_class
+    elif issubclass(event_class, Event):
+        _event_parsers[event_type] = event_class.from_dict
+    elif issubclass(event_class, ToDeviceEvent):
+        _to_device_parsers[event_type] = event_class.from_dict
+    elif issubclass(event_class, InviteEvent):
+        _invite_event_classes[event_type] = event_class
+    else:
+        raise ValueError(
+            "Event class {} isn't a subclass of a known event "
+            "base class".format(event_class.__name__)
+        )
+
+    _registrations[(event_type, None)] = event_class
+
+
+def unregister_event_type(event_type, msgtype=None):
+    # type: (str, Optional[str]) -> None
+    """Remove a class that was registered with register_event_type().
+
+    Built-in classes that were replaced by the registered class are used
+    again. Unregistering a type that wasn't registered does nothing.
+
+    Args:
+        event_type (str): The type of the event, e.g. "org.example.poll".
+        msgtype (str, optional): The msgtype of the registered RoomMessage
+            class.
+
+    """
+    _registrations.pop((event_type, msgtype or None), None)
+
+    if msgtype:
+        tables = [
+            (table, builtin, msgtype) for table, builtin in _msgtype_tables
+        ]  # type: List[Tuple[Dict[str, Any], Dict[str, Any], str]]
+    else:
+        tables = [
+            (table, builtin, event_type) for table, builtin in _type_tables
+        ]
+
+    for table, builtin, key in tables:
+        if key in builtin:
+            table[key] = builtin[key]
+        else:
+            table.pop(key, None)
+
+
+def registered_event_types():
+    # type: () -> List[Tuple[str, Type, Optional[str]]]
+    """Get the classes that are registered with register_event_type().
+
+    Returns a list of (event_type, event_class, msgtype) tuples, in the order
+    the classes were registered.
+    """
+    return [
+        (event_type, event_class, msgtype)
+        for (event_type, msgtype), event_class in _registrations.items()
+    ]
+
+
+@contextmanager
+def custom_event_types(registrations):
+    # type: (List[Tuple[str, Type, Optional[str]]]) -> Iterator[None]
+    """Parse events with exactly the given custom classes registered.
+
+    Registrations that were made before are hidden while the context is
+    active and restored afterwards. This is used to parse events in the
+    worker processes of a process pool, which don't share the registrations
+    of the client process. The lookup tables are global, this must not be
+    used while events are parsed in other threads.
+
+    Args:
+        registrations (List[Tuple[str, type, str]]): The event types, classes
+            and msgtypes, as returned by registered_event_types().
+
+    """
+    tables = [table for table, _ in _type_tables + _msgtype_tables]
+    saved = [dict(table) for table in tables]
+    saved_registrations = dict(_registrations)
+
+    for table, builtin in _type_tables + _msgtype_tables:
+        table.clear()
+        table.update(builtin)
+    _registrations.clear()
+
+    try:
+        for event_type, event_class, msgtype in registrations:
+            register_event_type(event_type, event_class, msgtype)
+        yield
+    finally:
+        for table, contents in zip(tables, saved):
+            table.clear()
+            table.update(contents)
+        _registrations.clear()
+        _registrations.update(saved_registrations)
@@ -17,13 +17,13 @@
 from __future__ import unicode_literals
 
 import time
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Type, Union
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, is_dataclass
 
 from ..schemas import Schemas
 from .misc import (BadEventType, UnknownBadEvent, validate_or_badevent, verify,
-                   BadEvent)
+                   BadEvent, create_lazy_event, get_lazy_events)
 from ..event_builders import RoomKeyRequestMessage
 
 
@@ -107,35 +107,18 @@ class Event:
             if "redacted_because" in event_dict["unsigned"]:
                 return RedactedEvent.from_dict(event_dict)
 
-        if event_dict["type"] == "m.room.message":
-            return RoomMessage.parse_event(event_dict)
-        elif event_dict["type"] == "m.room.create":
-            return RoomCreateEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.guest_access":
-            return RoomGuestAccessEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.join_rules":
-            return RoomJoinRulesEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.history_visibility":
-            return RoomHistoryVisibilityEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.member":
-            return RoomMemberEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.canonical_alias":
-            return RoomAliasEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.name":
-            return RoomNameEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.topic":
-            return RoomTopicEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.avatar":
-            return RoomAvatarEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.power_levels":
-            return PowerLevelsEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.encryption":
-            return RoomEncryptionEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.redaction":
-            return RedactionEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.room.encrypted":
-            return Event.parse_encrypted_event(event_dict)
-        elif event_dict["type"].startswith("m.call"):
+        parser = _event_parsers.get(event_dict["type"])
+
+        if parser and get_lazy_events():
+            event = _parse_lazy_event(parser, event_dict)
+
+            if event:
+                return event
+
+        if parser:
+            return parser(event_dict)
+
+        if event_dict["type"].startswith("m.call"):
             return CallEvent.parse_event(event_dict)
 
         return UnknownEvent.from_dict(event_dict)
@@ -398,16 +381,11 @@ class CallEvent(Event):
             event_dict (dict): The raw matrix event dictionary.
 
         """
-        if event_dict["type"] == "m.call.candidates":
-            event = CallCandidatesEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.call.invite":
-            event = CallInviteEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.call.answer":
-            event = CallAnswerEvent.from_dict(event_dict)
-        elif event_dict["type"] == "m.call.hangup":
-            event = CallHangupEvent.from_dict(event_dict)
-        else:
-            event = UnknownEvent.from_dict(event_dict)
+        event_class = _call_event_classes.get(
+            event_dict["type"],
+            UnknownEvent
+        )
+        event = event_class.from_dict(event_dict)
 
         return event
 
@@ -795,22 +773,11 @@ class RoomMessage(Event):
         # type: (Dict[Any, Any]) -> Union[RoomMessage, BadEventType]
         content_dict = parsed_dict["content"]
 
-        if content_dict["msgtype"] == "m.text":
-            event = RoomMessageText.from_dict(parsed_dict)
-        elif content_dict["msgtype"] == "m.emote":
-            event = RoomMessageEmote.from_dict(parsed_dict)
-        elif content_dict["msgtype"] == "m.notice":
-            event = RoomMessageNotice.from_dict(parsed_dict)
-        elif content_dict["msgtype"] == "m.image":
-            event = RoomMessageImage.from_dict(parsed_dict)
-        elif content_dict["msgtype"] == "m.audio":
-            event = RoomMessageAudio.from_dict(parsed_dict)
-        elif content_dict["msgtype"] == "m.video":
-            event = RoomMessageVideo.from_dict(parsed_dict)
-        elif content_dict["msgtype"] == "m.file":
-            event = RoomMessageFile.from_dict(parsed_dict)
-        else:
-            event = RoomMessageUnknown.from_dict(parsed_dict)
+        event_class = _message_classes.get(
+            content_dict["msgtype"],
+            RoomMessageUnknown
+        )
+        event = event_class.from_dict(parsed_dict)
 
         if "unsigned" in parsed_dict:
             txn_id = parsed_dict["unsigned"].get("transaction_id", None)
@@ -824,14 +791,10 @@ class RoomMessage(Event):
         # type: (Dict[Any, Any]) -> Union[RoomMessage, BadEventType]
         msgtype = parsed_dict["content"]["msgtype"]
 
-        if msgtype == "m.image":
-            event = RoomEncryptedImage.from_dict(parsed_dict)
-        elif msgtype == "m.audio":
-            event = RoomEncryptedAudio.from_dict(parsed_dict)
-        elif msgtype == "m.video":
-            event = RoomEncryptedVideo.from_dict(parsed_dict)
-        elif msgtype == "m.file":
-            event = RoomEncryptedFile.from_dict(parsed_dict)
+        event_class = _encrypted_message_classes.get(msgtype)
+
+        if event_class:
+            event = event_class.from_dict(parsed_dict)
         else:
             event = RoomMessage.parse_event(parsed_dict)
 
@@ -1410,3 +1373,77 @@ class RoomMemberEvent(Event):
             content,
             prev_content,
         )
+
+
+def _parse_lazy_event(parser, event_dict):
+    # type: (Callable, Dict[Any, Any]) -> Optional[Event]
+    """Create a lazy event if the class of the event is known upfront.
+
+    Returns None if the event needs to be parsed eagerly, e.g. encrypted
+    events.
+    """
+    event_class = None  # type: Optional[Type]
+
+    if parser == RoomMessage.parse_event:
+        content = event_dict["content"]
+        msgtype = content.get("msgtype") if isinstance(content, dict) else None
+
+        if not isinstance(msgtype, str):
+            return None
+
+        event_class = _message_classes.get(msgtype, RoomMessageUnknown)
+    else:
+        event_class = getattr(parser, "__self__", None)
+
+        if (not isinstance(event_class, type)
+                or parser != getattr(event_class, "from_dict", None)):
+            return None
+
+    if event_class is None or not is_dataclass(event_class):
+        return None
+
+    return create_lazy_event(event_class, parser, event_dict)
+
+
+# Lookup tables used by the parse methods above to pick the class of an event,
+# use register_event_type() to add custom event classes to them.
+_event_parsers = {
+    "m.room.message": RoomMessage.parse_event,
+    "m.room.create": RoomCreateEvent.from_dict,
+    "m.room.guest_access": RoomGuestAccessEvent.from_dict,
+    "m.room.join_rules": RoomJoinRulesEvent.from_dict,
+    "m.room.history_visibility": RoomHistoryVisibilityEvent.from_dict,
+    "m.room.member": RoomMemberEvent.from_dict,
+    "m.room.canonical_alias": RoomAliasEvent.from_dict,
+    "m.room.name": RoomNameEvent.from_dict,
+    "m.room.topic": RoomTopicEvent.from_dict,
+    "m.room.avatar": RoomAvatarEvent.from_dict,
+    "m.room.power_levels": PowerLevelsEvent.from_dict,
+    "m.room.encryption": RoomEncryptionEvent.from_dict,
+    "m.room.redaction": RedactionEvent.from_dict,
+    "m.room.encrypted": Event.parse_encrypted_event,
+}  # type: Dict[str, Callable[[Dict[Any, Any]], Union[Event, BadEventType]]]
+
+_call_event_classes = {
+    "m.call.candidates": CallCandidatesEvent,
+    "m.call.invite": CallInviteEvent,
+    "m.call.answer": CallAnswerEvent,
+    "m.call.hangup": CallHangupEvent,
+}  # type: Dict[str, Type[CallEvent]]
+
+_message_classes = {
+    "m.text": RoomMessageText,
+    "m.emote": RoomMessageEmote,
+    "m.notice": RoomMessageNotice,
+    "m.image": RoomMessageImage,
+    "m.audio": RoomMessageAudio,
+    "m.video": RoomMessageVideo,
+    "m.file": RoomMessageFile,
+}  # type: Dict[str, Type]
+
+_encrypted_message_classes = {
+    "m.image": RoomEncryptedImage,
+    "m.audio": RoomEncryptedAudio,
+    "m.video": RoomEncryptedVideo,
+    "m.file": RoomEncryptedFile,
+}  # type: Dict[str, Type]
@@ -24,7 +24,7 @@ of a user.
 
 """
 
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Union
 from copy import deepcopy
 
 from dataclasses import dataclass, field
@@ -69,20 +69,10 @@ class ToDeviceEvent:
         if not event_dict["content"]:
             return None
 
-        if event_dict["type"] == "m.room.encrypted":
-            return ToDeviceEvent.parse_encrypted_event(event_dict)
-        elif event_dict["type"] == "m.key.verification.start":
-            return KeyVerificationStart.from_dict(event_dict)
-        elif event_dict["type"] == "m.key.verification.accept":
-            return KeyVerificationAccept.from_dict(event_dict)
-        elif event_dict["type"] == "m.key.verification.key":
-            return KeyVerificationKey.from_dict(event_dict)
-        elif event_dict["type"] == "m.key.verification.mac":
-            return KeyVerificationMac.from_dict(event_dict)
-        elif event_dict["type"] == "m.key.verification.cancel":
-            return KeyVerificationCancel.from_dict(event_dict)
-        elif event_dict["type"] == "m.room_key_request":
-            return BaseRoomKeyRequest.parse_event(event_dict)
+        parser = _to_device_parsers.get(event_dict["type"])
+
+        if parser:
+            return parser(event_dict)
 
         return None
 
@@ -535,3 +525,16 @@ class ForwardedRoomKeyEvent(RoomKeyEvent):
             content["session_id"],
             content["algorithm"]
         )
+
+
+# Lookup table used by ToDeviceEvent.parse_event() to pick the class of an
+# event, use register_event_type() to add custom event classes to it.
+_to_device_parsers = {
+    "m.room.encrypted": ToDeviceEvent.parse_encrypted_event,
+    "m.key.verification.start": KeyVerificationStart.from_dict,
+    "m.key.verification.accept": KeyVerificationAccept.from_dict,
+    "m.key.verification.key": KeyVerificationKey.from_dict,
+    "m.key.verification.mac": KeyVerificationMac.from_dict,
+    "m.key.verification.cancel": KeyVerificationCancel.from_dict,
+    "m.room_key_request": BaseRoomKeyRequest.parse_event,
+}  # type: Dict[str, Callable[[Dict[Any, Any]], Optional[ToDeviceEvent]]]
@@ -16,7 +16,6 @@
 
 from __future__ import unicode_literals
 
-import json
 import pprint
 import time
 from builtins import bytes, super
@@ -30,6 +29,7 @@ import h2.events
 import h11
 from logbook import Logger
 
+from . import json_backend
 from .log import logger_group
 
 logger = Logger("nio.http")
@@ -100,7 +100,7 @@ class HttpRequest(TransportRequest):
     @classmethod
     def _post_or_put(cls, method, host, target, data, timeout=0):
         request_data = (
-            json.dumps(data, separators=(",", ":"))
+            json_backend.dumps(data)
             if isinstance(data, dict)
             else data
         )
@@ -158,7 +158,7 @@ class Http2Request(TransportRequest):
     @classmethod
     def _post_or_put(cls, method, host, target, data, timeout):
         request_data = (
-            json.dumps(data, separators=(",", ":"))
+            json_backend.dumps(data)
             if isinstance(data, dict)
             else data
         )
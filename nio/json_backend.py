@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018-2019 Damir Jelić <poljar@termina.org.uk>
+#
+# Permission to use, copy, modify, and/or distribute this software for
+# any purpose with or without fee is hereby granted, provided that the
+# above copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER
+# RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF
+# CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""nio JSON backends.
+
+nio encodes request bodies and decodes responses and decrypted events using a
+JSON backend. By default the json module of the standard library is used.
+orjson or ujson can be selected with set_json_backend(), or the json_backend
+client config option, if they are installed. They encode some values
+differently, e.g. they don't escape non-ASCII characters and format floats in
+their own way.
+
+Canonical JSON, which is used for signatures, is always produced by the
+standard library encoder. The other backends format some values, e.g. floats,
+differently and signatures need to be computed over exactly the same bytes as
+before.
+
+"""
+
+import json
+from enum import Enum, unique
+from typing import Any, Callable, Dict, List, Union
+
+from ._compat import package_installed
+
+if package_installed("orjson"):
+    import orjson
+
+if package_installed("ujson"):
+    import ujson
+
+
+@unique
+class JsonBackend(Enum):
+    """The available JSON backends.
+
+    Attributes:
+        auto (str): Use the fastest installed backend.
+        stdlib (str): Use the json module of the standard library.
+        orjson (str): Use orjson.
+        ujson (str): Use ujson.
+
+    """
+
+    auto = "auto"
+    stdlib = "json"
+    orjson = "orjson"
+    ujson = "ujson"
+
+
+def _stdlib_dumps(obj):
+    # type: (Any) -> str
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def _stdlib_loads(data):
+    # type: (Union[str, bytes]) -> Any
+    return json.loads(data)
+
+
+def _orjson_dumps(obj):
+    # type: (Any) -> str
+    try:
+        return orjson.dumps(obj).decode("utf-8")
+    except TypeError:
+        # Non-string keys, integers that don't fit into 64 bits and unknown
+        # types are left to the standard library.
+        return _stdlib_dumps(obj)
+
+
+def _orjson_loads(data):
+    # type: (Union[str, bytes]) -> Any
+    try:
+        return orjson.loads(data)
+    except ValueError:
+        # Let the standard library decide, it accepts some documents orjson
+        # doesn't, e.g. numbers that don't fit into 64 bits, and raises the
+        # JSONDecodeError that our callers expect for invalid ones.
+        return _stdlib_loads(data)
+
+
+def _ujson_dumps(obj):
+    # type: (Any) -> str
+    try:
+        return ujson.dumps(
+            obj,
+            ensure_ascii=False,
+            escape_forward_slashes=False,
+        )
+    except (TypeError, OverflowError):
+        return _stdlib_dumps(obj)
+
+
+def _ujson_loads(data):
+    # type: (Union[str, bytes]) -> Any
+    try:
+        return ujson.loads(data)
+    except ValueError:
+        return _stdlib_loads(data)
+
+
+_BACKENDS = {
+    JsonBackend.stdlib: (_stdlib_dumps, _stdlib_loads),
+    JsonBackend.orjson: (_orjson_dumps, _orjson_loads),
+    JsonBackend.ujson: (_ujson_dumps, _ujson_loads),
+}  # type: Dict[JsonBackend, Any]
+
+
+def available_backends():
+    # type: () -> List[JsonBackend]
+    """Get the JSON backends that are installed, fastest first."""
+    backends = []
+
+    if package_installed("orjson"):
+        backends.append(JsonBackend.orjson)
+
+    if package_installed("ujson"):
+        backends.append(JsonBackend.ujson)
+
+    backends.append(JsonBackend.stdlib)
+
+    return backends
+
+
+_backend = JsonBackend.stdlib
+_dumps = _stdlib_dumps  # type: Callable[[Any], str]
+_loads = _stdlib_loads  # type: Callable[[Union[str, bytes]], Any]
+
+
+def set_json_backend(backend=JsonBackend.auto):
+    # type: (JsonBackend) -> None
+    """Select the JSON backend that nio should use.
+
+    Args:
+        backend (JsonBackend): The backend that should be used, auto selects
+            the fastest installed one.
+
+    Raises an ImportError if the selected backend isn't installed.
+
+    """
+    global _backend, _dumps, _loads
+
+    if backend is JsonBackend.auto:
+        backend = available_backends()[0]
+
+    if backend not in available_backends():
+        raise ImportError(
+            "The {} JSON backend isn't installed".format(backend.value)
+        )
+
+    _backend = backend
+    _dumps, _loads = _BACKENDS[backend]
+
+
+def get_json_backend():
+    # type: () -> JsonBackend
+    """Get the JSON backend that is currently used."""
+    return _backend
+
+
+def dumps(obj):
+    # type: (Any) -> str
+    """Encode an object as compact JSON using the selected backend.
+
+    Non-ASCII characters may or may not be escaped depending on the backend.
+    """
+    return _dumps(obj)
+
+
+def loads(data):
+    # type: (Union[str, bytes]) -> Any
+    """Decode a JSON document using the selected backend.
+
+    Raises a json.JSONDecodeError if the document isn't valid JSON.
+    """
+    return _loads(data)
+
+
+def canonical_dumps(obj):
+    # type: (Any) -> str
+    """Encode an object as canonical JSON.
+
+    This always uses the standard library, see the module documentation.
+    """
+    return json.dumps(
+        obj,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        sort_keys=True,
+    )
+
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018-2019 Damir Jelić <poljar@termina.org.uk>
+#
+# Permission to use, copy, modify, and/or distribute this software for
+# any purpose with or without fee is hereby granted, provided that the
+# above copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER
+# RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF
+# CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""nio incremental JSON parsing.
+
+This module splits a JSON object that is received in chunks into its members
+while the chunks arrive. Only a single member needs to be kept in memory at a
+time, which bounds the memory that is needed to parse a large response, e.g.
+an initial sync, by the largest member instead of the whole response.
+
+"""
+
+import codecs
+from json import JSONDecodeError, JSONDecoder
+from typing import (Any, AsyncIterable, AsyncIterator, Collection, Set, Tuple,
+                    Union)
+
+Path = Tuple[str, ...]
+
+_WHITESPACE = " \t\n\r"
+
+# Consumed input is dropped from the buffer once it grows over this size.
+_COMPACT_SIZE = 64 * 1024
+
+
+class _StreamReader:
+    """Buffered reader that decodes JSON values from a stream of chunks."""
+
+    def __init__(self, chunks):
+        # type: (AsyncIterable[Union[bytes, str]]) -> None
+        self.chunks = chunks.__aiter__()
+        self.utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    async def fill(self, size=1):
+        # type: (int) -> None
+        """Read at least size more characters unless the stream ends."""
+        if self.pos > _COMPACT_SIZE and self.pos * 2 > len(self.buffer):
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+
+        parts = []
+        read = 0
+
+        while read < size and not self.eof:
+            try:
+                chunk = await self.chunks.__anext__()
+            except StopAsyncIteration:
+                chunk = b""
+                self.eof = True
+
+            if isinstance(chunk, bytes):
+                text = self.utf8_decoder.decode(chunk, final=self.eof)
+            else:
+                text = chunk
+
+            parts.append(text)
+            read += len(text)
+
+        self.buffer += "".join(parts)
+
+    async def peek(self):
+        # type: () -> str
+        """Skip whitespace and return the next character without consuming it.
+
+        Returns an empty string if the stream ended.
+        """
+        while True:
+            while (self.pos < len(self.buffer)
+                   and self.buffer[self.pos] in _WHITESPACE):
+                self.pos += 1
+
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+
+            await self.fill()
+
+    async def expect(self, characters):
+        # type: (str) -> str
+        """Consume the next character, it must be one of the given ones."""
+        char = await self.peek()
+
+        if not char or char not in characters:
+            raise JSONDecodeError(
+                "Expecting one of {!r}".format(characters),
+                self.buffer,
+                self.pos
+            )
+
+        self.pos += 1
+        return char
+
+    async def value(self):
+        # type: () -> Any
+        """Decode the next JSON value."""
+        await self.peek()
+
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(
+                    self.buffer,
+                    self.pos
+                )
+            except JSONDecodeError:
+                if self.eof:
+                    raise
+
+                # The value is probably incomplete. Read at least as much as
+                # we already have buffered before trying again, so large
+                # values are decoded a logarithmic number of times.
+                await self.fill(max(len(self.buffer) - self.pos, 1))
+                continue
+
+            # A number at the end of the buffer may continue in the next
+            # chunk.
+            if end == len(self.buffer) and not self.eof:
+                await self.fill()
+                continue
+
+            self.pos = end
+            return value
+
+
+async def _object_members(reader, path, split_paths, containers):
+    # type: (_StreamReader, Path, Set[Path], Set[Path]) -> AsyncIterator
+    await reader.expect("{")
+
+    if await reader.peek() == "}":
+        await reader.expect("}")
+        return
+
+    while True:
+        if await reader.peek() != '"':
+            raise JSONDecodeError(
+                "Expecting property name enclosed in double quotes",
+                reader.buffer,
+                reader.pos
+            )
+
+        key = await reader.value()
+        await reader.expect(":")
+        member_path = path + (key, )
+
+        if (path not in split_paths and member_path in containers
+                and await reader.peek() == "{"):
+            async for member in _object_members(
+                reader,
+                member_path,
+                split_paths,
+                containers
+            ):
+                yield member
+        else:
+            yield member_path, await reader.value()
+
+        if await reader.expect(",}") == "}":
+            return
+
+
+async def iter_object_members(chunks, split_paths):
+    # type: (AsyncIterable[Union[bytes, str]], Collection[Path]) -> AsyncIterator[Tuple[Path, Any]]  # noqa
+    """Incrementally decode a JSON object from a stream of chunks.
+
+    The members of the objects found at the split paths are decoded and
+    yielded one by one, as soon as they are complete. All other members are
+    yielded as a whole, e.g. for the split path ("rooms", "join") the joined
+    rooms are yielded one by one, the "next_batch" member is yielded as it is.
+
+    Args:
+        chunks (AsyncIterable): The chunks of the UTF-8 encoded JSON
+            document.
+        split_paths (Collection[Tuple[str, ...]]): The paths of the objects
+            whose members should be yielded individually.
+
+    Yields tuples of the path of the member and its decoded value.
+
+    Raises a JSONDecodeError if the document isn't a valid JSON object.
+
+    """
+    split_paths = set(split_paths)
+    containers = {
+        split_path[:length]
+        for split_path in split_paths
+        for length in range(1, len(split_path) + 1)
+    }
+
+    reader = _StreamReader(chunks)
+
+    async for member in _object_members(reader, (), split_paths, containers):
+        yield member
+
+    if await reader.peek():
+        raise JSONDecodeError("Extra data", reader.buffer, reader.pos)
@@ -13,6 +13,7 @@
 # CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
 # CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
+import asyncio
 import time
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
@@ -179,3 +180,64 @@ class TransferMonitor:
     def done(self) -> bool:
         """Whether the transfer is finished."""
         return bool(self.end_time)
+
+
+@dataclass
+class LoopStallMonitor:
+    """Measure how long the asyncio event loop gets blocked.
+
+    While the monitor is running a task wakes up every ``interval`` seconds,
+    a wake up that comes late means that the loop was busy running something
+    else. The ``AsyncClient`` uses a monitor to measure how long processing a
+    sync response stalls the loop.
+
+    Args:
+        interval (float, optional): How many seconds the monitoring task
+            sleeps between wake ups. Defaults to ``0.005``.
+
+    Attributes:
+        max_stall (float): The longest time in seconds that the loop was
+            blocked while the monitor was running.
+    """
+
+    interval: float = 0.005
+
+    max_stall: float = field(init=False, default=0.0)
+
+    _task:       Optional[asyncio.Future] = field(init=False, default=None)
+    _last_check: float                    = field(init=False, default=0.0)
+
+    def _check(self) -> None:
+        now              = asyncio.get_event_loop().time()
+        stall            = now - self._last_check - self.interval
+        self.max_stall   = max(self.max_stall, stall)
+        self._last_check = now
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self._check()
+
+    def start(self) -> None:
+        """Start monitoring the loop, resets ``max_stall``."""
+
+        self.stop()
+        self.max_stall   = 0.0
+        self._last_check = asyncio.get_event_loop().time()
+        self._task       = asyncio.ensure_future(self._run())
+
+    def stop(self) -> float:
+        """Stop monitoring the loop.
+
+        Returns the longest time in seconds that the loop was blocked while
+        the monitor was running.
+        """
+
+        if self._task:
+            # Account for the time since the last wake up, the loop might
+            # have been blocked until now.
+            self._check()
+            self._task.cancel()
+            self._task = None
+
+        return self.max_stall
@@ -18,20 +18,23 @@
 from __future__ import unicode_literals
 
 from builtins import str
+from contextlib import ExitStack
 from dataclasses import dataclass, field
 from datetime import datetime
 from functools import wraps
-from typing import Any, Dict, List, Optional, Set, Tuple, Union
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
 
 from jsonschema.exceptions import SchemaError, ValidationError
 from logbook import Logger
 
 from .event_builders import ToDeviceMessage
 from .events import (AccountDataEvent, BadEventType, Event, InviteEvent,
-                     ToDeviceEvent, EphemeralEvent)
+                     ToDeviceEvent, EphemeralEvent, lazy_events)
+from .events.registry import custom_event_types
 from .http import TransportResponse
 from .log import logger_group
-from .schemas import Schemas, validate_json
+from .schemas import (Schemas, ValidationLevel, use_compiled_validators,
+                      validate_json, validation_level)
 
 logger = Logger("nio.responses")
 logger_group.add_logger(logger)
@@ -119,6 +122,8 @@ __all__ = [
     "RoomReadMarkersError",
     "UploadResponse",
     "UploadError",
+    "UploadFilterResponse",
+    "UploadFilterError",
     "ProfileGetResponse",
     "ProfileGetError",
     "ProfileGetDisplayNameResponse",
@@ -397,6 +402,11 @@ class RoomResolveAliasError(ErrorResponse):
     pass
 
 
+class UploadFilterError(ErrorResponse):
+    """A response representing a unsuccessful filter upload request."""
+    pass
+
+
 class RoomTypingError(_ErrorWithRoomId):
     """A response representing a unsuccessful room typing request."""
 
@@ -873,6 +883,26 @@ class RoomResolveAliasResponse(Response):
         return cls(room_alias, room_id, servers)
 
 
+@dataclass
+class UploadFilterResponse(Response):
+    """A response containing the id of an uploaded filter.
+
+    Attributes:
+        filter_id (str): The id of the filter, it can be used in place of the
+            filter definition for sync and room messages requests.
+    """
+    filter_id: str = field()
+
+    @classmethod
+    @verify(Schemas.upload_filter, UploadFilterError)
+    def from_dict(
+        cls,
+        parsed_dict,  # type: Dict[Any, Any]
+    ):
+        # type: (...) -> Union[UploadFilterResponse, ErrorResponse]
+        return cls(parsed_dict["filter_id"])
+
+
 class EmptyResponse(Response):
     @staticmethod
     def create_error(parsed_dict):
@@ -1574,8 +1604,26 @@ class _SyncResponse(Response):
         return join_info, unhandled_info
 
     @staticmethod
-    def _get_room_info(parsed_dict, max_events=0):
-        # type: (Dict[Any, Any], int) -> Tuple[Rooms, Dict[str, RoomInfo]]
+    def _get_joined_room(room_dict, max_events=0):
+        # type: (Dict[Any, Any], int) -> Tuple[RoomInfo, Optional[RoomInfo]]
+        return _SyncResponse._get_join_info(
+            room_dict["state"]["events"],
+            room_dict["timeline"]["events"],
+            room_dict["timeline"]["prev_batch"],
+            room_dict["timeline"]["limited"],
+            room_dict["ephemeral"]["events"],
+            room_dict.get("summary", {}),
+            room_dict["account_data"]["events"],
+            max_events
+        )
+
+    @staticmethod
+    def _get_room_info(
+        parsed_dict,    # type: Dict[Any, Any]
+        max_events=0,   # type: int
+        joined=None,    # type: Optional[Iterable[JoinedRoomType]]
+    ):
+        # type: (...) -> Tuple[Rooms, Dict[str, RoomInfo]]
         joined_rooms = {
             key: None for key in parsed_dict["join"].keys()
         }  # type: Dict[str, Optional[RoomInfo]]
@@ -1594,18 +1642,13 @@ class _SyncResponse(Response):
             leave_info = RoomInfo(timeline, state, [], [])
             left_rooms[room_id] = leave_info
 
-        for room_id, room_dict in parsed_dict["join"].items():
-            join_info, unhandled_info = _SyncResponse._get_join_info(
-                room_dict["state"]["events"],
-                room_dict["timeline"]["events"],
-                room_dict["timeline"]["prev_batch"],
-                room_dict["timeline"]["limited"],
-                room_dict["ephemeral"]["events"],
-                room_dict.get("summary", {}),
-                room_dict["account_data"]["events"],
+        if joined is None:
+            joined = _parse_joined_rooms(
+                parsed_dict["join"].items(),
                 max_events
             )
 
+        for room_id, join_info, unhandled_info in joined:
             if unhandled_info:
                 unhandled_rooms[room_id] = unhandled_info
 
@@ -1613,14 +1656,52 @@ class _SyncResponse(Response):
 
         return Rooms(invited_rooms, joined_rooms, left_rooms), unhandled_rooms
 
+    @staticmethod
+    def _get_single_room(membership, room_id, room_dict):
+        # type: (str, str, Dict[Any, Any]) -> Rooms
+        """Parse a single room of a sync response.
+
+        This is used if the sync response is parsed incrementally, one room at
+        a time.
+
+        Args:
+            membership (str): The membership of the room in the sync response,
+                one of "invite", "join" or "leave".
+            room_id (str): The id of the room.
+            room_dict (dict): The dictionary representation of the room.
+
+        Raises a ValidationError if the room dictionary isn't valid.
+        """
+        rooms_dict = {
+            "invite": {}, "join": {}, "leave": {}
+        }  # type: Dict[str, Dict[str, Any]]
+        rooms_dict[membership] = {room_id: room_dict}
+
+        validate_json(rooms_dict, Schemas.sync_rooms)
+        rooms, _ = _SyncResponse._get_room_info(rooms_dict)
+
+        return rooms
+
     @classmethod
     @verify(Schemas.sync, SyncError, False)
     def from_dict(
         cls,
         parsed_dict,  # type: Dict[Any, Any]
         max_events=0,  # type: int
+        joined_rooms=None,  # type: Optional[Iterable[JoinedRoomType]]
     ):
         # type: (...) -> Union[SyncType, ErrorResponse]
+        """Create a sync response from its dictionary representation.
+
+        Args:
+            parsed_dict (dict): The sync response dictionary.
+            max_events (int): The maximum number of events of a room that
+                should be parsed, the rest is left for the next part of a
+                PartialSyncResponse. 0 parses all events.
+            joined_rooms (Iterable, optional): The joined rooms of the
+                response, already parsed with parse_joined_rooms(). The
+                rooms are parsed here if this isn't given.
+        """
         to_device = cls._get_to_device(parsed_dict["to_device"])
 
         key_count_dict = parsed_dict["device_one_time_keys_count"]
@@ -1635,7 +1716,7 @@ class _SyncResponse(Response):
         )
 
         rooms, unhandled_rooms = _SyncResponse._get_room_info(
-            parsed_dict["rooms"], max_events)
+            parsed_dict["rooms"], max_events, joined_rooms)
 
         if unhandled_rooms:
             return PartialSyncResponse(
@@ -1716,3 +1797,59 @@ class PartialSyncResponse(_SyncResponse):
 
 
 SyncType = Union[SyncResponse, PartialSyncResponse]
+JoinedRoomType = Tuple[str, RoomInfo, Optional[RoomInfo]]
+
+
+def _parse_joined_rooms(rooms, max_events=0):
+    # type: (Iterable[Tuple[str, Dict[Any, Any]]], int) -> List[JoinedRoomType]
+    return [
+        (room_id, ) + _SyncResponse._get_joined_room(room_dict, max_events)
+        for room_id, room_dict in rooms
+    ]
+
+
+def parse_joined_rooms(
+    rooms,                          # type: List[Tuple[str, Dict[Any, Any]]]
+    max_events=0,                   # type: int
+    level=ValidationLevel.full,     # type: ValidationLevel
+    lazy=False,                     # type: bool
+    event_types=None,               # type: Optional[List[Any]]
+    compiled_validators=None,       # type: Optional[bool]
+):
+    # type: (...) -> List[JoinedRoomType]
+    """Parse a batch of joined rooms of a sync response.
+
+    Joined rooms are parsed independently of each other, this function allows
+    to spread the rooms of a large sync response over an executor and pass
+    the results to SyncResponse.from_dict(). It can be sent to a process
+    pool, the validation level and lazy event mode are passed as arguments
+    since they are thread local settings. Worker processes don't share the
+    global settings of the client process either, the custom event types and
+    the compiled validator mode can be passed along for them.
+
+    Args:
+        rooms (List[Tuple[str, dict]]): The room ids and room dictionaries of
+            the joined rooms, in the order they appear in the response.
+        max_events (int): The maximum number of events per room that should
+            be parsed.
+        level (ValidationLevel): How thoroughly the events should be
+            validated.
+        lazy (bool): Should the events be parsed lazily.
+        event_types (List[Tuple[str, type, str]], optional): The custom event
+            classes that should be registered while the rooms are parsed, as
+            returned by registered_event_types(). Must only be given in a
+            worker process. Defaults to the current registrations.
+        compiled_validators (bool, optional): Should the compiled schema
+            checks be used. Defaults to the current setting.
+    """
+    if compiled_validators is not None:
+        use_compiled_validators(compiled_validators)
+
+    with ExitStack() as stack:
+        stack.enter_context(validation_level(level))
+        stack.enter_context(lazy_events(lazy))
+
+        if event_types is not None:
+            stack.enter_context(custom_event_types(event_types))
+
+        return _parse_joined_rooms(rooms, max_events)
@@ -16,21 +16,28 @@
 
 from __future__ import unicode_literals
 
+import heapq
+import time
+from array import array
 from builtins import super
-from collections import defaultdict
-from typing import (Any, DefaultDict, Dict, List, NamedTuple, Optional, Tuple,
-                    Union)
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import MutableMapping
+from sys import intern
+from typing import (Any, Deque, Dict, Iterable, Iterator, List, NamedTuple,
+                    Optional, Set, Tuple, Union)
 
 from jsonschema.exceptions import SchemaError, ValidationError
 from logbook import Logger
 
-from .events import (Event, InviteAliasEvent, InviteMemberEvent,
+from .events import (BadEvent, Event, InviteAliasEvent, InviteMemberEvent,
+                     MegolmEvent,
                      InviteNameEvent, PowerLevels, PowerLevelsEvent,
                      RoomAliasEvent, RoomCreateEvent, RoomEncryptionEvent,
                      RoomGuestAccessEvent, RoomHistoryVisibilityEvent,
                      RoomJoinRulesEvent, RoomMemberEvent, RoomNameEvent,
                      RoomTopicEvent, RoomAvatarEvent, TypingNoticeEvent,
                      ReceiptEvent, Receipt)
+from .json_backend import dumps
 from .log import logger_group
 from .responses import RoomSummary
 
@@ -41,14 +48,30 @@ __all__ = [
     "MatrixRoom",
     "MatrixInvitedRoom",
     "MatrixUser",
+    "MemberNames",
+    "MemberTable",
+    "RoomTimeline",
+    "TimelineCache",
 ]
 
 
 class MatrixRoom:
-    """Represents a Matrix room."""
-
-    def __init__(self, room_id, own_user_id, encrypted=False):
-        # type: (str, str, bool) -> None
+    """Represents a Matrix room.
+
+    If `compact_members` is set the members of the room are kept in a
+    `MemberTable` instead of a dictionary of `MatrixUser` objects and the
+    display names in a `MemberNames` index, which need a fraction of the
+    memory for rooms with many members. The `users`, `invited_users` and
+    `names` attributes are then mappings, but not dictionaries, and can be
+    read as before. Looking up a name in `names` returns a new list, an
+    empty one for unknown names, so changing that list doesn't change the
+    room. The members and their names should only be changed with the
+    methods of the room, e.g. `add_member()` and `remove_member()`.
+    """
+
+    def __init__(self, room_id, own_user_id, encrypted=False,
+                 compact_members=False):
+        # type: (str, str, bool, bool) -> None
         """Initialize a MatrixRoom object."""
         # yapf: disable
         self.room_id = room_id        # type: str
@@ -62,17 +85,26 @@ class MatrixRoom:
         self.canonical_alias = None   # type: Optional[str]
         self.topic = None             # type: Optional[str]
         self.name = None              # type: Optional[str]
-        self.users = dict()           # type: Dict[str, MatrixUser]
-        self.invited_users = dict()   # type: Dict[str, MatrixUser]
-        self.names = defaultdict(list)  # type: DefaultDict[str, List[str]]
+        self.users = dict()           # type: MutableMapping[str, MatrixUser]
+        self.invited_users = dict()   # type: MutableMapping[str, MatrixUser]
+        self.names = defaultdict(list)  # type: MutableMapping[str, List[str]]
         self.encrypted = encrypted    # type: bool
         self.power_levels = PowerLevels()  # type: PowerLevels
         self.typing_users = []        # type: List[str]
         self.read_receipts = {}       # type: Dict[str, Receipt]
         self.summary = None           # type: Optional[RoomSummary]
         self.room_avatar_url = None        # type: Optional[str]
+        self.lazy_members = dict()    # type: Dict[str, float]
+        self.timeline = None          # type: Optional[RoomTimeline]
+        self._members_version = 0     # type: int
+        self._display_name_cache = None  # type: Optional[Tuple[Any, str]]
         # yapf: enable
 
+        if compact_members:
+            self.users = MemberTable()
+            self.invited_users = self.users.invited
+            self.names = MemberNames()
+
     @property
     def display_name(self) -> str:
         """Calculate display name for a room.
@@ -82,8 +114,38 @@ class MatrixRoom:
 
         Follows:
         https://matrix.org/docs/spec/client_server/r0.6.0#id342
+
+        The name is cached until the members, their names, the room name,
+        canonical alias or summary change.
         """
-        return self.named_room_name() or self.group_name()
+        key = self._display_name_key()
+
+        if self._display_name_cache and self._display_name_cache[0] == key:
+            return self._display_name_cache[1]
+
+        display_name = self.named_room_name() or self.group_name()
+        self._display_name_cache = (key, display_name)
+
+        return display_name
+
+    def _display_name_key(self) -> Tuple[Any, ...]:
+        summary = self.summary
+
+        if summary:
+            summary_key = (
+                summary.joined_member_count,
+                summary.invited_member_count,
+                tuple(summary.heroes or ()),
+            )
+        else:
+            summary_key = None
+
+        return (
+            self._members_version,
+            self.name,
+            self.canonical_alias,
+            summary_key,
+        )
 
     def named_room_name(self) -> Optional[str]:
         """Return the name of the room if it's a named room, otherwise None."""
@@ -124,16 +186,19 @@ class MatrixRoom:
         try:
             heroes, joined, invited = self._summary_details()
         except ValueError:
+            # Only the first five names are needed, don't sort all members.
             users = [
-                u for u in sorted(self.users, key=lambda u: self.user_name(u))
+                u for u in heapq.nsmallest(
+                    6, self.users, key=lambda u: self.user_name(u) or u
+                )
                 if u != self.own_user_id
-            ]
-            empty = not users
+            ][:5]
+            others = len(self.users) - len(users)
 
-            if len(users) <= 5:
-                return (empty, users, 0)
+            if self.own_user_id in self.users:
+                others -= 1
 
-            return (empty, users[:5], len(users) - 5)
+            return (not users, users, others)
 
         empty = self.member_count <= 1
 
@@ -153,7 +218,7 @@ class MatrixRoom:
             return None
 
         user = self.users[user_id]
-        if len(self.names[user.name]) > 1:
+        if self._name_count(user.name) > 1:
             return user.disambiguated_name
         return user.name
 
@@ -234,6 +299,12 @@ class MatrixRoom:
         if user_id in self.users:
             return False
 
+        # Share the strings between the rooms the user is a member of.
+        user_id = intern(user_id)
+
+        if display_name:
+            display_name = intern(display_name)
+
         level = self.power_levels.users.get(
             user_id,
             self.power_levels.defaults.users_default,
@@ -246,21 +317,104 @@ class MatrixRoom:
             self.invited_users[user_id] = user
 
         name = display_name if display_name else user_id
-        self.names[name].append(user_id)
+        self._add_name(name, user_id)
 
         return True
 
+    def _name_count(self, name: str) -> int:
+        """Get the number of members that use the given name."""
+        user_ids = self.names.get(name)
+
+        if user_ids is None:
+            return 0
+
+        if isinstance(user_ids, str):
+            return 1
+
+        return len(user_ids)
+
+    def _add_name(self, name: str, user_id: str) -> None:
+        self._members_version += 1
+
+        if isinstance(self.names, MemberNames):
+            self.names.add(name, user_id)
+        else:
+            self.names[name].append(user_id)
+
+    def _remove_name(self, name: str, user_id: str) -> None:
+        self._members_version += 1
+
+        if isinstance(self.names, MemberNames):
+            self.names.remove(name, user_id)
+        else:
+            self.names[name].remove(user_id)
+
+    def add_lazy_member(
+        self,
+        user_id:      str,
+        display_name: Optional[str],
+        avatar_url:   Optional[str],
+        invited:      bool = False,
+    ) -> bool:
+        """Add a member that was fetched on demand.
+
+        Members that are fetched because they were missing due to member lazy
+        loading are remembered with the time they were fetched at, so they can
+        be evicted again using `evict_lazy_members()`.
+
+        Returns True if the member was added, False if it was already known.
+        """
+        if not self.add_member(user_id, display_name, avatar_url, invited):
+            return False
+
+        self.lazy_members[user_id] = time.time()
+        return True
+
+    def missing_members(self, user_ids: Iterable[str]) -> List[str]:
+        """Get the users out of the given ones that aren't known members."""
+        return [u for u in dict.fromkeys(user_ids) if u not in self.users]
+
+    def evict_lazy_members(
+        self, ttl: float, now: Optional[float] = None,
+    ) -> List[str]:
+        """Remove the members that were fetched on demand and got stale.
+
+        Members of encrypted rooms are never evicted, they are needed to share
+        room keys with.
+
+        Args:
+            ttl (float): How many seconds a fetched member is kept.
+            now (float, optional): The current time, defaults to time.time().
+
+        Returns the ids of the evicted members.
+        """
+        if self.encrypted or not self.lazy_members:
+            return []
+
+        deadline = (time.time() if now is None else now) - ttl
+
+        evicted = [
+            user_id for user_id, fetched in self.lazy_members.items()
+            if fetched <= deadline and user_id != self.own_user_id
+        ]
+
+        for user_id in evicted:
+            self.remove_member(user_id)
+
+        return evicted
+
     def remove_member(self, user_id: str) -> bool:
+        self.lazy_members.pop(user_id, None)
         user = self.users.pop(user_id, None)
 
         if user:
-            self.names[user.name].remove(user.user_id)
+            self._remove_name(user.name, user.user_id)
 
         invited_user = self.invited_users.pop(user_id, None)
 
         if invited_user:
             try:
-                self.names[invited_user.name].remove(invited_user.user_id)
+                self._remove_name(invited_user.name, invited_user.user_id)
             except ValueError:
                 pass
 
@@ -281,6 +435,9 @@ class MatrixRoom:
         target_user = event.state_key
         invited     = event.membership == "invite"
 
+        # The member is now part of the synced room state.
+        self.lazy_members.pop(target_user, None)
+
         if event.membership in ("invite", "join"):
             # Add member if not already present in self.users,
             # or the member is invited but not present in self.invited_users
@@ -307,9 +464,9 @@ class MatrixRoom:
             # Handle profile changes
 
             if "displayname" in event.content:
-                self.names[user.name].remove(user.user_id)
+                self._remove_name(user.name, user.user_id)
                 user.display_name = event.content["displayname"]
-                self.names[user.name].append(user.user_id)
+                self._add_name(user.name, user.user_id)
 
             if "avatar_url" in event.content:
                 user.avatar_url = event.content["avatar_url"]
@@ -423,7 +580,8 @@ class MatrixRoom:
 
         A `joined_members` request should be done for this room to populate the
         member list. This is crucial for encrypted rooms before sending any
-        messages.
+        messages. Single members can be fetched on demand using
+        `AsyncClient.fetch_room_members()`.
         """
         try:
             _, joined, invited = self._summary_details()
@@ -483,13 +641,17 @@ class MatrixInvitedRoom(MatrixRoom):
 
 
 class MatrixUser:
+    __slots__ = (
+        "user_id", "display_name", "avatar_url", "power_level", "invited"
+    )
+
     def __init__(
         self,
         user_id:      str,
-        display_name: str  = None,
-        avatar_url:   str  = None,
-        power_level:  int  = 0,
-        invited:      bool = False,
+        display_name: Optional[str] = None,
+        avatar_url:   Optional[str] = None,
+        power_level:  int           = 0,
+        invited:      bool          = False,
     ):
         # yapf: disable
         self.user_id = user_id
@@ -510,3 +672,566 @@ class MatrixUser:
             return "{name} ({user_id})".format(name=self.display_name,
                                                user_id=self.user_id)
         return self.user_id
+
+
+class CompactMatrixUser(MatrixUser):
+    """A view of a member that is stored in a MemberTable.
+
+    The attributes are read from and written to the table, the view is only
+    valid while the user is a member of the room.
+    """
+
+    __slots__ = ("_table",)
+
+    def __init__(self, table: "MemberTable", user_id: str) -> None:
+        self._table = table
+        self.user_id = user_id
+
+    @property
+    def _row(self) -> int:
+        return self._table._rows[self.user_id]
+
+    @property  # type: ignore
+    def display_name(self) -> Optional[str]:  # type: ignore
+        return self._table._display_names[self._row]
+
+    @display_name.setter
+    def display_name(self, value: Optional[str]) -> None:
+        self._table._display_names[self._row] = value and intern(value)
+
+    @property  # type: ignore
+    def avatar_url(self) -> Optional[str]:  # type: ignore
+        return self._table._avatar_urls[self._row]
+
+    @avatar_url.setter
+    def avatar_url(self, value: Optional[str]) -> None:
+        self._table._avatar_urls[self._row] = value
+
+    @property  # type: ignore
+    def power_level(self) -> int:  # type: ignore
+        return self._table._power_levels[self._row]
+
+    @power_level.setter
+    def power_level(self, value: int) -> None:
+        self._table._power_levels[self._row] = value
+
+    @property  # type: ignore
+    def invited(self) -> bool:  # type: ignore
+        return bool(self._table._invited[self._row])
+
+    @invited.setter
+    def invited(self, value: bool) -> None:
+        self._table._invited[self._row] = value
+
+
+class MemberTable(MutableMapping):
+    """Array backed storage for the members of a room.
+
+    The table behaves like a dictionary mapping user ids to `MatrixUser`
+    objects. The member attributes are stored in flat lists and arrays, one
+    row per member, instead of an object per member. Looking up a member
+    returns a view of its row, storing a `MatrixUser` copies its attributes
+    into the table and removing a member returns a detached copy.
+
+    User ids and display names are interned, so the strings of users that are
+    members of many rooms are shared between the rooms.
+
+    Attributes:
+        invited (InvitedMembers): A dictionary like view of the invited
+            members of the table.
+    """
+
+    def __init__(self) -> None:
+        self._rows: Dict[str, int] = {}
+        self._display_names: List[Optional[str]] = []
+        self._avatar_urls: List[Optional[str]] = []
+        self._power_levels = array("q")
+        self._invited = bytearray()
+        self._free: List[int] = []
+        self.invited = InvitedMembers(self)
+
+    def __getitem__(self, user_id: str) -> MatrixUser:
+        if user_id not in self._rows:
+            raise KeyError(user_id)
+
+        return CompactMatrixUser(self, user_id)
+
+    def __setitem__(self, user_id: str, user: MatrixUser) -> None:
+        row = self._rows.get(user_id)
+
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                row = len(self._display_names)
+                self._display_names.append(None)
+                self._avatar_urls.append(None)
+                self._power_levels.append(0)
+                self._invited.append(0)
+
+            self._rows[intern(user_id)] = row
+
+        display_name = user.display_name
+        self._display_names[row] = display_name and intern(display_name)
+        self._avatar_urls[row] = user.avatar_url
+        self._power_levels[row] = user.power_level
+        self._invited[row] = user.invited
+
+    def __delitem__(self, user_id: str) -> None:
+        row = self._rows.pop(user_id)
+
+        self._display_names[row] = None
+        self._avatar_urls[row] = None
+        self._power_levels[row] = 0
+        self._invited[row] = 0
+        self._free.append(row)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, user_id: object) -> bool:
+        return user_id in self._rows
+
+    def detached(self, user_id: str) -> MatrixUser:
+        """Get a copy of a member that is independent of the table."""
+        row = self._rows[user_id]
+
+        return MatrixUser(
+            user_id,
+            self._display_names[row],
+            self._avatar_urls[row],
+            self._power_levels[row],
+            bool(self._invited[row]),
+        )
+
+    def pop(self, user_id: str, *default: Any) -> Any:
+        if user_id not in self._rows:
+            if default:
+                return default[0]
+            raise KeyError(user_id)
+
+        user = self.detached(user_id)
+        del self[user_id]
+
+        return user
+
+
+class InvitedMembers(MutableMapping):
+    """A view of the invited members of a MemberTable.
+
+    Storing a member marks it as invited, removing it clears the mark, the
+    member stays in the table.
+    """
+
+    def __init__(self, table: MemberTable) -> None:
+        self._table = table
+
+    def __getitem__(self, user_id: str) -> MatrixUser:
+        if user_id not in self:
+            raise KeyError(user_id)
+
+        return self._table[user_id]
+
+    def __setitem__(self, user_id: str, user: MatrixUser) -> None:
+        if user_id not in self._table:
+            self._table[user_id] = user
+
+        self._table._invited[self._table._rows[user_id]] = 1
+
+    def __delitem__(self, user_id: str) -> None:
+        if user_id not in self:
+            raise KeyError(user_id)
+
+        self._table._invited[self._table._rows[user_id]] = 0
+
+    def __iter__(self) -> Iterator[str]:
+        table = self._table
+        return (u for u, row in table._rows.items() if table._invited[row])
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __contains__(self, user_id: object) -> bool:
+        row = self._table._rows.get(user_id)  # type: ignore
+        return row is not None and bool(self._table._invited[row])
+
+    def pop(self, user_id: str, *default: Any) -> Any:
+        if user_id not in self:
+            if default:
+                return default[0]
+            raise KeyError(user_id)
+
+        user = self._table.detached(user_id)
+        del self[user_id]
+
+        return user
+
+
+class MemberNames(dict):
+    """Display names mapped to the ids of the members that use them.
+
+    A name that only one member uses, the common case, maps to the user id
+    itself instead of a list. Looking up a name returns a new list of the
+    user ids, an empty one for unknown names, the index is modified using
+    `add()` and `remove()`.
+    """
+
+    def __getitem__(self, name: str) -> List[str]:
+        user_ids = self.get(name)
+
+        if user_ids is None:
+            return []
+
+        if isinstance(user_ids, str):
+            return [user_ids]
+
+        return list(user_ids)
+
+    def add(self, name: str, user_id: str) -> None:
+        user_ids = self.get(name)
+
+        if user_ids is None:
+            self[name] = user_id
+        elif isinstance(user_ids, str):
+            self[name] = (user_ids, user_id)
+        else:
+            self[name] = user_ids + (user_id,)
+
+    def remove(self, name: str, user_id: str) -> None:
+        """Remove a user id from a name.
+
+        Raises ValueError if the name isn't used by the user.
+        """
+        user_ids = self[name]
+        user_ids.remove(user_id)
+
+        if not user_ids:
+            del self[name]
+        elif len(user_ids) == 1:
+            self[name] = user_ids[0]
+        else:
+            self[name] = tuple(user_ids)
+
+
+def _event_size(event: Union[Event, BadEvent]) -> int:
+    """Get the size of the JSON source of an event in bytes."""
+    source = getattr(event, "_source", None)
+
+    # Compact events keep their source encoded.
+    if isinstance(source, bytes):
+        return len(source)
+
+    return len(dumps(event.source).encode("utf-8"))
+
+
+class RoomTimeline:
+    """A bounded buffer of the latest events of a room.
+
+    The events are ordered by their server timestamp and deduplicated by
+    their event id. Once the buffer is full the oldest events are dropped,
+    events that are older than every buffered event are dropped right away.
+
+    Args:
+        max_events (int, optional): The maximum number of events that are
+            kept.
+        max_bytes (int, optional): The maximum size of the JSON source of
+            the kept events.
+
+    Attributes:
+        events (Deque[Event]): The buffered events, oldest first.
+        byte_size (int): The size of the JSON source of the buffered events,
+            only tracked if max_bytes is set.
+        prev_batch (str, optional): A pagination token that points to the
+            events right before the buffered ones, None if it isn't known.
+    """
+
+    def __init__(
+        self,
+        max_events: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ) -> None:
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.events: Deque[Union[Event, BadEvent]] = deque()
+        self.byte_size = 0
+        self.prev_batch: Optional[str] = None
+        # The ids of the buffered events mapped to the size of their source,
+        # the size is only computed if max_bytes is set.
+        self._event_sizes: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __iter__(self) -> Iterator[Union[Event, BadEvent]]:
+        return iter(self.events)
+
+    def __contains__(self, event_id: object) -> bool:
+        return event_id in self._event_sizes
+
+    def latest(self, count: int) -> List[Union[Event, BadEvent]]:
+        """Get the latest events of the room, oldest first.
+
+        Args:
+            count (int): The maximum number of events to return.
+        """
+        if count <= 0:
+            return []
+
+        start = max(len(self.events) - count, 0)
+        return [self.events[i] for i in range(start, len(self.events))]
+
+    def clear(self) -> None:
+        self.events.clear()
+        self._event_sizes.clear()
+        self.byte_size = 0
+        self.prev_batch = None
+
+    def add(self, event: Any) -> bool:
+        """Add an event to the timeline.
+
+        Events that aren't room events are ignored. An event that is already
+        part of the timeline is only replaced if the buffered one is
+        undecrypted and the new one isn't.
+
+        Returns True if the event was added, False otherwise.
+        """
+        if not isinstance(event, (Event, BadEvent)):
+            return False
+
+        if event.event_id in self._event_sizes:
+            self._replace(event)
+            return False
+
+        events = self.events
+        timestamp = event.server_timestamp
+
+        if not events or events[-1].server_timestamp <= timestamp:
+            events.append(event)
+        else:
+            index = len(events)
+
+            while index and events[index - 1].server_timestamp > timestamp:
+                index -= 1
+
+            events.insert(index, event)
+
+        size = _event_size(event) if self.max_bytes is not None else 0
+        self._event_sizes[event.event_id] = size
+        self.byte_size += size
+
+        self._trim(event)
+
+        return event.event_id in self._event_sizes
+
+    def add_events(self, events: Iterable[Any]) -> int:
+        """Add multiple events to the timeline.
+
+        Returns the number of events that were added.
+        """
+        return sum(1 for event in events if self.add(event))
+
+    def _replace(self, event: Union[Event, BadEvent]) -> None:
+        if isinstance(event, MegolmEvent):
+            return
+
+        for index, old_event in enumerate(self.events):
+            if old_event.event_id != event.event_id:
+                continue
+
+            if isinstance(old_event, MegolmEvent):
+                self.events[index] = event
+
+                if self.max_bytes is not None:
+                    size = _event_size(event)
+                    self.byte_size += size - self._event_sizes[event.event_id]
+                    self._event_sizes[event.event_id] = size
+                    self._trim()
+
+            return
+
+    def _trim(self, new_event: Any = None) -> None:
+        events = self.events
+
+        while events and (
+            (self.max_events is not None and len(events) > self.max_events)
+            or (self.max_bytes is not None and self.byte_size > self.max_bytes)
+        ):
+            event = events.popleft()
+            self.byte_size -= self._event_sizes.pop(event.event_id, 0)
+
+            # The buffered events don't start at the token anymore, unless
+            # the new event was older than all of them.
+            if event is not new_event:
+                self.prev_batch = None
+
+
+class TimelineCache:
+    """The timelines of multiple rooms with a global limit.
+
+    Every room gets its own `RoomTimeline`, which is available as the
+    `timeline` attribute of the room. If the events of all timelines exceed
+    the global limit, the timelines of the rooms that were least recently
+    updated are dropped.
+
+    Args:
+        max_events (int, optional): The maximum number of events that are
+            kept per room.
+        max_bytes (int, optional): The maximum size of the events that are
+            kept per room.
+        max_total_events (int, optional): The maximum number of events that
+            are kept for all rooms.
+    """
+
+    def __init__(
+        self,
+        max_events: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        max_total_events: Optional[int] = None,
+    ) -> None:
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.max_total_events = max_total_events
+        self.total_events = 0
+        self._rooms: "OrderedDict[str, MatrixRoom]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._rooms)
+
+    def add_events(
+        self,
+        room: MatrixRoom,
+        events: Iterable[Any],
+        limited: bool = False,
+        prev_batch: Optional[str] = None,
+    ) -> int:
+        """Add the latest events of a room, e.g. of a sync response.
+
+        Args:
+            room (MatrixRoom): The room the events belong to.
+            events (Iterable[Event]): The events that should be added.
+            limited (bool): Are there events missing between the buffered
+                events and the new ones, the buffered events are dropped if
+                so.
+            prev_batch (str, optional): A pagination token that points to
+                the events right before the new ones. It is kept if the
+                timeline starts with the new events.
+
+        Returns the number of events that were added.
+        """
+        timeline = room.timeline
+
+        if timeline is None or self._rooms.get(room.room_id) is not room:
+            self.drop(room.room_id)
+            timeline = RoomTimeline(self.max_events, self.max_bytes)
+            room.timeline = timeline
+            self._rooms[room.room_id] = room
+
+        before = len(timeline)
+
+        if limited:
+            timeline.clear()
+
+        if not timeline.events:
+            timeline.prev_batch = prev_batch
+
+        return self._add(room, timeline, events, before)
+
+    def add_history(
+        self,
+        room: MatrixRoom,
+        events: Iterable[Any],
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+    ) -> int:
+        """Add a page of events from the history of a room.
+
+        The page, e.g. the events of a room messages or room context
+        response, is only added if it touches the buffered events: if one of
+        its events is already buffered, or if it was requested backwards from
+        the pagination token of the timeline. Pages from other parts of the
+        history are ignored, they would leave a gap in the timeline.
+
+        Args:
+            room (MatrixRoom): The room the events belong to.
+            events (Iterable[Event]): The events of the page.
+            start (str, optional): The pagination token the page was
+                requested from.
+            end (str, optional): The pagination token that points to the
+                events after the page, in the direction of the request.
+
+        Returns the number of events that were added.
+        """
+        timeline = room.timeline
+
+        if (
+            timeline is None
+            or not timeline.events
+            or self._rooms.get(room.room_id) is not room
+        ):
+            return 0
+
+        events = list(events)
+        continues = start is not None and start == timeline.prev_batch
+
+        if not continues and not any(
+            getattr(event, "event_id", None) in timeline for event in events
+        ):
+            return 0
+
+        added = self._add(room, timeline, events, len(timeline))
+
+        # The timeline only starts at the end of the page if the whole page
+        # was kept and none of the older buffered events were dropped.
+        if (
+            continues
+            and timeline.prev_batch == start
+            and all(
+                event.event_id in timeline for event in events
+                if isinstance(event, (Event, BadEvent))
+            )
+        ):
+            timeline.prev_batch = end
+
+        return added
+
+    def _add(
+        self,
+        room: MatrixRoom,
+        timeline: RoomTimeline,
+        events: Iterable[Any],
+        before: int,
+    ) -> int:
+        self._rooms.move_to_end(room.room_id)
+
+        added = timeline.add_events(events)
+        self.total_events += len(timeline) - before
+
+        self._evict()
+
+        return added
+
+    def drop(self, room_id: str) -> None:
+        """Drop the timeline of a room."""
+        room = self._rooms.pop(room_id, None)
+
+        if room is None or room.timeline is None:
+            return
+
+        self.total_events -= len(room.timeline)
+        room.timeline = None
+
+    def _evict(self) -> None:
+        if self.max_total_events is None:
+            return
+
+        # Never drop the timeline that was just updated.
+        while (
+            self.total_events > self.max_total_events
+            and len(self._rooms) > 1
+        ):
+            room_id = next(iter(self._rooms))
+            logger.info("Dropping the timeline of room {}".format(room_id))
+            self.drop(room_id)
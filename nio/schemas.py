@@ -17,6 +17,14 @@
 
 from __future__ import unicode_literals
 
+import numbers
+import re
+import threading
+from copy import deepcopy
+from contextlib import contextmanager
+from enum import Enum, unique
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
 from jsonschema import Draft4Validator, FormatChecker, validators
 
 RoomRegex = "^!.+:.+$"
@@ -60,8 +68,578 @@ def check_user_id(value):
     return True
 
 
+_format_checker = FormatChecker()
+
+# Validators for the schemas defined in the Schemas class, keyed by the id of
+# the schema dictionary. Populated lazily by get_validator().
+_validators = {}  # type: Dict[int, Any]
+
+
+def get_validator(schema):
+    # type: (Dict[str, Any]) -> Any
+    """Get a validator for the given schema.
+
+    Validators for schemas that are defined in the Schemas class are built
+    once, on first use, and reused for every subsequent validation. A new
+    validator is built for any other schema.
+
+    Args:
+        schema (dict): The json schema the validator should check against.
+    """
+    validator = _validators.get(id(schema))
+
+    if validator is not None and validator.schema is schema:
+        return validator
+
+    validator = Validator(schema, format_checker=_format_checker)
+
+    if id(schema) in _known_schemas:
+        _validators[id(schema)] = validator
+
+    return validator
+
+
+class _UncompilableSchema(Exception):
+    pass
+
+
+def _is_number(instance):
+    return isinstance(instance, numbers.Number) and not isinstance(
+        instance, bool
+    )
+
+
+def _is_integer(instance):
+    return isinstance(instance, int) and not isinstance(instance, bool)
+
+
+_type_checks = {
+    "array": lambda instance: isinstance(instance, list),
+    "boolean": lambda instance: isinstance(instance, bool),
+    "integer": _is_integer,
+    "null": lambda instance: instance is None,
+    "number": _is_number,
+    "object": lambda instance: isinstance(instance, dict),
+    "string": lambda instance: isinstance(instance, str),
+}
+
+
+def _unbool(element, true=object(), false=object()):
+    # Same trick as jsonschema uses so that 1 and True don't compare equal
+    # in enums.
+    if element is True:
+        return true
+    elif element is False:
+        return false
+    return element
+
+
+def _compile_type(types, schema):
+    if not isinstance(types, list):
+        types = [types]
+
+    try:
+        checks = [_type_checks[t] for t in types]
+    except (KeyError, TypeError):
+        raise _UncompilableSchema()
+
+    if len(checks) == 1:
+        return checks[0]
+
+    return lambda instance: any(check(instance) for check in checks)
+
+
+def _compile_properties(properties, schema):
+    defaults = [
+        (name, subschema["default"])
+        for name, subschema in properties.items()
+        if "default" in subschema
+    ]
+    checks = [
+        (name, _compile(subschema)) for name, subschema in properties.items()
+    ]
+
+    def check(instance):
+        if not isinstance(instance, dict):
+            # The defaults extension would blow up on a non-object, leave it
+            # to the full validator to report that.
+            return not defaults
+
+        for name, default in defaults:
+            instance.setdefault(name, default)
+
+        for name, subcheck in checks:
+            if name in instance and not subcheck(instance[name]):
+                return False
+
+        return True
+
+    return check
+
+
+def _compile_pattern_properties(pattern_properties, schema):
+    checks = [
+        (re.compile(pattern), _compile(subschema))
+        for pattern, subschema in pattern_properties.items()
+    ]
+
+    def check(instance):
+        if not isinstance(instance, dict):
+            return True
+
+        for pattern, subcheck in checks:
+            for key, value in instance.items():
+                if pattern.search(key) and not subcheck(value):
+                    return False
+
+        return True
+
+    return check
+
+
+def _compile_additional_properties(additional, schema):
+    properties = schema.get("properties", {})
+    patterns = "|".join(schema.get("patternProperties", {}))
+    pattern = re.compile(patterns) if patterns else None
+
+    if isinstance(additional, dict):
+        subcheck = _compile(additional)
+    elif additional is False:
+        subcheck = None
+    else:
+        return lambda instance: True
+
+    def check(instance):
+        if not isinstance(instance, dict):
+            return True
+
+        for key, value in instance.items():
+            if key in properties or (pattern and pattern.search(key)):
+                continue
+
+            if subcheck is None or not subcheck(value):
+                return False
+
+        return True
+
+    return check
+
+
+def _compile_required(required, schema):
+    def check(instance):
+        if not isinstance(instance, dict):
+            return True
+
+        return all(name in instance for name in required)
+
+    return check
+
+
+def _compile_items(items, schema):
+    if isinstance(items, dict):
+        subcheck = _compile(items)
+
+        def check(instance):
+            if not isinstance(instance, list):
+                return True
+
+            return all(subcheck(item) for item in instance)
+
+        return check
+
+    subchecks = [_compile(subschema) for subschema in items]
+
+    def check_tuple(instance):
+        if not isinstance(instance, list):
+            return True
+
+        return all(
+            subcheck(item) for item, subcheck in zip(instance, subchecks)
+        )
+
+    return check_tuple
+
+
+def _compile_enum(enums, schema):
+    unbooled_enums = [_unbool(e) for e in enums]
+
+    def check(instance):
+        if instance == 0 or instance == 1:
+            unbooled = _unbool(instance)
+            return any(unbooled == e for e in unbooled_enums)
+
+        return instance in enums
+
+    return check
+
+
+def _compile_format(format, schema):
+    return lambda instance: _format_checker.conforms(instance, format)
+
+
+def _compile_minimum(minimum, schema):
+    if schema.get("exclusiveMinimum", False):
+        return lambda instance: not _is_number(instance) or instance > minimum
+
+    return lambda instance: not _is_number(instance) or instance >= minimum
+
+
+def _compile_maximum(maximum, schema):
+    if schema.get("exclusiveMaximum", False):
+        return lambda instance: not _is_number(instance) or instance < maximum
+
+    return lambda instance: not _is_number(instance) or instance <= maximum
+
+
+def _compile_pattern(pattern, schema):
+    regex = re.compile(pattern)
+
+    return lambda instance: (
+        not isinstance(instance, str) or bool(regex.search(instance))
+    )
+
+
+def _compile_not(not_schema, schema):
+    subcheck = _compile(not_schema)
+    return lambda instance: not subcheck(instance)
+
+
+_keyword_compilers = {
+    "additionalProperties": _compile_additional_properties,
+    "enum": _compile_enum,
+    "format": _compile_format,
+    "items": _compile_items,
+    "maximum": _compile_maximum,
+    "minimum": _compile_minimum,
+    "not": _compile_not,
+    "pattern": _compile_pattern,
+    "patternProperties": _compile_pattern_properties,
+    "properties": _compile_properties,
+    "required": _compile_required,
+    "type": _compile_type,
+}
+
+
+def _compile_structural_properties(properties, schema):
+    defaults = [
+        (name, subschema["default"])
+        for name, subschema in properties.items()
+        if "default" in subschema
+    ]
+    checks = [
+        (name, _compile_structural(subschema))
+        for name, subschema in properties.items()
+    ]
+
+    def check(instance):
+        if not isinstance(instance, dict):
+            return not defaults
+
+        for name, default in defaults:
+            instance.setdefault(name, default)
+
+        for name, subcheck in checks:
+            if name in instance and not subcheck(instance[name]):
+                return False
+
+        return True
+
+    return check
+
+
+def _compile_structural_type(types, schema):
+    if types != "object":
+        return None
+
+    return _type_checks["object"]
+
+
+_structural_compilers = {
+    "properties": _compile_structural_properties,
+    "required": _compile_required,
+    "type": _compile_structural_type,
+}
+
+
+def _compile_structural(schema):
+    # type: (Dict[str, Any]) -> Callable[[Any], bool]
+    checks = []  # type: List[Callable[[Any], bool]]
+
+    if isinstance(schema, dict):
+        for keyword, value in schema.items():
+            if keyword in _structural_compilers:
+                check = _structural_compilers[keyword](value, schema)
+
+                if check is not None:
+                    checks.append(check)
+
+    return _all_checks(checks)
+
+
+def _all_checks(checks):
+    # type: (List[Callable[[Any], bool]]) -> Callable[[Any], bool]
+    if not checks:
+        return lambda instance: True
+
+    if len(checks) == 1:
+        return checks[0]
+
+    def check(instance):
+        for subcheck in checks:
+            if not subcheck(instance):
+                return False
+        return True
+
+    return check
+
+
+def _compile(schema):
+    # type: (Dict[str, Any]) -> Callable[[Any], bool]
+    if not isinstance(schema, dict):
+        raise _UncompilableSchema()
+
+    checks = []  # type: List[Callable[[Any], bool]]
+
+    # Keywords are checked in the same order as jsonschema does it, this
+    # matters because the properties keyword sets default values.
+    for keyword, value in schema.items():
+        if keyword in _keyword_compilers:
+            checks.append(_keyword_compilers[keyword](value, schema))
+        elif keyword in Validator.VALIDATORS:
+            raise _UncompilableSchema()
+
+    return _all_checks(checks)
+
+
+def compile_schema(schema):
+    # type: (Dict[str, Any]) -> Optional[Callable[[Any], bool]]
+    """Compile a json schema into a plain Python checking function.
+
+    The returned function takes an instance and returns True if the instance
+    is valid for the schema, it sets default values the same way our
+    validator does. Only the subset of Draft 4 that our schemas use is
+    supported.
+
+    Returns None if the schema uses unsupported keywords.
+
+    Args:
+        schema (dict): The json schema that should be compiled.
+    """
+    try:
+        return _compile(schema)
+    except (_UncompilableSchema, re.error):
+        return None
+
+
+# Compiled checks for the schemas defined in the Schemas class, keyed by the
+# id of the schema dictionary. A value of None means that the schema couldn't
+# be compiled.
+_compiled_checks = {}  # type: Dict[int, Optional[Callable[[Any], bool]]]
+_use_compiled_checks = False
+
+
+def use_compiled_validators(enabled=True):
+    # type: (bool) -> None
+    """Enable or disable the compiled fast path for schema validation.
+
+    If enabled, the schemas of the Schemas class will be compiled into plain
+    Python checking functions on first use. The full jsonschema validator is
+    only used if such a check fails, to produce the validation error, or if a
+    schema can't be compiled. Validation results are the same in both modes.
+
+    Args:
+        enabled (bool): Should the compiled checks be used.
+    """
+    global _use_compiled_checks
+    _use_compiled_checks = enabled
+
+
+def _get_compiled_check(schema):
+    # type: (Dict[str, Any]) -> Optional[Callable[[Any], bool]]
+    key = id(schema)
+
+    if key not in _known_schemas:
+        return None
+
+    try:
+        return _compiled_checks[key]
+    except KeyError:
+        check = compile_schema(schema)
+        _compiled_checks[key] = check
+        return check
+
+
+@unique
+class ValidationLevel(Enum):
+    """Enum representing how thoroughly received events are validated.
+
+    "full" validates every event against its json schema.
+
+    "structural" only checks that the keys the event parsers use are present.
+
+    "none" skips event validation completely, only the default values of the
+    schema are filled in.
+
+    With the "structural" and "none" levels, events that still fail to parse
+    will be turned into a BadEvent, or an UnknownBadEvent if the event lacks
+    its basic fields.
+    """
+
+    full = "full"
+    structural = "structural"
+    none = "none"
+
+
+_local = threading.local()
+
+# Structural checks for the schemas defined in the Schemas class, keyed by the
+# id of the schema dictionary.
+_structural_checks = {}  # type: Dict[int, Callable[[Any], bool]]
+
+# Functions that only set the default values of the schemas defined in the
+# Schemas class, keyed by the id of the schema dictionary.
+_default_setters = {}  # type: Dict[int, Callable[[Any], None]]
+
+
+def get_validation_level():
+    # type: () -> ValidationLevel
+    """Get the event validation level that is in effect for this thread."""
+    return getattr(_local, "validation_level", ValidationLevel.full)
+
+
+@contextmanager
+def validation_level(level):
+    # type: (ValidationLevel) -> Iterator[None]
+    """Context manager setting the event validation level for this thread.
+
+    Args:
+        level (ValidationLevel): The validation level that the event parsers
+            should follow inside the context.
+    """
+    previous_level = get_validation_level()
+    _local.validation_level = level
+
+    try:
+        yield
+    finally:
+        _local.validation_level = previous_level
+
+
+def _get_structural_check(schema):
+    # type: (Dict[str, Any]) -> Callable[[Any], bool]
+    key = id(schema)
+
+    if key not in _known_schemas:
+        return _compile_structural(schema)
+
+    try:
+        return _structural_checks[key]
+    except KeyError:
+        check = _compile_structural(schema)
+        _structural_checks[key] = check
+        return check
+
+
+def _compile_defaults(schema):
+    # type: (Dict[str, Any]) -> Optional[Callable[[Any], None]]
+    properties = schema.get("properties") if isinstance(schema, dict) else None
+
+    if not isinstance(properties, dict):
+        return None
+
+    defaults = [
+        (name, subschema["default"])
+        for name, subschema in properties.items()
+        if isinstance(subschema, dict) and "default" in subschema
+    ]
+    setters = [
+        (name, setter)
+        for name, setter in (
+            (name, _compile_defaults(subschema))
+            for name, subschema in properties.items()
+        )
+        if setter is not None
+    ]
+
+    if not defaults and not setters:
+        return None
+
+    def set_defaults(instance):
+        if not isinstance(instance, dict):
+            return
+
+        for name, default in defaults:
+            if name not in instance:
+                # Don't share mutable defaults between events.
+                instance[name] = (
+                    deepcopy(default)
+                    if isinstance(default, (dict, list)) else default
+                )
+
+        for name, setter in setters:
+            if name in instance:
+                setter(instance[name])
+
+    return set_defaults
+
+
+def _get_default_setter(schema):
+    # type: (Dict[str, Any]) -> Callable[[Any], None]
+    key = id(schema)
+
+    try:
+        return _default_setters[key]
+    except KeyError:
+        pass
+
+    setter = _compile_defaults(schema) or (lambda instance: None)
+
+    if key in _known_schemas:
+        _default_setters[key] = setter
+
+    return setter
+
+
+def validate_event(instance, schema):
+    """Validate an event following the current validation level.
+
+    This is used for events and for the parts of a sync response that hold
+    events. Depending on the level the event gets fully validated, only its
+    structure gets checked or it isn't checked at all.
+
+    Raises a ValidationError if the event isn't valid.
+    """
+    level = get_validation_level()
+
+    if level is ValidationLevel.none:
+        # The event isn't checked but the parsers rely on the default values
+        # of the schema.
+        _get_default_setter(schema)(instance)
+        return
+
+    if level is ValidationLevel.structural:
+        if _get_structural_check(schema)(instance):
+            return
+
+        # Let the full validator produce a proper error.
+        get_validator(schema).validate(instance)
+        return
+
+    validate_json(instance, schema)
+
+
 def validate_json(instance, schema):
-    Validator(schema, format_checker=FormatChecker()).validate(instance)
+    if _use_compiled_checks:
+        check = _get_compiled_check(schema)
+
+        try:
+            if check is not None and check(instance):
+                return
+        except Exception:
+            # Let the full validator decide what happens with this instance.
+            pass
+
+    get_validator(schema).validate(instance)
 
 
 class Schemas:
@@ -291,128 +869,130 @@ class Schemas:
         "required": ["events", "limited", "prev_batch"],
     }
 
-    sync = {
+    sync_rooms = {
         "type": "object",
         "properties": {
-            "device_one_time_keys_count": {
+            "invite": {
                 "type": "object",
-                "properties": {
-                    "curve25519": {"type": "integer", "default": 0},
-                    "signed_curve25519": {"type": "integer", "default": 0},
-                }
-            },
-            "device_lists": {
-                "type": "object",
-                "properties": {
-                    "changed": {"type": "array", "items": {"type": "string"}},
-                    "left": {"type": "array", "items": {"type": "string"}}
-                }
-            },
-            "next_batch": {"type": "string"},
-            "rooms": {
-                "type": "object",
-                "properties": {
-                    "invite": {
+                "patternProperties": {
+                    RoomRegex: {
                         "type": "object",
-                        "patternProperties": {
-                            RoomRegex: {
+                        "properties": {
+                            "invite_state": {
                                 "type": "object",
                                 "properties": {
-                                    "invite_state": {
-                                        "type": "object",
-                                        "properties": {
-                                            "events": {"type": "array"}
-                                        },
-                                        "required": ["events"]
-                                    }
+                                    "events": {"type": "array"}
                                 },
-                                "required": ["invite_state"]
+                                "required": ["events"]
                             }
                         },
-                        "additionalProperties": False,
-                    },
-                    "join": {
+                        "required": ["invite_state"]
+                    }
+                },
+                "additionalProperties": False,
+            },
+            "join": {
+                "type": "object",
+                "patternProperties": {
+                    RoomRegex: {
                         "type": "object",
-                        "patternProperties": {
-                            RoomRegex: {
+                        "properties": {
+                            "timeline": room_timeline,
+                            "state": {
                                 "type": "object",
                                 "properties": {
-                                    "timeline": room_timeline,
-                                    "state": {
-                                        "type": "object",
-                                        "properties": {
-                                            "events": {"type": "array"}
-                                        },
-                                        "required": ["events"]
-                                    },
-                                    "ephemeral": {
-                                        "type": "object",
-                                        "properties": {
-                                            "events": {"type": "array"}
-                                        },
-                                        "required": ["events"]
+                                    "events": {"type": "array"}
+                                },
+                                "required": ["events"]
+                            },
+                            "ephemeral": {
+                                "type": "object",
+                                "properties": {
+                                    "events": {"type": "array"}
+                                },
+                                "required": ["events"]
+                            },
+                            "summary": {
+                                "type": "object",
+                                "properties": {
+                                    "m.invited_member_count": {
+                                        "type": "integer"
                                     },
-                                    "summary": {
-                                        "type": "object",
-                                        "properties": {
-                                            "m.invited_member_count": {
-                                                "type": "integer"
-                                            },
-                                            "m.joined_member_count": {
-                                                "type": "integer"
-                                            },
-                                            "m.heroes": {
-                                                "type": "array",
-                                                "items": {"type": "string"}
-                                            },
-                                        }
+                                    "m.joined_member_count": {
+                                        "type": "integer"
                                     },
-                                    "account_data": {
-                                        "type": "object",
-                                        "properties": {
-                                            "events": {"type": "array"}
-                                        },
-                                        "required": ["events"]
+                                    "m.heroes": {
+                                        "type": "array",
+                                        "items": {"type": "string"}
                                     },
+                                }
+                            },
+                            "account_data": {
+                                "type": "object",
+                                "properties": {
+                                    "events": {"type": "array"}
                                 },
-                                "required": [
-                                    "timeline",
-                                    "state",
-                                    "ephemeral",
-                                    "account_data",
-                                ]
-                            }
+                                "required": ["events"]
+                            },
                         },
-                        "additionalProperties": False,
-                    },
-                    "leave": {
+                        "required": [
+                            "timeline",
+                            "state",
+                            "ephemeral",
+                            "account_data",
+                        ]
+                    }
+                },
+                "additionalProperties": False,
+            },
+            "leave": {
+                "type": "object",
+                "patternProperties": {
+                    RoomRegex: {
                         "type": "object",
-                        "patternProperties": {
-                            RoomRegex: {
+                        "properties": {
+                            "timeline": {
                                 "type": "object",
                                 "properties": {
-                                    "timeline": {
-                                        "type": "object",
-                                        "properties": {
-                                            "events": {"type": "array"}
-                                        },
-                                        "required": ["events"]
-                                    },
-                                    "state": {
-                                        "type": "object",
-                                        "properties": {
-                                            "events": {"type": "array"}
-                                        },
-                                        "required": ["events"]
-                                    }
+                                    "events": {"type": "array"}
                                 },
-                                "required": ["timeline", "state"]
+                                "required": ["events"]
+                            },
+                            "state": {
+                                "type": "object",
+                                "properties": {
+                                    "events": {"type": "array"}
+                                },
+                                "required": ["events"]
                             }
                         },
-                        "additionalProperties": False,
-                    },
+                        "required": ["timeline", "state"]
+                    }
                 },
+                "additionalProperties": False,
             },
+        },
+    }
+
+    sync = {
+        "type": "object",
+        "properties": {
+            "device_one_time_keys_count": {
+                "type": "object",
+                "properties": {
+                    "curve25519": {"type": "integer", "default": 0},
+                    "signed_curve25519": {"type": "integer", "default": 0},
+                }
+            },
+            "device_lists": {
+                "type": "object",
+                "properties": {
+                    "changed": {"type": "array", "items": {"type": "string"}},
+                    "left": {"type": "array", "items": {"type": "string"}}
+                }
+            },
+            "next_batch": {"type": "string"},
+            "rooms": sync_rooms,
             "to_device": {
                 "type": "object",
                 "properties": {
@@ -1023,6 +1603,11 @@ class Schemas:
         "required": ["room_id", "servers"],
     }
 
+    upload_filter = {
+        "type": "object",
+        "properties": {"filter_id": {"type": "string"}},
+        "required": ["filter_id"],
+    }
 
     room_event_id = {
         "type": "object",
@@ -1740,3 +2325,9 @@ class Schemas:
     }
 
     empty = {"type": "object", "properties": {}, "additionalProperties": False}
+
+
+_known_schemas = {
+    id(value) for name, value in vars(Schemas).items()
+    if not name.startswith("_") and isinstance(value, dict)
+}
@@ -30,7 +30,10 @@ if package_installed("olm"):
         DeviceTrustField,
         StoreVersion,
         Keys,
-        SyncTokens
+        SyncTokens,
+        SyncFilters,
+        Rooms,
+        RoomMembers
     )
     from .database import (
         DefaultStore,
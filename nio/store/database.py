@@ -15,19 +15,22 @@ import os
 import sqlite3
 from builtins import super
 from functools import wraps
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Iterable, Mapping, Set, Tuple
 
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
 from peewee import DoesNotExist, SqliteDatabase
 from playhouse.sqliteq import SqliteQueueDatabase
 
 from . import (Accounts, DeviceKeys, DeviceKeys_v1, DeviceTrustState,
                EncryptedRooms, ForwardedChains, Key, Keys, KeyStore,
                MegolmInboundSessions, OlmSessions, OutgoingKeyRequests,
-               StoreVersion, SyncTokens)
+               RoomMembers, Rooms, StoreVersion, SyncFilters, SyncTokens)
 from ..crypto import (DeviceStore, GroupSessionStore, InboundGroupSession,
                       OlmAccount, OlmDevice, OutgoingKeyRequest, Session,
                       SessionStore, TrustState)
+from ..events import DefaultLevels, PowerLevels
+from ..responses import RoomSummary
+from ..rooms import MatrixRoom
 
 
 def use_database(fn):
@@ -73,7 +76,10 @@ class MatrixStore:
         OutgoingKeyRequests,
         StoreVersion,
         Keys,
-        SyncTokens
+        SyncTokens,
+        SyncFilters,
+        Rooms,
+        RoomMembers
     ]
     store_version = 2
 
@@ -220,6 +226,34 @@ class MatrixStore:
 
         return session_store
 
+    @use_database
+    def load_sessions_for_key(self, sender_key):
+        # type: (str) -> List[Session]
+        """Load the Olm sessions of a single curve25519 key from the database.
+
+        Args:
+            sender_key (str): The curve key that owns the Olm sessions.
+
+        Returns a list of the sessions, the most recently used one first.
+        """
+        account = self._get_account()
+
+        if not account:
+            return []
+
+        query = OlmSessions.select().where(
+            (OlmSessions.account == account)
+            & (OlmSessions.sender_key == sender_key)
+        )
+
+        sessions = [
+            Session.from_pickle(s.session, s.creation_time, self.pickle_key)
+            for s in query
+        ]
+        sessions.sort(key=lambda x: x.use_time, reverse=True)
+
+        return sessions
+
     @use_database
     def save_session(self, sender_key, session):
         """Save the provided Olm session to the database.
@@ -241,6 +275,40 @@ class MatrixStore:
             last_usage_date=session.use_time
         ).execute()
 
+    @use_database_atomic
+    def save_sessions(self, sessions):
+        # type: (List[Tuple[str, Session]]) -> None
+        """Save multiple Olm sessions to the database in one transaction.
+
+        Args:
+            sessions (List[Tuple[str, Session]]): Tuples of the curve key that
+                owns a session and the session itself.
+        """
+        account = self._get_account()
+        assert account
+
+        data = [
+            (
+                account,
+                sender_key,
+                session.pickle(self.pickle_key),
+                session.id,
+                session.creation_time,
+                session.use_time
+            ) for sender_key, session in sessions
+        ]
+
+        for idx in range(0, len(data), 100):
+            rows = data[idx:idx + 100]
+            OlmSessions.insert_many(rows, fields=[
+                OlmSessions.account,
+                OlmSessions.sender_key,
+                OlmSessions.session,
+                OlmSessions.session_id,
+                OlmSessions.creation_time,
+                OlmSessions.last_usage_date
+            ]).on_conflict_replace().execute()
+
     @use_database
     def load_inbound_group_sessions(self):
         # type: () -> GroupSessionStore
@@ -270,6 +338,42 @@ class MatrixStore:
 
         return store
 
+    @use_database
+    def load_inbound_group_session(self, room_id, sender_key, session_id):
+        # type: (str, str, str) -> Optional[InboundGroupSession]
+        """Load a single Megolm inbound group session from the database.
+
+        Args:
+            room_id (str): The room the session belongs to.
+            sender_key (str): The curve25519 key of the session creator.
+            session_id (str): The id of the session.
+
+        Returns the session or None if it isn't stored.
+        """
+        account = self._get_account()
+
+        if not account:
+            return None
+
+        s = MegolmInboundSessions.get_or_none(
+            MegolmInboundSessions.room_id == room_id,
+            MegolmInboundSessions.sender_key == sender_key,
+            MegolmInboundSessions.session_id == session_id,
+            MegolmInboundSessions.account == account
+        )
+
+        if not s:
+            return None
+
+        return InboundGroupSession.from_pickle(
+            s.session,
+            s.fp_key,
+            s.sender_key,
+            s.room_id,
+            self.pickle_key,
+            [chain.sender_key for chain in s.forwarded_chains]
+        )
+
     @use_database
     def save_inbound_group_session(self, session):
         """Save the provided Megolm inbound group session to the database.
@@ -277,35 +381,58 @@ class MatrixStore:
         Args:
             session (InboundGroupSession): The session to save.
         """
+        self.save_inbound_group_sessions([session])
+
+    @use_database_atomic
+    def save_inbound_group_sessions(self, sessions):
+        # type: (List[InboundGroupSession]) -> None
+        """Save multiple Megolm inbound group sessions in one transaction.
+
+        Sessions that are already stored only get their pickle updated.
+
+        Args:
+            sessions (List[InboundGroupSession]): The sessions to save.
+        """
         account = self._get_account()
         assert account
 
-        MegolmInboundSessions.insert(
-            sender_key=session.sender_key,
-            account=account,
-            fp_key=session.ed25519,
-            room_id=session.room_id,
-            session=session.pickle(self.pickle_key),
-            session_id=session.id
-        ).on_conflict_ignore().execute()
-
-        MegolmInboundSessions.update(
-            {
-                MegolmInboundSessions.session: session.pickle(
-                    self.pickle_key
-                )
-            }
-        ).where(
-            MegolmInboundSessions.session_id == session.id
-        ).execute()
+        data = [
+            (
+                session.sender_key,
+                account,
+                session.ed25519,
+                session.room_id,
+                session.pickle(self.pickle_key),
+                session.id
+            ) for session in sessions
+        ]
 
-        # TODO, use replace many here
-        for chain in session.forwarding_chain:
-            ForwardedChains.replace(
-                sender_key=chain,
-                session=session.id
+        for idx in range(0, len(data), 100):
+            rows = data[idx:idx + 100]
+            MegolmInboundSessions.insert_many(rows, fields=[
+                MegolmInboundSessions.sender_key,
+                MegolmInboundSessions.account,
+                MegolmInboundSessions.fp_key,
+                MegolmInboundSessions.room_id,
+                MegolmInboundSessions.session,
+                MegolmInboundSessions.session_id
+            ]).on_conflict(
+                conflict_target=[MegolmInboundSessions.session_id],
+                preserve=[MegolmInboundSessions.session]
             ).execute()
 
+        chains = [
+            (chain, session.id)
+            for session in sessions for chain in session.forwarding_chain
+        ]
+
+        for idx in range(0, len(chains), 400):
+            chain_rows = chains[idx:idx + 400]
+            ForwardedChains.insert_many(chain_rows, fields=[
+                ForwardedChains.sender_key,
+                ForwardedChains.session
+            ]).on_conflict_replace().execute()
+
     @use_database
     def load_device_keys(self):
         # type: () -> DeviceStore
@@ -485,6 +612,214 @@ class MatrixStore:
 
         return None
 
+    @use_database
+    def save_filter_id(self, filter_hash, filter_id):
+        # type: (str, str) -> None
+        """Save the id of an uploaded filter.
+
+        Args:
+            filter_hash (str): The hash of the filter definition.
+            filter_id (str): The id the server returned for the filter.
+        """
+        account = self._get_account()
+        assert account
+
+        SyncFilters.replace(
+            account=account,
+            filter_hash=filter_hash,
+            filter_id=filter_id
+        ).execute()
+
+    @use_database
+    def load_filter_ids(self):
+        # type: () -> Dict[str, str]
+        """Load the ids of the uploaded filters, keyed by filter hash."""
+        account = self._get_account()
+
+        if not account:
+            return dict()
+
+        return {
+            f.filter_hash: f.filter_id for f in SyncFilters.select().where(
+                SyncFilters.account == account.id
+            )
+        }
+
+    @use_database_atomic
+    def save_rooms(
+        self,
+        rooms,                 # type: Iterable[MatrixRoom]
+        changed_members=None,  # type: Optional[Mapping[str, Iterable[str]]]
+    ):
+        # type: (...) -> None
+        """Save the state of the given rooms.
+
+        Args:
+            rooms (Iterable[MatrixRoom]): The rooms whose state should be
+                saved.
+            changed_members (Mapping[str, Iterable[str]], optional): A
+                mapping of room ids to the ids of the members that changed,
+                only those members are updated. All the members of a room
+                that isn't part of the mapping are replaced.
+        """
+        account = self._get_account()
+        assert account
+
+        changed_members = changed_members or dict()
+
+        for room in rooms:
+            Rooms.insert(
+                room_id=room.room_id,
+                account=account,
+                creator=room.creator,
+                federate=room.federate,
+                room_version=room.room_version,
+                guest_access=room.guest_access,
+                join_rule=room.join_rule,
+                history_visibility=room.history_visibility,
+                canonical_alias=room.canonical_alias,
+                topic=room.topic,
+                name=room.name,
+                avatar_url=room.room_avatar_url,
+                encrypted=room.encrypted,
+                power_levels=asdict(room.power_levels),
+                summary=asdict(room.summary) if room.summary else None,
+            ).on_conflict(
+                conflict_target=[Rooms.room_id, Rooms.account],
+                preserve=[
+                    Rooms.creator,
+                    Rooms.federate,
+                    Rooms.room_version,
+                    Rooms.guest_access,
+                    Rooms.join_rule,
+                    Rooms.history_visibility,
+                    Rooms.canonical_alias,
+                    Rooms.topic,
+                    Rooms.name,
+                    Rooms.avatar_url,
+                    Rooms.encrypted,
+                    Rooms.power_levels,
+                    Rooms.summary,
+                ]
+            ).execute()
+
+            db_room = Rooms.get(
+                Rooms.room_id == room.room_id,
+                Rooms.account == account
+            )
+
+            if room.room_id in changed_members:
+                members = set(changed_members[room.room_id])
+                left = [m for m in members if m not in room.users]
+
+                for idx in range(0, len(left), 400):
+                    RoomMembers.delete().where(
+                        (RoomMembers.room == db_room)
+                        & (RoomMembers.user_id.in_(left[idx:idx + 400]))
+                    ).execute()
+
+                members.difference_update(left)
+            else:
+                RoomMembers.delete().where(
+                    RoomMembers.room == db_room
+                ).execute()
+                members = set(room.users)
+
+            data = [
+                (
+                    user.user_id,
+                    user.display_name,
+                    user.avatar_url,
+                    user.invited,
+                    db_room
+                ) for user in (room.users[m] for m in members)
+            ]
+
+            for idx in range(0, len(data), 100):
+                rows = data[idx:idx + 100]
+                RoomMembers.insert_many(rows, fields=[
+                    RoomMembers.user_id,
+                    RoomMembers.display_name,
+                    RoomMembers.avatar_url,
+                    RoomMembers.invited,
+                    RoomMembers.room
+                ]).on_conflict_replace().execute()
+
+    @use_database
+    def load_rooms(self, compact_members=False):
+        # type: (bool) -> Dict[str, MatrixRoom]
+        """Load the rooms of this account and their members.
+
+        Args:
+            compact_members (bool, optional): Should the members of the rooms
+                be stored in a compact member table.
+
+        Returns a dictionary mapping room ids to MatrixRoom objects.
+        """
+        account = self._get_account()
+
+        if not account:
+            return dict()
+
+        rooms = dict()  # type: Dict[int, MatrixRoom]
+
+        for db_room in account.rooms:
+            room = MatrixRoom(
+                db_room.room_id,
+                self.user_id,
+                db_room.encrypted,
+                compact_members
+            )
+            room.creator = db_room.creator
+            room.federate = db_room.federate
+            room.room_version = db_room.room_version
+            room.guest_access = db_room.guest_access
+            room.join_rule = db_room.join_rule
+            room.history_visibility = db_room.history_visibility
+            room.canonical_alias = db_room.canonical_alias
+            room.topic = db_room.topic
+            room.name = db_room.name
+            room.room_avatar_url = db_room.avatar_url
+
+            levels = db_room.power_levels
+            room.power_levels = PowerLevels(
+                DefaultLevels(**levels["defaults"]),
+                levels["users"],
+                levels["events"]
+            )
+
+            if db_room.summary:
+                room.summary = RoomSummary(**db_room.summary)
+
+            rooms[db_room.id] = room
+
+        members = RoomMembers.select().join(Rooms).where(
+            Rooms.account == account
+        )
+
+        for member in members:
+            rooms[member.room_id].add_member(
+                member.user_id,
+                member.display_name,
+                member.avatar_url,
+                member.invited
+            )
+
+        return {room.room_id: room for room in rooms.values()}
+
+    @use_database
+    def delete_room(self, room_id):
+        # type: (str) -> None
+        """Delete the state of a room and its members from the store."""
+        account = self._get_account()
+
+        if not account:
+            return
+
+        Rooms.delete().where(
+            (Rooms.room_id == room_id) & (Rooms.account == account)
+        ).execute()
+
     @use_database
     def delete_encrypted_room(self, room):
         # type: (str) -> None
@@ -14,11 +14,13 @@
 import time
 from builtins import bytes
 from datetime import datetime
+from typing import Iterable
 
 from peewee import (SQL, BlobField, BooleanField, CompositeKey,
                     ForeignKeyField, IntegerField, Model, TextField)
 
 from ..crypto import TrustState
+from ..json_backend import dumps, loads
 
 
 class ByteField(BlobField):
@@ -59,6 +61,16 @@ class DateField(TextField):
         return value.strftime("%Y-%m-%d %H:%M:%S.%f")
 
 
+class JsonField(TextField):
+    """Database field to hold a JSON serializable value."""
+
+    def python_value(self, value):  # pragma: no cover
+        return loads(value)
+
+    def db_value(self, value):  # pragma: no cover
+        return dumps(value)
+
+
 class StoreVersion(Model):
     version = IntegerField()
 
@@ -85,6 +97,11 @@ class OlmSessions(Model):
     session = ByteField()
     session_id = TextField(primary_key=True)
 
+    class Meta:
+        indexes = (
+            (("sender_key", ), False),
+        )
+
 
 class DeviceKeys_v1(Model):
     sender_key = TextField()
@@ -154,6 +171,14 @@ class MegolmInboundSessions(Model):
     room_id = TextField()
     session = ByteField()
     session_id = TextField(primary_key=True)
+    # The forwarding chain of the session, peewee adds this backref for the
+    # session field of ForwardedChains.
+    forwarded_chains: Iterable["ForwardedChains"]
+
+    class Meta:
+        indexes = (
+            (("room_id", "sender_key", "session_id"), False),
+        )
 
 
 class ForwardedChains(Model):
@@ -210,6 +235,64 @@ class SyncTokens(Model):
         constraints = [SQL("UNIQUE(account_id)")]
 
 
+class SyncFilters(Model):
+    filter_hash = TextField()
+    filter_id = TextField()
+    account = ForeignKeyField(
+        model=Accounts,
+        column_name="account_id",
+        on_delete="CASCADE",
+        backref="sync_filters",
+    )
+
+    class Meta:
+        constraints = [SQL("UNIQUE(account_id,filter_hash)")]
+
+
+class Rooms(Model):
+    room_id = TextField()
+    account = ForeignKeyField(
+        model=Accounts,
+        column_name="account_id",
+        on_delete="CASCADE",
+        backref="rooms",
+    )
+    creator = TextField()
+    federate = BooleanField()
+    room_version = TextField()
+    guest_access = TextField()
+    join_rule = TextField()
+    history_visibility = TextField()
+    canonical_alias = TextField(null=True)
+    topic = TextField(null=True)
+    name = TextField(null=True)
+    avatar_url = TextField(null=True)
+    encrypted = BooleanField()
+    power_levels = JsonField()
+    summary = JsonField(null=True)
+
+    class Meta:
+        constraints = [SQL("UNIQUE(room_id,account_id)")]
+
+
+class RoomMembers(Model):
+    user_id = TextField()
+    display_name = TextField(null=True)
+    avatar_url = TextField(null=True)
+    invited = BooleanField()
+    room = ForeignKeyField(
+        model=Rooms,
+        column_name="room",
+        on_delete="CASCADE",
+        backref="members",
+    )
+    # The id of the room row, peewee adds this accessor for the room field.
+    room_id: int
+
+    class Meta:
+        constraints = [SQL("UNIQUE(room,user_id)")]
+
+
 class TrackedUsers(Model):
     user_id = TextField()
     account = ForeignKeyField(
@@ -39,7 +39,8 @@ setup(
             "peewee>=3.9.5",
             "cachetools",
             "atomicwrites",
-        ]
+        ],
+        "fast-json": ["orjson"],
     },
     zip_safe=False
 )
@@ -1,10 +1,15 @@
+import copy
 import json
 import math
 import sys
 import re
+import threading
 import time
+from dataclasses import dataclass
+from multiprocessing import get_context
 from pathlib import Path
 from os import path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from urllib.parse import quote
 from uuid import uuid4
@@ -15,18 +20,18 @@ from aiohttp import (ClientRequest, ClientSession, ClientTimeout,
                      TraceRequestChunkSentParams)
 from yarl import URL
 
-from helpers import faker
+from helpers import faker, large_sync_response
 from nio import (ContentRepositoryConfigResponse,
                  DeviceList, DeviceOneTimeKeyCount, DownloadError,
                  DevicesResponse, DeleteDevicesAuthResponse,
-                 DeleteDevicesResponse,
-                 DownloadResponse, ErrorResponse,
+                 DeleteDevicesResponse, SyncTuner, UploadFilterError,
+                 DownloadResponse, ErrorResponse, Event,
                  GroupEncryptionError,
                  JoinResponse, JoinedRoomsResponse,
                  JoinedMembersResponse, KeysClaimResponse, KeysQueryResponse,
                  KeysUploadResponse, LocalProtocolError, LoginError,
                  LoginResponse, LogoutError, LogoutResponse,
-                 MegolmEvent, MembersSyncError, OlmTrustError,
+                 LoopStallMonitor, MegolmEvent, MembersSyncError, OlmTrustError,
                  RegisterResponse,
                  RoomContextResponse, RoomForgetResponse,
                  ProfileGetAvatarResponse,
@@ -44,11 +49,12 @@ from nio import (ContentRepositoryConfigResponse,
                  RoomSendResponse, RoomSummary,
                  RoomUnbanResponse,
                  ShareGroupSessionResponse,
-                 SyncResponse, ThumbnailError, ThumbnailResponse,
+                 SyncError, SyncResponse, ThumbnailError, ThumbnailResponse,
                  Timeline, TransferMonitor, TransferCancelledError,
                  UploadResponse,
-                 RoomMessageText, RoomKeyRequest)
+                 RoomMessageText, RoomKeyRequest, KeyVerificationStart)
 from nio.api import ResizingMethod, RoomPreset, RoomVisibility
+from nio.events import register_event_type, unregister_event_type
 from nio.crypto import OlmDevice, Session, decrypt_attachment
 from nio.client.async_client import connect_wrapper, on_request_chunk_sent
 
@@ -66,6 +72,13 @@ if sys.version_info >= (3, 5):
     from nio import AsyncClient, AsyncClientConfig
 
 
+@dataclass
+class ReactionEvent(Event):
+    @classmethod
+    def from_dict(cls, parsed_dict):
+        return cls(parsed_dict)
+
+
 @pytest.mark.skipif(sys.version_info < (3, 5), reason="Python 3 specific asyncio tests")
 class TestClass:
     @staticmethod
@@ -336,6 +349,22 @@ class TestClass:
     def get_avatar_response(avatar_url):
         return {"avatar_url": avatar_url}
 
+    @staticmethod
+    async def wait_for_requests(task, requested, count, timeout=5):
+        """Wait until the sync task made count requests.
+
+        Fails if the task stops or the requests don't arrive in time.
+        """
+        async def wait():
+            while len(requested) < count:
+                if task.done():
+                    task.result()
+                    raise AssertionError("The sync loop stopped")
+
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(wait(), timeout)
+
     @property
     def room_resolve_alias_response(self):
         return {
@@ -659,6 +688,631 @@ class TestClass:
         resp4 = await async_client.sync(sync_filter={})
         assert isinstance(resp4, SyncResponse)
 
+    async def test_sync_filter_upload(self, async_client, aioresponse):
+        async_client.config = AsyncClientConfig(
+            max_timeouts=3, upload_filters=True
+        )
+
+        await async_client.receive_response(
+            LoginResponse.from_dict(self.login_response)
+        )
+
+        filter_url = re.compile(
+            r"^https://example\.org/_matrix/client/r0/user/.*/filter\?.*"
+        )
+        sync_url = re.compile(
+            r"^https://example\.org/_matrix/client/r0/sync\?access_token=.*"
+        )
+
+        uploaded = []
+        requested = []
+
+        def filter_callback(url, data=None, **kwargs):
+            uploaded.append(json.loads(data))
+            return CallbackResult(status=200, payload={"filter_id": "1"})
+
+        def sync_callback(url, **kwargs):
+            requested.append(url.query.get("filter"))
+            return CallbackResult(status=200, payload=self.sync_response)
+
+        aioresponse.post(filter_url, callback=filter_callback, repeat=True)
+        aioresponse.get(sync_url, callback=sync_callback, repeat=True)
+
+        sync_filter = {"room": {"timeline": {"limit": 10}}}
+
+        resp = await async_client.sync(sync_filter=sync_filter)
+        assert isinstance(resp, SyncResponse)
+        resp = await async_client.sync(sync_filter=dict(sync_filter))
+        assert isinstance(resp, SyncResponse)
+        resp = await async_client.sync(sync_filter="custom_id")
+        assert isinstance(resp, SyncResponse)
+
+        assert uploaded == [sync_filter]
+        assert requested == ["1", "1", "custom_id"]
+
+        filter_hash = async_client._filter_hash(sync_filter)
+        assert async_client.filter_ids == {filter_hash: "1"}
+        assert async_client.store.load_filter_ids() == {filter_hash: "1"}
+
+    async def test_sync_filter_upload_error(self, async_client, aioresponse):
+        async_client.config = AsyncClientConfig(
+            max_timeouts=3, upload_filters=True
+        )
+
+        await async_client.receive_response(
+            LoginResponse.from_dict(self.login_response)
+        )
+
+        aioresponse.post(
+            re.compile(r"^https://example\.org/_matrix/client/r0/user/.*"),
+            status=400,
+            payload={"errcode": "M_UNKNOWN", "error": "Bad filter"},
+        )
+
+        resp = await async_client.upload_filter({"presence": {"types": []}})
+        assert isinstance(resp, UploadFilterError)
+
+        uploads = []
+
+        def upload_callback(url, **kwargs):
+            uploads.append(url)
+            return CallbackResult(
+                status=400,
+                payload={"errcode": "M_UNKNOWN", "error": "Bad filter"},
+            )
+
+        aioresponse.post(
+            re.compile(r"^https://example\.org/_matrix/client/r0/user/.*"),
+            callback=upload_callback,
+            repeat=True,
+        )
+
+        requested = []
+
+        def sync_callback(url, **kwargs):
+            requested.append(url.query.get("filter"))
+            return CallbackResult(status=200, payload=self.sync_response)
+
+        aioresponse.get(
+            re.compile(
+                r"^https://example\.org/_matrix/client/r0/sync\?access_token=.*"
+            ),
+            callback=sync_callback,
+            repeat=True,
+        )
+
+        resp = await async_client.sync(sync_filter={"presence": {}})
+        assert isinstance(resp, SyncResponse)
+        assert len(requested) == 1
+        assert "presence" in requested[0]
+        assert not async_client.filter_ids
+
+        # The rejected filter isn't uploaded again.
+        resp = await async_client.sync(sync_filter={"presence": {}})
+        assert isinstance(resp, SyncResponse)
+        assert len(requested) == 2
+        assert "presence" in requested[1]
+        assert len(uploads) == 1
+
+    async def test_streaming_sync(self, async_client, aioresponse):
+        async_client.config = AsyncClientConfig(streaming_sync=True)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+
+        sync_response = self.sync_response
+        encrypted_room_id = "!jEsUZKDJdhlrceRyVU:example.org"
+        room_id, room = next(iter(sync_response["rooms"]["join"].items()))
+        encrypted_room = {
+            "state": {"events": []},
+            "timeline": {
+                "events": [
+                    self._load_response("tests/data/events/megolm.json")
+                ],
+                "limited": False,
+                "prev_batch": "t392-516_47314_0_7_1_1_1_11444_1",
+            },
+            "ephemeral": {"events": []},
+            "account_data": {"events": []},
+        }
+        sync_response["rooms"]["join"] = {
+            encrypted_room_id: encrypted_room,
+            room_id: room,
+        }
+        # The to-device events come after the rooms.
+        sync_response["to_device"] = {
+            "events": [
+                self._load_response("tests/data/events/key_start.json")
+            ]
+        }
+
+        aioresponse.get(
+            re.compile(
+                r"^https://example\.org/_matrix/client/r0/"
+                r"sync\?access_token=abc123$"
+            ),
+            status=200,
+            payload=sync_response
+        )
+
+        handled = []
+
+        async def event_cb(room, event):
+            handled.append((room.room_id, type(event)))
+
+        async def to_device_cb(event):
+            handled.append(type(event))
+
+        async_client.add_event_callback(
+            event_cb, (RoomMessageText, MegolmEvent)
+        )
+        async_client.add_to_device_callback(to_device_cb, KeyVerificationStart)
+
+        await async_client.login("wordpass")
+        response = await async_client.sync()
+
+        expected = SyncResponse.from_dict(copy.deepcopy(sync_response))
+
+        assert isinstance(response, SyncResponse)
+        assert response.next_batch == sync_response["next_batch"]
+        assert async_client.next_batch == sync_response["next_batch"]
+        assert response.rooms.invite == expected.rooms.invite
+        assert response.rooms.leave == expected.rooms.leave
+        assert list(response.rooms.join) == list(expected.rooms.join)
+        assert len(response.to_device_events) == 1
+
+        # The response is handled like any other sync response once it was
+        # received completely, the to-device events come first.
+        assert handled == [
+            KeyVerificationStart,
+            (encrypted_room_id, MegolmEvent),
+            (room_id, RoomMessageText),
+        ]
+
+        assert room_id in async_client.rooms
+        assert async_client.rooms[room_id].users
+
+    async def test_streaming_sync_invalid_room(self, async_client,
+                                               aioresponse):
+        async_client.config = AsyncClientConfig(streaming_sync=True)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+
+        sync_response = self.sync_response
+        room_id = next(iter(sync_response["rooms"]["join"]))
+        # The room is valid, but a room that comes after it isn't.
+        sync_response["rooms"]["join"]["!invalid:example.org"] = {}
+
+        aioresponse.get(
+            re.compile(
+                r"^https://example\.org/_matrix/client/r0/"
+                r"sync\?access_token=abc123$"
+            ),
+            status=200,
+            payload=sync_response
+        )
+
+        handled = []
+
+        async def event_cb(room, event):
+            handled.append(event)
+
+        async_client.add_event_callback(event_cb, RoomMessageText)
+
+        await async_client.login("wordpass")
+        response = await async_client.sync()
+
+        assert isinstance(response, SyncError)
+        assert not handled
+        assert room_id not in async_client.rooms
+        assert not async_client.next_batch
+
+    async def test_streaming_sync_invalid_json(self, async_client,
+                                               aioresponse):
+        async_client.config = AsyncClientConfig(streaming_sync=True)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            re.compile(
+                r"^https://example\.org/_matrix/client/r0/"
+                r"sync\?access_token=abc123$"
+            ),
+            status=200,
+            body='{"next_batch": "s1", "rooms": {"join": {',
+            content_type="application/json",
+        )
+
+        await async_client.login("wordpass")
+        response = await async_client.sync()
+
+        assert isinstance(response, SyncError)
+
+    @pytest.mark.parametrize(
+        "executor_class",
+        [ThreadPoolExecutor, ProcessPoolExecutor]
+    )
+    async def test_sync_executor(self, async_client, aioresponse,
+                                 executor_class):
+        sync_response = large_sync_response(150, 5)
+        expected = SyncResponse.from_dict(copy.deepcopy(sync_response))
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            re.compile(
+                r"^https://example\.org/_matrix/client/r0/"
+                r"sync\?access_token=abc123$"
+            ),
+            status=200,
+            payload=sync_response
+        )
+
+        await async_client.login("wordpass")
+
+        with executor_class(max_workers=2) as executor:
+            async_client.config = AsyncClientConfig(sync_executor=executor)
+            response = await async_client.sync()
+
+        assert isinstance(response, SyncResponse)
+        assert response.next_batch == expected.next_batch
+        assert list(response.rooms.join) == list(expected.rooms.join)
+        assert response.rooms == expected.rooms
+        assert len(async_client.rooms) == 150
+
+    async def test_sync_executor_event_types(self, async_client,
+                                             aioresponse):
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            re.compile(
+                r"^https://example\.org/_matrix/client/r0/"
+                r"sync\?access_token=abc123$"
+            ),
+            status=200,
+            payload=large_sync_response(150, 10)
+        )
+
+        await async_client.login("wordpass")
+
+        # Spawned workers only get the registrations sent with the batches.
+        register_event_type("m.reaction", ReactionEvent)
+
+        try:
+            with ProcessPoolExecutor(
+                max_workers=2, mp_context=get_context("spawn")
+            ) as executor:
+                async_client.config = AsyncClientConfig(
+                    sync_executor=executor
+                )
+                response = await async_client.sync()
+        finally:
+            unregister_event_type("m.reaction")
+
+        assert isinstance(response, SyncResponse)
+
+        reactions = [
+            event
+            for room in response.rooms.join.values()
+            for event in room.timeline.events
+            if event.source["type"] == "m.reaction"
+        ]
+
+        assert len(reactions) == 150
+        assert all(isinstance(event, ReactionEvent) for event in reactions)
+
+    async def test_sync_executor_invalid_response(self, async_client,
+                                                  aioresponse):
+        sync_response = large_sync_response(150, 5)
+        del sync_response["rooms"]["join"]["!room0:example.org"]["timeline"]
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            re.compile(
+                r"^https://example\.org/_matrix/client/r0/"
+                r"sync\?access_token=abc123$"
+            ),
+            status=200,
+            payload=sync_response
+        )
+
+        await async_client.login("wordpass")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            async_client.config = AsyncClientConfig(sync_executor=executor)
+            response = await async_client.sync()
+
+        assert isinstance(response, SyncError)
+
+    @pytest.mark.parametrize("offload_sync", [False, True])
+    async def test_offload_sync(self, async_client, aioresponse,
+                                offload_sync):
+        async_client.config = AsyncClientConfig(offload_sync=offload_sync)
+
+        sync_response = large_sync_response(20, 10)
+        room_id = "!room0:example.org"
+        sync_response["rooms"]["join"][room_id]["timeline"]["events"].append(
+            self._load_response("tests/data/events/megolm.json")
+        )
+        sync_response["to_device"] = {
+            "events": [
+                self._load_response("tests/data/events/key_start.json")
+            ]
+        }
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            re.compile(
+                r"^https://example\.org/_matrix/client/r0/"
+                r"sync\?access_token=abc123$"
+            ),
+            status=200,
+            payload=sync_response
+        )
+
+        handled = []
+
+        async def event_cb(room, event):
+            handled.append((room.room_id, event.event_id))
+
+        async def to_device_cb(event):
+            handled.append(type(event))
+
+        async_client.add_event_callback(event_cb, Event)
+        async_client.add_to_device_callback(to_device_cb, KeyVerificationStart)
+
+        await async_client.login("wordpass")
+        response = await async_client.sync()
+
+        assert isinstance(response, SyncResponse)
+        assert async_client.next_batch == sync_response["next_batch"]
+        assert len(async_client.rooms) == 20
+        assert async_client.sync_loop_stall >= 0
+
+        expected = [KeyVerificationStart]
+
+        for joined_id, room in sync_response["rooms"]["join"].items():
+            for event in room["timeline"]["events"]:
+                expected.append((joined_id, event["event_id"]))
+
+        assert handled == expected
+        assert isinstance(
+            response.rooms.join[room_id].timeline.events[-1], MegolmEvent
+        )
+
+    async def test_offload_sync_invalid_json(self, async_client,
+                                             aioresponse):
+        async_client.config = AsyncClientConfig(offload_sync=True)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            re.compile(
+                r"^https://example\.org/_matrix/client/r0/"
+                r"sync\?access_token=abc123$"
+            ),
+            status=200,
+            body='{"next_batch": "s1", "rooms": {"join": {',
+            content_type="application/json",
+        )
+
+        await async_client.login("wordpass")
+        response = await async_client.sync()
+
+        assert isinstance(response, SyncError)
+
+    async def test_lazy_sync_invalid_state_event(self, async_client,
+                                                 aioresponse):
+        async_client.config = AsyncClientConfig(lazy_events=True)
+
+        await async_client.receive_response(
+            LoginResponse.from_dict(self.login_response)
+        )
+
+        room_id = "!SVkFJHzfwvuaIEawgC:localhost"
+        sync_response = self.sync_response
+        sync_response["rooms"]["join"][room_id]["state"]["events"].append({
+            "type": "m.room.name",
+            "event_id": "$name_state",
+            "sender": "@example:localhost",
+            "origin_server_ts": 1516809890615,
+            "state_key": "",
+            "content": {"name": 5},
+        })
+
+        sync_url = re.compile(
+            r'^https://example\.org/_matrix/client/r0/sync\?access_token=.*'
+        )
+        aioresponse.get(sync_url, status=200, payload=sync_response)
+
+        response = await async_client.sync()
+
+        assert isinstance(response, SyncResponse)
+        assert async_client.rooms[room_id].name is None
+
+    async def test_offload_sync_step_lock(self, async_client):
+        async_client.config = AsyncClientConfig(offload_sync=True)
+        loop = asyncio.get_event_loop()
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def sync_step():
+            started.set()
+            release.wait(5)
+
+        step = asyncio.ensure_future(async_client._run_sync_step(sync_step))
+        await loop.run_in_executor(None, started.wait, 5)
+
+        # Other responses wait for the running sync step.
+        receive = asyncio.ensure_future(
+            async_client.receive_response(RoomForgetResponse(TEST_ROOM_ID))
+        )
+        await asyncio.sleep(0.05)
+        assert not receive.done()
+
+        release.set()
+        await step
+        await receive
+
+    async def test_decryption_workers_off_loop(self, async_client):
+        async_client.config = AsyncClientConfig(decryption_workers=2)
+
+        await async_client.receive_response(
+            LoginResponse.from_dict(self.login_response)
+        )
+
+        threads = []
+        decrypt_timeline = async_client._decrypt_timeline
+
+        def record_thread(room_id, events):
+            threads.append(threading.current_thread())
+            return decrypt_timeline(room_id, events)
+
+        async_client._decrypt_timeline = record_thread
+
+        await async_client.receive_response(
+            SyncResponse.from_dict(self.sync_response)
+        )
+
+        # Waiting for the decryption pool doesn't block the loop.
+        assert threads
+        assert threading.main_thread() not in threads
+
+    async def test_loop_stall_monitor_stopped_on_error(
+        self, async_client, aioresponse
+    ):
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            re.compile(
+                r"^https://example\.org/_matrix/client/r0/"
+                r"sync\?access_token=abc123$"
+            ),
+            status=200,
+            payload=self.sync_response
+        )
+
+        async def handle_sync(response):
+            raise RuntimeError("handling failed")
+
+        await async_client.login("wordpass")
+        async_client._handle_sync = handle_sync
+
+        with pytest.raises(RuntimeError):
+            await async_client.sync()
+
+        # Let the cancelled monitor task finish.
+        await asyncio.sleep(0)
+
+        assert not [
+            task for task in asyncio.all_tasks()
+            if "LoopStallMonitor" in repr(task.get_coro())
+        ]
+
+    async def test_loop_stall_monitor(self):
+        monitor = LoopStallMonitor(interval=0.001)
+        monitor.start()
+
+        await asyncio.sleep(0.01)
+        time.sleep(0.05)
+
+        assert monitor.stop() >= 0.04
+        assert monitor.max_stall >= 0.04
+
+        monitor.start()
+        assert monitor.max_stall == 0
+        await asyncio.sleep(0.01)
+        assert monitor.stop() < 0.04
+
+    async def test_callback_dispatcher(self, async_client, aioresponse):
+        async_client.config = AsyncClientConfig(
+            callback_workers=4,
+            callback_queue_size=200,
+        )
+
+        sync_response = large_sync_response(10, 10)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/login",
+            status=200,
+            payload=self.login_response
+        )
+        aioresponse.get(
+            re.compile(
+                r"^https://example\.org/_matrix/client/r0/"
+                r"sync\?access_token=abc123$"
+            ),
+            status=200,
+            payload=sync_response
+        )
+
+        handled = []
+        running = 0
+        max_running = 0
+
+        async def event_cb(room, event):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.001)
+            handled.append((room.room_id, event.event_id))
+            running -= 1
+
+        async def response_cb(response):
+            handled.append(type(response))
+
+        async_client.add_event_callback(event_cb, Event)
+        async_client.add_response_callback(response_cb, SyncResponse)
+
+        await async_client.login("wordpass")
+        response = await async_client.sync()
+        await async_client.run_response_callbacks([response])
+
+        await async_client.callback_dispatcher.join()
+
+        assert max_running == 4
+        assert handled.count(SyncResponse) == 1
+
+        for room_id, room in sync_response["rooms"]["join"].items():
+            assert [
+                entry[1] for entry in handled
+                if isinstance(entry, tuple) and entry[0] == room_id
+            ] == [event["event_id"] for event in room["timeline"]["events"]]
+
+        await async_client.close()
+        assert async_client.callback_dispatcher.queued == 0
+
     def test_keys_upload(self, async_client, aioresponse):
         loop = asyncio.get_event_loop()
 
@@ -960,6 +1614,58 @@ class TestClass:
         assert isinstance(response, JoinedMembersResponse)
         assert room.members_synced
 
+    async def test_fetch_room_members(self, async_client, aioresponse):
+        async_client.config = AsyncClientConfig(
+            max_timeouts=3, lazy_member_ttl=60
+        )
+
+        await async_client.receive_response(
+            LoginResponse.from_dict(self.login_response)
+        )
+        await async_client.receive_response(self.encryption_sync_response)
+
+        room = async_client.rooms[TEST_ROOM_ID]
+        requested = []
+
+        def member_callback(url, **kwargs):
+            user_id = url.path.rsplit("/", 1)[-1]
+            requested.append(user_id)
+
+            if user_id == "@gone:example.org":
+                return CallbackResult(
+                    status=200, payload={"membership": "leave"}
+                )
+
+            return CallbackResult(
+                status=200,
+                payload={"membership": "join", "displayname": "Dave"},
+            )
+
+        aioresponse.get(
+            re.compile(
+                r"^https://example\.org/_matrix/client/r0/rooms/.*/"
+                r"state/m\.room\.member/.*"
+            ),
+            callback=member_callback,
+            repeat=True,
+        )
+
+        assert "@dave:example.org" not in room.users
+
+        added = await async_client.fetch_room_members(
+            TEST_ROOM_ID,
+            ["@alice:example.org", "@dave:example.org", "@gone:example.org"],
+            batch_size=1,
+        )
+
+        assert added == ["@dave:example.org"]
+        assert sorted(requested) == ["@dave:example.org", "@gone:example.org"]
+        assert room.users["@dave:example.org"].display_name == "Dave"
+        assert "@dave:example.org" in room.lazy_members
+
+        with pytest.raises(LocalProtocolError):
+            await async_client.fetch_room_members("!unknown:example.org", [])
+
     async def test_joined_rooms(self, async_client, aioresponse):
         await async_client.receive_response(
             LoginResponse.from_dict(self.login_response)
@@ -2022,6 +2728,173 @@ class TestClass:
         task.cancel()
         await task
 
+    async def test_sync_forever_pipelined(self, async_client, aioresponse, loop):
+        sync_url = re.compile(
+            r'^https://example\.org/_matrix/client/r0/sync\?access_token=.*'
+        )
+
+        requested = []
+        handled = []
+        responses = []
+
+        for index in range(3):
+            response = large_sync_response(2, 2)
+            response["next_batch"] = "batch{}".format(index)
+            responses.append(response)
+
+        def sync_callback(url, **kwargs):
+            requested.append((url.query.get("since"), len(handled)))
+            response = responses.pop(0) if responses else self.empty_sync
+            return CallbackResult(status=200, payload=response)
+
+        aioresponse.get(sync_url, callback=sync_callback, repeat=True)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/keys/upload?access_token=abc123",
+            status=200,
+            payload=self.keys_upload_response,
+            repeat=True
+        )
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/keys/query?access_token=abc123",
+            status=200,
+            payload=self.keys_query_response,
+            repeat=True
+        )
+
+        await async_client.receive_response(
+            LoginResponse.from_dict(self.login_response)
+        )
+
+        async def slow_callback(room, event):
+            # The handling of every response outlasts the next request.
+            await asyncio.sleep(0.01)
+            handled.append(async_client.next_batch)
+
+        async_client.add_event_callback(slow_callback, RoomMessageText)
+
+        task = loop.create_task(async_client.sync_forever(
+            timeout=100,
+            pipeline=True,
+        ))
+
+        await self.wait_for_requests(task, requested, 4)
+
+        task.cancel()
+        await task
+
+        assert [since for since, _ in requested[:4]] == [
+            None, "batch0", "batch1", "batch2"
+        ]
+
+        # The next sync was requested before the callbacks of the previous
+        # response finished running.
+        assert requested[1][1] == 0
+
+        # Responses are handled in the order they were received.
+        assert handled == sorted(handled)
+        assert handled[0] == "batch0"
+
+    async def test_sync_forever_tuner(self, async_client, aioresponse, loop):
+        sync_url = re.compile(
+            r'^https://example\.org/_matrix/client/r0/sync\?access_token=.*'
+        )
+
+        requested = []
+
+        def sync_callback(url, **kwargs):
+            requested.append(
+                (url.query.get("timeout"), url.query.get("filter"))
+            )
+            return CallbackResult(status=200, payload=self.empty_sync)
+
+        aioresponse.get(sync_url, callback=sync_callback, repeat=True)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/keys/upload?access_token=abc123",
+            status=200,
+            payload=self.keys_upload_response,
+            repeat=True
+        )
+
+        await async_client.receive_response(
+            LoginResponse.from_dict(self.login_response)
+        )
+
+        tuner = SyncTuner(
+            min_timeout=1000,
+            max_timeout=4000,
+            light_filter="light",
+            idle_threshold=1,
+        )
+
+        task = loop.create_task(async_client.sync_forever(
+            timeout=1000,
+            sync_filter="full",
+            tuner=tuner,
+        ))
+
+        await self.wait_for_requests(task, requested, 5)
+
+        task.cancel()
+        await task
+
+        assert requested[:5] == [
+            (None, None),
+            ("1000", "full"),
+            ("2000", "light"),
+            ("4000", "light"),
+            ("4000", "light"),
+        ]
+
+        assert tuner.metrics.syncs >= 3
+        assert tuner.metrics.idle_syncs == tuner.metrics.syncs
+
+    async def test_sync_forever_tuner_streaming(self, async_client,
+                                                aioresponse, loop):
+        async_client.config = AsyncClientConfig(streaming_sync=True)
+
+        sync_url = re.compile(
+            r'^https://example\.org/_matrix/client/r0/sync\?access_token=.*'
+        )
+
+        requested = []
+
+        def sync_callback(url, **kwargs):
+            requested.append(url.query.get("timeout"))
+            return CallbackResult(status=200, payload=self.sync_response)
+
+        aioresponse.get(sync_url, callback=sync_callback, repeat=True)
+
+        aioresponse.post(
+            "https://example.org/_matrix/client/r0/keys/upload?access_token=abc123",
+            status=200,
+            payload=self.keys_upload_response,
+            repeat=True
+        )
+
+        await async_client.receive_response(
+            LoginResponse.from_dict(self.login_response)
+        )
+
+        tuner = SyncTuner(min_timeout=1000, max_timeout=4000)
+
+        task = loop.create_task(async_client.sync_forever(
+            timeout=1000,
+            tuner=tuner,
+        ))
+
+        await self.wait_for_requests(task, requested, 4)
+
+        task.cancel()
+        await task
+
+        # The events of streamed sync responses are counted as well.
+        assert requested[:4] == [None, "1000", "1000", "1000"]
+        assert tuner.metrics.events > 0
+        assert tuner.metrics.idle_syncs == 0
+
     async def test_session_unwedging(self, async_client_pair, aioresponse, loop):
         alice, bob = async_client_pair
 
@@ -5,7 +5,8 @@ from uuid import uuid4
 
 import pytest
 
-from helpers import FrameFactory, ephemeral, ephemeral_dir, faker
+from helpers import (FrameFactory, ephemeral, ephemeral_dir, faker,
+                     large_sync_response)
 from nio import (Client, DeviceList, DeviceOneTimeKeyCount, DownloadResponse,
                  EncryptionError,
                  HttpClient, JoinedMembersResponse, KeysQueryResponse,
@@ -20,8 +21,11 @@ from nio import (Client, DeviceList, DeviceOneTimeKeyCount, DownloadResponse,
                  ShareGroupSessionResponse, SyncResponse,
                  Timeline, ThumbnailResponse, TransportType, TypingNoticeEvent,
                  InviteMemberEvent, InviteInfo, ClientConfig, ReceiptEvent,
-                 Receipt)
+                 Receipt, RoomMessageText, RoomMessagesResponse)
+from nio.client.base_client import CallbackIndex, ClientCallback
 from nio.event_builders import ToDeviceMessage
+from nio.events import (BadEvent, Event, LazyEvent, RoomMessage,
+                        compact_event, lazy_events)
 
 HOST = "example.org"
 USER = "example"
@@ -795,6 +799,104 @@ class TestClass:
         assert isinstance(response, SyncResponse)
         assert http_client.access_token == "ABCD"
 
+    def test_http_client_lazy_sync(self, http_client):
+        http_client.config = ClientConfig(lazy_events=True)
+        http_client.connect(TransportType.HTTP2)
+
+        _, _ = http_client.login("1234")
+
+        http_client.receive(self.login_byte_response)
+        http_client.next_response()
+
+        messages = []
+
+        def cb(room, event):
+            messages.append(event)
+
+        http_client.add_event_callback(cb, RoomMessageText)
+
+        _, _ = http_client.sync()
+
+        http_client.receive(self.sync_byte_response)
+        response = http_client.next_response()
+
+        assert isinstance(response, SyncResponse)
+        assert len(messages) == 1
+        assert isinstance(messages[0], LazyEvent)
+        assert messages[0].body
+
+        room = http_client.rooms["!SVkFJHzfwvuaIEawgC:localhost"]
+        assert room.users
+
+    def test_lazy_sync_invalid_event(self, tempdir):
+        client = Client("ephemeral", "DEVICEID", tempdir)
+        client.receive_response(self.login_response)
+
+        messages = []
+        bad_events = []
+
+        client.add_event_callback(
+            lambda room, event: messages.append(event), RoomMessageText
+        )
+        client.add_event_callback(
+            lambda room, event: bad_events.append(event), BadEvent
+        )
+
+        parsed_dict = self._load_response("tests/data/sync.json")
+        room = parsed_dict["rooms"]["join"]["!SVkFJHzfwvuaIEawgC:localhost"]
+
+        for event in room["timeline"]["events"]:
+            if event["type"] == "m.room.message":
+                event["content"].pop("body")
+
+        with lazy_events():
+            response = SyncResponse.from_dict(parsed_dict)
+
+        client.receive_response(response)
+
+        assert not messages
+        assert len(bad_events) == 1
+        assert not isinstance(bad_events[0], RoomMessageText)
+
+    def test_lazy_sync_invalid_state_event(self, tempdir):
+        config = ClientConfig(lazy_events=True)
+        client = Client("ephemeral", "DEVICEID", tempdir, config)
+        client.receive_response(self.login_response)
+
+        bad_events = []
+
+        client.add_event_callback(
+            lambda room, event: bad_events.append(event), BadEvent
+        )
+
+        room_id = "!SVkFJHzfwvuaIEawgC:localhost"
+        parsed_dict = self._load_response("tests/data/sync.json")
+        room_info = parsed_dict["rooms"]["join"][room_id]
+
+        name_event = {
+            "type": "m.room.name",
+            "event_id": "$name_state",
+            "sender": "@example:localhost",
+            "origin_server_ts": 1516809890615,
+            "state_key": "",
+            "content": {"name": 5},
+        }
+        room_info["state"]["events"].append(name_event)
+        room_info["timeline"]["events"].append(
+            dict(name_event, event_id="$name_timeline")
+        )
+
+        with lazy_events():
+            response = SyncResponse.from_dict(parsed_dict)
+
+        client.receive_response(response)
+
+        room = client.rooms[room_id]
+        assert room.name is None
+        assert room.users
+        assert [event.event_id for event in bad_events] == ["$name_timeline"]
+        assert isinstance(response.rooms.join[room_id].state[-1], BadEvent)
+
     def test_http_client_keys_query(self, http_client):
         http_client.connect(TransportType.HTTP2)
 
@@ -1179,6 +1281,106 @@ class TestClass:
         with pytest.raises(CallbackException):
             client.receive_response(self.sync_invite_response)
 
+    def test_callback_index(self):
+        index = CallbackIndex()
+        callbacks = [
+            ClientCallback(0, RoomMessage),
+            ClientCallback(1, (RoomMemberEvent, RoomMessageText)),
+            ClientCallback(2, None),
+            ClientCallback(3, RoomMemberEvent),
+        ]
+
+        message = RoomMessageText.from_dict({
+            "event_id": "$1:example.org",
+            "sender": "@alice:example.org",
+            "origin_server_ts": 1,
+            "type": "m.room.message",
+            "content": {"msgtype": "m.text", "body": "Hello"},
+        })
+
+        def lookup(event):
+            return [cb.func for cb in index.lookup(callbacks, event)]
+
+        assert lookup(message) == [0, 1, 2]
+        assert index.lookup(callbacks, message) is index.lookup(
+            callbacks, message
+        )
+
+        # Compact events are subclasses of their event class.
+        assert lookup(compact_event(message)) == [0, 1, 2]
+
+        callbacks.append(ClientCallback(4, Event))
+        assert lookup(message) == [0, 1, 2, 4]
+
+        callbacks[0] = ClientCallback(5, RoomMessageText)
+        assert lookup(message) == [0, 1, 2, 4]
+        version = index.version
+        index.invalidate()
+        assert index.version == version + 1
+        assert lookup(message) == [5, 1, 2, 4]
+
+        # Removing one callback and adding another one keeps the length.
+        callbacks.pop()
+        callbacks.append(ClientCallback(6, RoomMessage))
+        index.invalidate()
+        assert lookup(message) == [5, 1, 2, 6]
+
+    def test_callback_index_invalidation(self, client):
+        client.receive_response(self.login_response)
+        handled = []
+
+        client.add_event_callback(
+            lambda room, event: handled.append(1), RoomMemberEvent
+        )
+        client.receive_response(self.sync_response)
+        members = len(handled)
+
+        assert members > 0
+
+        client.add_event_callback(
+            lambda room, event: handled.append(2), RoomMemberEvent
+        )
+        client.next_batch = ""
+        client.receive_response(self.sync_response)
+
+        assert handled[members:] == [1, 2] * members
+
+    @pytest.mark.parametrize("routing", ["linear", "indexed"])
+    def test_callback_routing_benchmark(self, benchmark, routing):
+        response = SyncResponse.from_dict(large_sync_response(100, 100))
+        events = [
+            event
+            for info in response.rooms.join.values()
+            for event in info.timeline.events
+        ]
+        filters = [
+            RoomMessageText,
+            RoomMemberEvent,
+            RoomMessage,
+            (RoomMessageText, RoomEncryptionEvent),
+            MegolmEvent,
+        ]
+        callbacks = [
+            ClientCallback(lambda room, event: None, filters[i % len(filters)])
+            for i in range(50)
+        ]
+        index = CallbackIndex()
+
+        def linear():
+            for event in events:
+                for cb in callbacks:
+                    if cb.filter is None or isinstance(event, cb.filter):
+                        cb.func(None, event)
+
+        def indexed():
+            for event in events:
+                for cb in index.lookup(callbacks, event):
+                    cb.func(None, event)
+
+        benchmark(linear if routing == "linear" else indexed)
+
+        assert len(events) == 10000
+
     def test_homeserver_url_parsing(self):
         host, path = HttpClient._parse_homeserver("https://example.org:8080")
         assert host == "example.org:8080"
@@ -1246,3 +1448,205 @@ class TestClass:
         client = Client(user, device_id, path, config=config)
         client.receive_response(self.login_response)
         assert client.loaded_sync_token
+
+    def test_sync_token_saved_after_sessions(self, client):
+        user = client.user_id
+        device_id = client.device_id
+        path = client.store_path
+        del client
+
+        config = ClientConfig(store_sync_tokens=True)
+        client = Client(user, device_id, path, config=config)
+        client.receive_response(self.login_response)
+
+        calls = []
+        flush_sessions = client.olm.flush_sessions
+        save_sync_token = client.store.save_sync_token
+
+        def flush():
+            calls.append("flush")
+            flush_sessions()
+
+        def save_token(token):
+            calls.append("token")
+            save_sync_token(token)
+
+        client.olm.flush_sessions = flush
+        client.store.save_sync_token = save_token
+
+        client.receive_response(self.sync_response)
+        assert calls == ["flush", "token"]
+        assert client.store.load_sync_token() == client.next_batch
+
+    def test_room_state_restoring(self, client):
+        user = client.user_id
+        device_id = client.device_id
+        path = client.store_path
+        del client
+
+        config = ClientConfig(store_sync_tokens=True, store_room_state=True)
+        client = Client(user, device_id, path, config=config)
+        client.receive_response(self.login_response)
+        assert not client.rooms
+
+        client.receive_response(self.sync_response)
+        room = client.rooms[TEST_ROOM_ID]
+        assert room.encrypted
+
+        client = Client(user, device_id, path, config=config)
+        client.receive_response(self.login_response)
+
+        restored = client.rooms[TEST_ROOM_ID]
+        assert restored.encrypted
+        assert restored.users.keys() == room.users.keys()
+        assert list(restored.invited_users) == [CAROL_ID]
+        assert restored.summary == room.summary
+        assert restored.display_name == room.display_name
+
+        timeline = Timeline(
+            [
+                RoomMemberEvent(
+                    {"event_id": "event_id_4",
+                     "sender": CAROL_ID,
+                     "origin_server_ts": 1516809890615},
+                    CAROL_ID,
+                    "leave",
+                    "invite",
+                    {"membership": "leave"}
+                ),
+            ],
+            False,
+            "prev_batch_token"
+        )
+        response = SyncResponse(
+            "token124",
+            Rooms({}, {TEST_ROOM_ID: RoomInfo(timeline, [], [], [])}, {}),
+            DeviceOneTimeKeyCount(49, 50),
+            DeviceList([], []),
+            []
+        )
+        client.receive_response(response)
+        assert CAROL_ID not in client.rooms[TEST_ROOM_ID].users
+
+        rooms = client.store.load_rooms()
+        assert list(rooms[TEST_ROOM_ID].users) == [ALICE_ID]
+
+        client.receive_response(RoomForgetResponse(TEST_ROOM_ID))
+        assert client.store.load_rooms() == {}
+
+    def test_timeline_cache(self, tempdir):
+        config = ClientConfig(timeline_max_events=4)
+        client = Client("ephemeral", "DEVICEID", tempdir, config)
+        client.receive_response(self.login_response)
+        client.receive_response(self.sync_response)
+
+        timeline = client.rooms[TEST_ROOM_ID].timeline
+        assert [e.event_id for e in timeline] == [
+            "event_id_1", "event_id_2", "event_id_3"
+        ]
+        assert timeline.prev_batch == "prev_batch_token"
+
+        def message(event_id, timestamp):
+            return RoomMessageText.from_dict({
+                "event_id": event_id,
+                "sender": ALICE_ID,
+                "origin_server_ts": timestamp,
+                "type": "m.room.message",
+                "content": {"msgtype": "m.text", "body": "Hello"},
+            })
+
+        # A page from another part of the history isn't added.
+        client.receive_response(RoomMessagesResponse(
+            TEST_ROOM_ID, [message("event_id_9", 1)], "other", "end"
+        ))
+        assert len(timeline) == 3
+
+        # The page before the buffered events is.
+        client.receive_response(RoomMessagesResponse(
+            TEST_ROOM_ID,
+            [message("event_id_0", 1)],
+            timeline.prev_batch,
+            "older",
+        ))
+        assert timeline.events[0].event_id == "event_id_0"
+        assert timeline.prev_batch == "older"
+
+        # A page that overlaps the buffered events is added as well. The
+        # full timeline drops its oldest event and forgets the token.
+        client.receive_response(RoomMessagesResponse(
+            TEST_ROOM_ID,
+            [message("event_id_3", 1516809890615),
+             message("event_id_4", 1516809890616)],
+            "start",
+            "end",
+        ))
+        assert [e.event_id for e in timeline.latest(2)] == [
+            "event_id_3", "event_id_4"
+        ]
+        assert len(timeline) == 4
+        assert "event_id_0" not in timeline
+        assert timeline.prev_batch is None
+
+        client.receive_response(RoomForgetResponse(TEST_ROOM_ID))
+        assert client._timeline_cache.total_events == 0
+
+    def test_batch_timeline_decryption(self, tempdir):
+        config = ClientConfig(decryption_workers=2)
+        client = Client("ephemeral", "DEVICEID", tempdir, config)
+        client.receive_response(self.login_response)
+        client.receive_response(self.sync_response)
+
+        olm = client.olm
+        olm.create_outbound_group_session(TEST_ROOM_ID)
+        olm.outbound_group_sessions[TEST_ROOM_ID].shared = True
+
+        events = []
+
+        for index in range(3):
+            content = olm.group_encrypt(TEST_ROOM_ID, {
+                "type": "m.room.message",
+                "content": {"msgtype": "m.text", "body": str(index)}
+            })
+            events.append(MegolmEvent.from_dict({
+                "event_id": "event_id_{}".format(index),
+                "sender": client.user_id,
+                "origin_server_ts": 1516809890615,
+                "type": "m.room.encrypted",
+                "content": content,
+            }))
+
+        messages = []
+
+        def cb(_, event):
+            messages.append(event)
+
+        client.add_event_callback(cb, RoomMessageText)
+
+        response = self.sync_response
+        timeline = response.rooms.join[TEST_ROOM_ID].timeline
+        timeline.events = events
+        response.next_batch = "token456"
+
+        client.receive_response(response)
+
+        assert [e.body for e in messages] == ["0", "1", "2"]
+        assert all(isinstance(e, RoomMessageText) for e in timeline.events)
+        assert client._decryption_executor
+
+    def test_decryption_executor_shutdown(self, tempdir):
+        config = ClientConfig(decryption_workers=2)
+        client = HttpClient(
+            "example.org", "ephemeral", "DEVICEID", tempdir, config
+        )
+        assert not client._decryption_executor
+
+        executor = client._get_decryption_executor()
+        assert executor
+        assert client._get_decryption_executor() is executor
+
+        client.connect(TransportType.HTTP2)
+        client.disconnect()
+
+        assert not client._decryption_executor
+        assert executor._shutdown
+        assert client._get_decryption_executor() is not executor
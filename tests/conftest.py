@@ -25,6 +25,19 @@ def tempdir():
     shutil.rmtree(newpath)
 
 
+@pytest.fixture
+def slow_benchmark(benchmark):
+    """Benchmark fixture for benchmarks that are too slow to run as tests.
+
+    Benchmarks using this fixture are skipped if benchmarks are disabled, e.g.
+    with --benchmark-disable.
+    """
+    if benchmark.disabled:
+        pytest.skip("Benchmarks are disabled")
+
+    return benchmark
+
+
 @pytest.fixture
 def client(tempdir):
     return Client("ephemeral", "DEVICEID", tempdir)
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from nio.client import CallbackDispatcher
+
+
+class TestClass:
+    async def test_ordering_per_key(self):
+        dispatcher = CallbackDispatcher(max_workers=4)
+        handled = []
+
+        async def callback(key, index):
+            # Later callbacks finish faster, they would overtake earlier ones
+            # if they weren't ordered.
+            await asyncio.sleep(0.001 * (10 - index))
+            handled.append((key, index))
+
+        for index in range(10):
+            for key in ("a", "b", "c"):
+                await dispatcher.dispatch(key, callback, key, index)
+
+        await dispatcher.join()
+
+        assert len(handled) == 30
+
+        for key in ("a", "b", "c"):
+            assert [i for k, i in handled if k == key] == list(range(10))
+
+        await dispatcher.close()
+
+    async def test_bounded_concurrency(self):
+        dispatcher = CallbackDispatcher(max_workers=3)
+        running = 0
+        max_running = 0
+
+        async def callback():
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.005)
+            running -= 1
+
+        for index in range(20):
+            await dispatcher.dispatch("room{}".format(index), callback)
+
+        await dispatcher.join()
+
+        assert max_running == 3
+        assert dispatcher.queued == 0
+
+        await dispatcher.close()
+
+    async def test_backpressure(self):
+        dispatcher = CallbackDispatcher(max_workers=1, max_queued=2)
+        release = asyncio.Event()
+
+        async def callback():
+            await release.wait()
+
+        await dispatcher.dispatch(None, callback)
+        await dispatcher.dispatch(None, callback)
+        assert dispatcher.queued == 2
+
+        blocked = asyncio.ensure_future(dispatcher.dispatch(None, callback))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+
+        release.set()
+        await blocked
+        await dispatcher.join()
+
+        assert dispatcher.queued == 0
+
+        await dispatcher.close()
+
+    async def test_errors_and_sync_callbacks(self):
+        dispatcher = CallbackDispatcher(max_workers=2)
+        handled = []
+
+        def failing():
+            raise ValueError("Callback failure")
+
+        await dispatcher.dispatch("a", failing)
+        await dispatcher.dispatch("a", handled.append, 1)
+
+        await dispatcher.join()
+
+        assert handled == [1]
+
+        await dispatcher.close()
+
+    async def test_close(self):
+        dispatcher = CallbackDispatcher(max_workers=1)
+        handled = []
+
+        async def callback(index):
+            await asyncio.sleep(1)
+            handled.append(index)
+
+        await dispatcher.dispatch(None, callback, 1)
+        await dispatcher.dispatch(None, callback, 2)
+        await dispatcher.close()
+
+        assert dispatcher.queued == 0
+        await dispatcher.join()
+        assert handled == []
+
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            CallbackDispatcher(max_workers=0)
+
+        with pytest.raises(ValueError):
+            CallbackDispatcher(max_queued=0)
@@ -3,14 +3,17 @@
 import copy
 import json
 import os
+import shutil
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import pytest
 from olm import Account, OlmMessage, OlmPreKeyMessage, OutboundGroupSession
 
 from nio.crypto import (DeviceStore, GroupSessionStore, InboundGroupSession,
-                        Olm, OlmDevice, OutboundSession, OutgoingKeyRequest,
+                        LazyGroupSessionStore, LazySessionStore, Olm,
+                        OlmDevice, OutboundSession, OutgoingKeyRequest,
                         SessionStore, Session)
 from nio.events import (ForwardedRoomKeyEvent, MegolmEvent, OlmEvent,
                         RoomKeyEvent, RoomMessageText, UnknownBadEvent,
@@ -51,6 +54,13 @@ def ephemeral(func):
     return wrapper
 
 
+@pytest.fixture
+def example_dir(tempdir):
+    """Directory with a copy of the example store, which tests may change."""
+    shutil.copy(os.path.join(ephemeral_dir, "example_DEVICEID.db"), tempdir)
+    return tempdir
+
+
 @pytest.fixture
 def olm_account(tempdir):
     return Olm(
@@ -75,8 +85,9 @@ class TestClass:
         with open(filename) as f:
             return json.loads(f.read())
 
-    def _get_store(self, user_id, device_id, pickle_key=""):
-        return DefaultStore(user_id, device_id, ephemeral_dir, pickle_key)
+    def _get_store(self, user_id, device_id, pickle_key="",
+                   path=ephemeral_dir):
+        return DefaultStore(user_id, device_id, path, pickle_key)
 
     @staticmethod
     def olm_message_to_event(message_dict, recipient, sender):
@@ -99,15 +110,15 @@ class TestClass:
         olm = self.ephemeral_olm
         assert isinstance(olm.account, Account)
 
-    def _load(self, user_id, device_id, pickle_key=""):
+    def _load(self, user_id, device_id, pickle_key="", path=ephemeral_dir):
         return Olm(
             user_id,
             device_id,
-            self._get_store(user_id, device_id, pickle_key)
+            self._get_store(user_id, device_id, pickle_key, path)
         )
 
-    def test_account_loading(self):
-        olm = self._load("example", "DEVICEID", PICKLE_KEY)
+    def test_account_loading(self, example_dir):
+        olm = self._load("example", "DEVICEID", PICKLE_KEY, example_dir)
         assert isinstance(olm.account, Account)
         assert (olm.account.identity_keys["curve25519"]
                 == "Xjuu9d2KjHLGIHpCOCHS7hONQahapiwI1MhVmlPlCFM")
@@ -236,8 +247,8 @@ class TestClass:
             OutboundSession
         )
 
-    def test_olm_session_load(self):
-        olm = self._load("example", "DEVICEID", PICKLE_KEY)
+    def test_olm_session_load(self, example_dir):
+        olm = self._load("example", "DEVICEID", PICKLE_KEY, example_dir)
 
         bob_session = olm.session_store.get(
             "+Qs131S/odNdWG6VJ8hiy9YZW0us24wnsDjYQbaxLk4"
@@ -870,6 +881,142 @@ class TestClass:
         assert alice.outbound_group_sessions["!test:example.org"]
         assert alice.is_device_ignored(bob_device)
 
+    def test_deferred_session_saving(self, tempdir):
+        alice = Olm(
+            AliceId,
+            Alice_device,
+            DefaultStore(AliceId, Alice_device, tempdir)
+        )
+        bob = Olm(BobId, Bob_device, DefaultStore(BobId, Bob_device, tempdir))
+
+        alice_device = OlmDevice(
+            alice.user_id,
+            alice.device_id,
+            alice.account.identity_keys
+        )
+        bob_device = OlmDevice(
+            bob.user_id,
+            bob.device_id,
+            bob.account.identity_keys
+        )
+
+        alice.device_store.add(bob_device)
+        bob.device_store.add(alice_device)
+
+        bob.account.generate_one_time_keys(1)
+        one_time = list(bob.account.one_time_keys["curve25519"].values())[0]
+        bob.account.mark_keys_as_published()
+
+        alice.create_session(one_time, bob_device.curve25519)
+
+        _, to_device = alice.share_group_session(
+            TEST_ROOM,
+            [bob.user_id],
+            ignore_unverified_devices=True
+        )
+        olm_message = self.olm_message_to_event(to_device, bob, alice)
+        event = ToDeviceEvent.parse_event(olm_message)
+
+        assert isinstance(bob.decrypt_event(event), RoomKeyEvent)
+
+        # The new session used up a one-time key, it's saved right away.
+        session = bob.session_store.get(alice_device.curve25519)
+        assert not bob._dirty_sessions
+        loaded = bob.store.load_sessions().get(alice_device.curve25519)
+        assert loaded.id == session.id
+
+        # Decrypting with an existing session only marks it as changed.
+        _, to_device = alice.share_group_session(
+            "!other_room:example.org",
+            [bob.user_id],
+            ignore_unverified_devices=True
+        )
+        olm_message = self.olm_message_to_event(to_device, bob, alice)
+        event = ToDeviceEvent.parse_event(olm_message)
+
+        assert isinstance(bob.decrypt_event(event), RoomKeyEvent)
+        assert bob._dirty_sessions == {
+            session.id: (alice_device.curve25519, session)
+        }
+
+        group_session_id = alice.outbound_group_sessions[TEST_ROOM].id
+        assert group_session_id in bob._dirty_group_sessions
+        assert not bob.store.load_inbound_group_sessions().get(
+            TEST_ROOM, alice_device.curve25519, group_session_id
+        )
+
+        bob.flush_sessions()
+
+        assert not bob._dirty_sessions
+        assert not bob._dirty_group_sessions
+        loaded = bob.store.load_sessions().get(alice_device.curve25519)
+        assert loaded.id == session.id
+        assert bob.store.load_inbound_group_sessions().get(
+            TEST_ROOM, alice_device.curve25519, group_session_id
+        )
+
+    def test_lazy_group_session_loading(self, tempdir):
+        olm = Olm(
+            AliceId,
+            Alice_device,
+            DefaultStore(AliceId, Alice_device, tempdir),
+            group_session_cache_size=1
+        )
+        assert isinstance(olm.inbound_group_store, LazyGroupSessionStore)
+        olm.create_outbound_group_session(TEST_ROOM)
+        olm.create_outbound_group_session("!other_room")
+
+        sender_key = olm.account.identity_keys["curve25519"]
+        session_id = olm.outbound_group_sessions[TEST_ROOM].id
+
+        olm = Olm(
+            AliceId,
+            Alice_device,
+            DefaultStore(AliceId, Alice_device, tempdir),
+            group_session_cache_size=1
+        )
+        assert not list(olm.inbound_group_store)
+
+        session = olm.inbound_group_store.get(
+            TEST_ROOM, sender_key, session_id
+        )
+        assert session.id == session_id
+        assert list(olm.inbound_group_store) == [session]
+
+    def test_lazy_session_loading(self, tempdir):
+        olm = Olm(
+            AliceId,
+            Alice_device,
+            DefaultStore(AliceId, Alice_device, tempdir),
+            session_cache_size=1
+        )
+        assert isinstance(olm.session_store, LazySessionStore)
+
+        bob, carol = Account(), Account()
+        bob.generate_one_time_keys(1)
+        carol.generate_one_time_keys(1)
+        bob_curve = bob.identity_keys["curve25519"]
+        carol_curve = carol.identity_keys["curve25519"]
+
+        session = olm.create_session(
+            list(bob.one_time_keys["curve25519"].values())[0], bob_curve
+        )
+        olm.create_session(
+            list(carol.one_time_keys["curve25519"].values())[0], carol_curve
+        )
+
+        olm = Olm(
+            AliceId,
+            Alice_device,
+            DefaultStore(AliceId, Alice_device, tempdir),
+            session_cache_size=1
+        )
+        assert isinstance(olm.session_store, LazySessionStore)
+        assert not list(olm.session_store)
+
+        assert olm.session_store.get(bob_curve).id == session.id
+        assert [s.id for s in olm.session_store] == [session.id]
+
     def test_session_unwedging(self, olm_account, bob_account):
 
         alice = olm_account
@@ -1139,6 +1286,56 @@ class TestClass:
 
         assert decrypted_event.body == message["content"]["body"]
 
+    def test_batch_megolm_decryption(self, olm_account):
+        olm = olm_account
+        rooms = [TEST_ROOM, "!other_room"]
+
+        for room_id in rooms:
+            olm.create_outbound_group_session(room_id)
+            olm.outbound_group_sessions[room_id].shared = True
+
+        def encrypt(room_id, body, event_id):
+            message = {
+                "type": "m.room.message",
+                "content": {"msgtype": "m.text", "body": body}
+            }
+            return {
+                "event_id": event_id,
+                "type": "m.room.encrypted",
+                "sender": olm.user_id,
+                "origin_server_ts": 0,
+                "content": olm.group_encrypt(room_id, message),
+                "room_id": room_id
+            }
+
+        messages = [
+            encrypt(rooms[index % 2], str(index), "!event{}".format(index))
+            for index in range(20)
+        ]
+
+        # The first message replayed with a new event id.
+        replayed = dict(messages[0], event_id="!replayed")
+
+        missing = dict(messages[1], room_id="!missing_room")
+
+        events = [
+            MegolmEvent.from_dict(message)
+            for message in messages + [replayed, missing]
+        ]
+
+        with ThreadPoolExecutor(2) as executor:
+            decrypted = olm.decrypt_megolm_events(events, executor=executor)
+
+        assert [e.body for e in decrypted[:20]] == [
+            str(index) for index in range(20)
+        ]
+        assert [e.room_id for e in decrypted[:4]] == rooms * 2
+        assert decrypted[20:] == [None, None]
+
+        # The original events are still fine if they are decrypted again.
+        decrypted = olm.decrypt_megolm_events(events[:2])
+        assert [e.body for e in decrypted] == ["0", "1"]
+
     def test_key_forwards(self, olm_account, bob_account):
         alice = olm_account
         bob = bob_account
@@ -2,9 +2,16 @@
 
 from __future__ import unicode_literals
 
+import gc
 import json
 import pdb
+import tracemalloc
+from copy import deepcopy
 
+import pytest
+from dataclasses import dataclass, field
+
+from helpers import large_sync_response
 from nio.events import (
     BadEvent,
     OlmEvent,
@@ -28,6 +35,7 @@ from nio.events import (
     Event,
     RoomEncryptionEvent,
     InviteEvent,
+    LazyEvent,
     RoomKeyEvent,
     ForwardedRoomKeyEvent,
     MegolmEvent,
@@ -57,7 +65,56 @@ from nio.events import (
     DummyEvent,
     RoomKeyRequest,
     RoomKeyRequestCancellation,
+    RoomMessage,
+    UnknownEvent,
+    CompactEvent,
+    SourceRetention,
+    compact_event,
+    lazy_events,
+    parse_lazy_event,
+    register_event_type,
+    unregister_event_type,
 )
+from nio.events.registry import custom_event_types as registered_types
+from nio.events.registry import registered_event_types
+from nio.schemas import ValidationLevel, validation_level
+
+
+@dataclass
+class PollEvent(Event):
+    question: str = field()
+
+    @classmethod
+    def from_dict(cls, parsed_dict):
+        return cls(parsed_dict, parsed_dict["content"]["question"])
+
+
+@dataclass
+class LocationMessage(RoomMessage):
+    geo_uri: str = field()
+
+    @classmethod
+    def from_dict(cls, parsed_dict):
+        return cls(parsed_dict, parsed_dict["content"]["geo_uri"])
+
+
+@dataclass
+class PingEvent(ToDeviceEvent):
+    @classmethod
+    def from_dict(cls, parsed_dict):
+        return cls(parsed_dict, parsed_dict["sender"])
+
+
+@pytest.fixture
+def custom_event_types():
+    """Remove the custom event types that a test registers."""
+    yield
+
+    unregister_event_type("org.example.poll")
+    unregister_event_type("m.room.message", "org.example.location")
+    unregister_event_type("m.room.message", "m.image")
+    unregister_event_type("org.example.ping")
+    unregister_event_type("m.room.name")
 
 
 class TestClass:
@@ -485,3 +542,410 @@ class TestClass:
         assert event.thumbnail_key
         assert event.thumbnail_hashes
         assert event.thumbnail_iv
+
+    def test_validation_level_none(self):
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/message_text.json"
+        )
+        parsed_dict["content"]["body"] = 1
+
+        with validation_level(ValidationLevel.none):
+            event = Event.parse_event(parsed_dict)
+
+        assert isinstance(event, RoomMessageText)
+        assert event.body == 1
+
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/message_text.json"
+        )
+        parsed_dict.pop("content")
+
+        with validation_level(ValidationLevel.none):
+            event = Event.parse_event(parsed_dict)
+
+        assert isinstance(event, BadEvent)
+
+        with validation_level(ValidationLevel.none):
+            event = Event.parse_event({"type": "m.unknown"})
+
+        assert isinstance(event, UnknownBadEvent)
+
+    def test_validation_level_none_create_defaults(self):
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/create.json"
+        )
+        parsed_dict["content"].pop("m.federate")
+        parsed_dict["content"].pop("room_version")
+
+        with validation_level(ValidationLevel.none):
+            event = Event.parse_event(parsed_dict)
+
+        assert isinstance(event, RoomCreateEvent)
+        assert event.federate is True
+        assert event.room_version == "1"
+
+    def test_validation_level_none_power_levels_defaults(self):
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/power_levels.json"
+        )
+
+        for key in ("ban", "kick", "events", "users"):
+            parsed_dict["content"].pop(key)
+
+        with validation_level(ValidationLevel.none):
+            event = Event.parse_event(parsed_dict)
+
+        assert isinstance(event, PowerLevelsEvent)
+        assert event.power_levels.defaults.ban == 50
+        assert event.power_levels.defaults.kick == 50
+        assert event.power_levels.users == {}
+
+    def test_validation_level_structural(self):
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/message_text.json"
+        )
+        parsed_dict["content"]["body"] = 1
+
+        with validation_level(ValidationLevel.structural):
+            event = Event.parse_event(parsed_dict)
+
+        assert isinstance(event, RoomMessageText)
+
+        parsed_dict["content"].pop("body")
+
+        with validation_level(ValidationLevel.structural):
+            event = Event.parse_event(parsed_dict)
+
+        assert isinstance(event, BadEvent)
+
+    def test_validation_level_to_device_and_ephemeral(self):
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/key_start.json"
+        )
+        parsed_dict["content"].pop("transaction_id")
+
+        for level in ValidationLevel:
+            with validation_level(level):
+                event = ToDeviceEvent.parse_event(deepcopy(parsed_dict))
+
+            assert isinstance(event, UnknownBadEvent)
+
+        parsed_dict = TestClass._load_response("tests/data/events/typing.json")
+        parsed_dict["content"].pop("user_ids")
+
+        for level in ValidationLevel:
+            with validation_level(level):
+                event = EphemeralEvent.parse_event(deepcopy(parsed_dict))
+
+            assert event is None
+
+    def test_lazy_event(self):
+        parsed_dict = TestClass._load_response("tests/data/events/member.json")
+
+        with lazy_events():
+            event = Event.parse_event(parsed_dict)
+
+        assert isinstance(event, RoomMemberEvent)
+        assert isinstance(event, LazyEvent)
+        assert event.sender == "@example:localhost"
+        assert "membership" not in vars(event)
+
+        assert event.membership == "join"
+        assert event.content["displayname"] == "example"
+        assert not event.decrypted
+
+    def test_lazy_event_message(self):
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/message_text.json"
+        )
+        parsed_dict["unsigned"] = {"transaction_id": "txn1"}
+
+        with lazy_events():
+            event = Event.parse_event(deepcopy(parsed_dict))
+
+        assert isinstance(event, RoomMessageText)
+        assert event.body == "is dancing"
+        assert event.transaction_id == "txn1"
+
+        parsed_dict["content"].pop("body")
+
+        with lazy_events():
+            event = Event.parse_event(deepcopy(parsed_dict))
+
+        assert isinstance(event, RoomMessageText)
+
+        parse_lazy_event(event)
+
+        assert isinstance(event, BadEvent)
+        assert not isinstance(event, RoomMessageText)
+
+    def test_lazy_event_eager_types(self):
+        parsed_dict = TestClass._load_response("tests/data/events/megolm.json")
+
+        with lazy_events():
+            event = Event.parse_event(parsed_dict)
+
+        assert isinstance(event, MegolmEvent)
+        assert not isinstance(event, LazyEvent)
+
+    def test_register_event_type(self, custom_event_types):
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/message_text.json"
+        )
+        parsed_dict["type"] = "org.example.poll"
+        parsed_dict["content"] = {"question": "Lunch?"}
+
+        event = Event.parse_event(deepcopy(parsed_dict))
+        assert isinstance(event, UnknownEvent)
+
+        register_event_type("org.example.poll", PollEvent)
+        event = Event.parse_event(deepcopy(parsed_dict))
+
+        assert isinstance(event, PollEvent)
+        assert event.question == "Lunch?"
+
+        parsed_dict["type"] = "m.room.message"
+        parsed_dict["content"] = {
+            "msgtype": "org.example.location",
+            "body": "Here",
+            "geo_uri": "geo:51.5008,0.1247",
+        }
+        parsed_dict["unsigned"] = {"transaction_id": "txn1"}
+
+        register_event_type(
+            "m.room.message",
+            LocationMessage,
+            msgtype="org.example.location"
+        )
+        event = Event.parse_event(parsed_dict)
+
+        assert isinstance(event, LocationMessage)
+        assert event.geo_uri == "geo:51.5008,0.1247"
+        assert event.transaction_id == "txn1"
+
+        register_event_type("org.example.ping", PingEvent)
+        event = ToDeviceEvent.parse_event({
+            "sender": "@alice:example.org",
+            "type": "org.example.ping",
+            "content": {"ping": True},
+        })
+
+        assert isinstance(event, PingEvent)
+
+    def test_unregister_event_type(self, custom_event_types):
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/message_text.json"
+        )
+        parsed_dict["type"] = "org.example.poll"
+        parsed_dict["content"] = {"question": "Lunch?"}
+
+        register_event_type("org.example.poll", PollEvent)
+        unregister_event_type("org.example.poll")
+
+        event = Event.parse_event(deepcopy(parsed_dict))
+        assert isinstance(event, UnknownEvent)
+
+        # Unregistering a replaced built-in type restores the built-in class.
+        parsed_dict["type"] = "m.room.name"
+        parsed_dict["state_key"] = ""
+        parsed_dict["content"] = {"name": "Lunch", "question": "Lunch?"}
+
+        register_event_type("m.room.name", PollEvent)
+        assert isinstance(Event.parse_event(deepcopy(parsed_dict)), PollEvent)
+
+        unregister_event_type("m.room.name")
+        event = Event.parse_event(deepcopy(parsed_dict))
+        assert isinstance(event, RoomNameEvent)
+
+        register_event_type(
+            "m.room.message",
+            LocationMessage,
+            msgtype="org.example.location"
+        )
+        unregister_event_type("m.room.message", "org.example.location")
+
+        parsed_dict["type"] = "m.room.message"
+        parsed_dict.pop("state_key")
+        parsed_dict["content"] = {
+            "msgtype": "org.example.location",
+            "body": "Here",
+            "geo_uri": "geo:51.5008,0.1247",
+        }
+        event = Event.parse_event(parsed_dict)
+
+        assert not isinstance(event, LocationMessage)
+
+    def test_register_decrypted_msgtype(self, custom_event_types):
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/room_encrypted_image.json"
+        )
+        parsed_dict["content"]["geo_uri"] = "geo:51.5008,0.1247"
+
+        event = Event.parse_decrypted_event(deepcopy(parsed_dict))
+        assert isinstance(event, RoomEncryptedImage)
+
+        # The registered class is used for decrypted messages as well.
+        register_event_type("m.room.message", LocationMessage, "m.image")
+        event = Event.parse_decrypted_event(deepcopy(parsed_dict))
+
+        assert isinstance(event, LocationMessage)
+        assert event.geo_uri == "geo:51.5008,0.1247"
+
+        unregister_event_type("m.room.message", "m.image")
+        event = Event.parse_decrypted_event(deepcopy(parsed_dict))
+
+        assert isinstance(event, RoomEncryptedImage)
+
+    def test_registered_event_types(self, custom_event_types):
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/message_text.json"
+        )
+        parsed_dict["type"] = "org.example.poll"
+        parsed_dict["content"] = {"question": "Lunch?"}
+
+        register_event_type("m.room.name", PollEvent)
+        register_event_type("m.room.message", LocationMessage, "m.image")
+
+        assert registered_event_types() == [
+            ("m.room.name", PollEvent, None),
+            ("m.room.message", LocationMessage, "m.image"),
+        ]
+
+        unregister_event_type("m.room.message", "m.image")
+        assert registered_event_types() == [("m.room.name", PollEvent, None)]
+
+        # Only the given registrations are used inside of the context.
+        with registered_types([("org.example.poll", PollEvent, None)]):
+            event = Event.parse_event(deepcopy(parsed_dict))
+            assert isinstance(event, PollEvent)
+            assert registered_event_types() == [
+                ("org.example.poll", PollEvent, None)
+            ]
+
+            parsed_dict["type"] = "m.room.name"
+            parsed_dict["state_key"] = ""
+            parsed_dict["content"] = {"name": "Lunch", "question": "Lunch?"}
+            event = Event.parse_event(deepcopy(parsed_dict))
+            assert isinstance(event, RoomNameEvent)
+
+        assert isinstance(Event.parse_event(deepcopy(parsed_dict)), PollEvent)
+        assert registered_event_types() == [("m.room.name", PollEvent, None)]
+
+        parsed_dict["type"] = "org.example.poll"
+        parsed_dict["content"] = {"question": "Lunch?"}
+        parsed_dict.pop("state_key")
+        event = Event.parse_event(parsed_dict)
+        assert isinstance(event, UnknownEvent)
+
+    def test_register_event_type_errors(self, custom_event_types):
+        with pytest.raises(ValueError):
+            register_event_type("m.room.message", LocationMessage)
+
+        with pytest.raises(ValueError):
+            register_event_type("org.example.poll", PollEvent, "m.text")
+
+        with pytest.raises(ValueError):
+            register_event_type("org.example.poll", dict)
+
+    def test_parse_mixed_timeline_benchmark(self, benchmark):
+        response = large_sync_response(10, 200)
+        events = [
+            event
+            for room in response["rooms"]["join"].values()
+            for event in room["timeline"]["events"]
+        ]
+
+        # Skip the schema validation so the benchmark measures the dispatch.
+        def parse(events):
+            with validation_level(ValidationLevel.none):
+                return [Event.parse_event(event) for event in events]
+
+        def setup():
+            return (deepcopy(events), ), {}
+
+        parsed = benchmark.pedantic(parse, setup=setup, rounds=10)
+
+        assert len(parsed) == len(events)
+        assert not any(isinstance(event, BadEvent) for event in parsed)
+
+    def test_compact_event(self):
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/message_text.json"
+        )
+        event = Event.parse_event(deepcopy(parsed_dict))
+        compact = compact_event(event)
+
+        assert isinstance(compact, CompactEvent)
+        assert isinstance(compact, RoomMessageText)
+        assert isinstance(compact, Event)
+        assert "body" in type(compact).__slots__
+        # All the fields are stored in slots.
+        assert not vars(compact)
+        assert isinstance(compact._source, bytes)
+        assert compact.source == parsed_dict
+        assert compact.body == event.body
+        assert compact.event_id == event.event_id
+        assert str(compact) == str(event)
+        assert compact_event(compact) is compact
+
+        compact = compact_event(event, SourceRetention.drop)
+        assert compact.source is None
+        assert compact.formatted_body == event.formatted_body
+
+        compact = compact_event(event, SourceRetention.keep)
+        assert compact.source is event.source
+
+    def test_compact_lazy_and_bad_events(self):
+        parsed_dict = TestClass._load_response("tests/data/events/member.json")
+
+        with lazy_events():
+            event = Event.parse_event(parsed_dict)
+
+        compact = compact_event(event)
+
+        assert isinstance(compact, RoomMemberEvent)
+        assert not isinstance(compact, LazyEvent)
+        assert compact.membership == "join"
+
+        parsed_dict = TestClass._load_response(
+            "tests/data/events/message_text.json"
+        )
+        parsed_dict["content"].pop("body")
+        event = Event.parse_event(parsed_dict)
+
+        assert isinstance(event, BadEvent)
+        assert compact_event(event) is event
+
+    def test_compact_event_memory_benchmark(self, slow_benchmark):
+        with open("tests/data/events/message_text.json") as f:
+            source = f.read()
+
+        def parse(convert):
+            gc.collect()
+            tracemalloc.start()
+
+            try:
+                with validation_level(ValidationLevel.none):
+                    events = [
+                        convert(Event.parse_event(json.loads(source)))
+                        for _ in range(100000)
+                    ]
+
+                return events, tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+
+        events, plain_size = parse(lambda event: event)
+        del events
+
+        events, compact_size = slow_benchmark.pedantic(
+            parse,
+            args=(compact_event, ),
+            rounds=1
+        )
+
+        slow_benchmark.extra_info["plain_size"] = plain_size
+        slow_benchmark.extra_info["compact_size"] = compact_size
+
+        assert isinstance(events[0], RoomMessageText)
+        assert compact_size < plain_size
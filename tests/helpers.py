@@ -231,3 +231,101 @@ class FrameFactory:
         f.origin = origin
         f.field = field
         return f
+
+
+def large_sync_response(room_count=100, events_per_room=100):
+    """
+    Builds a sync response dictionary with `room_count` joined rooms holding
+    `events_per_room` timeline events each, using a realistic mix of events.
+    """
+    def event(room_index, index, event_type, content, **extra):
+        event_dict = {
+            "content": content,
+            "event_id": "$event{}_{}:example.org".format(room_index, index),
+            "origin_server_ts": 1516809890615 + index,
+            "sender": "@user{}:example.org".format(index % 20),
+            "type": event_type,
+            "unsigned": {"age": 1000},
+        }
+        event_dict.update(extra)
+        return event_dict
+
+    def timeline_event(room_index, index):
+        kind = index % 10
+
+        if kind == 7:
+            return event(
+                room_index, index, "m.room.member",
+                {"membership": "join", "displayname": "user{}".format(index)},
+                state_key="@user{}:example.org".format(index % 20),
+            )
+        if kind == 8:
+            return event(
+                room_index, index, "m.room.encrypted",
+                {
+                    "algorithm": "m.megolm.v1.aes-sha2",
+                    "ciphertext": "AwgAEnAC" * 8,
+                    "device_id": "DEVICEID",
+                    "sender_key": "IlRMeOPX2e0MurIyfWEucYBRVOEEUMrOHqn/8mLqMjA",
+                    "session_id": "X3lUlvLELLYxeTx4yOVu6UDpasGEVO0Jbu+QFnm0cKQ",
+                },
+            )
+        if kind == 9:
+            return event(
+                room_index, index, "m.reaction",
+                {"m.relates_to": {
+                    "rel_type": "m.annotation",
+                    "event_id": "$event{}_0:example.org".format(room_index),
+                    "key": "👍",
+                }},
+            )
+
+        content = {
+            "body": "Message number {}".format(index),
+            "msgtype": "m.notice" if kind == 6 else "m.text",
+        }
+        if kind % 2:
+            content["format"] = "org.matrix.custom.html"
+            content["formatted_body"] = "<b>Message number {}</b>".format(
+                index
+            )
+
+        return event(room_index, index, "m.room.message", content)
+
+    rooms = {}
+
+    for room_index in range(room_count):
+        state = [
+            event(room_index, -1, "m.room.create",
+                  {"creator": "@user0:example.org"}, state_key=""),
+            event(room_index, -2, "m.room.name",
+                  {"name": "Room {}".format(room_index)}, state_key=""),
+            event(room_index, -3, "m.room.power_levels", {
+                "ban": 50, "events": {}, "events_default": 0, "invite": 0,
+                "kick": 50, "redact": 50, "state_default": 50,
+                "users": {"@user0:example.org": 100}, "users_default": 0,
+            }, state_key=""),
+        ]
+
+        rooms["!room{}:example.org".format(room_index)] = {
+            "account_data": {"events": []},
+            "ephemeral": {"events": []},
+            "state": {"events": state},
+            "summary": {},
+            "timeline": {
+                "events": [
+                    timeline_event(room_index, index)
+                    for index in range(events_per_room)
+                ],
+                "limited": False,
+                "prev_batch": "t392-516_47314_0_7_1_1_1_11444_1",
+            },
+        }
+
+    return {
+        "device_one_time_keys_count": {},
+        "next_batch": "s526_47314_0_7_1_1_1_11444_1",
+        "device_lists": {"changed": [], "left": []},
+        "rooms": {"invite": {}, "join": rooms, "leave": {}},
+        "to_device": {"events": []},
+    }
@@ -0,0 +1,129 @@
+import json
+import subprocess
+import sys
+from json import JSONDecodeError
+
+import pytest
+
+from helpers import large_sync_response
+from nio import Client, ClientConfig
+from nio.api import Api
+from nio.json_backend import (JsonBackend, available_backends, dumps,
+                              get_json_backend, loads, set_json_backend)
+
+BACKENDS = [
+    JsonBackend.stdlib,
+    JsonBackend.orjson,
+    JsonBackend.ujson,
+]
+
+
+@pytest.fixture(params=BACKENDS, ids=lambda backend: backend.value)
+def backend(request):
+    if request.param is not JsonBackend.stdlib:
+        pytest.importorskip(request.param.value)
+
+    previous = get_json_backend()
+    set_json_backend(request.param)
+    yield request.param
+    set_json_backend(previous)
+
+
+class TestClass:
+    def test_roundtrip(self, backend):
+        document = {
+            "body": "ü€\U0001f600 </a>",
+            "count": 3,
+            "ratio": 0.1,
+            "nested": {"list": [True, False, None]},
+        }
+
+        encoded = dumps(document)
+
+        assert isinstance(encoded, str)
+        assert loads(encoded) == document
+        assert loads(encoded.encode("utf-8")) == document
+        assert json.loads(encoded) == document
+
+    def test_stdlib_fallback(self, backend):
+        document = {"big": 1 << 70}
+
+        assert loads(json.dumps(document)) == document
+        assert json.loads(dumps(document)) == document
+        assert json.loads(dumps({1: "a"})) == {"1": "a"}
+
+    @pytest.mark.parametrize("data", ["", "{", '{"a": 1', "[1,]", "nope"])
+    def test_invalid_json(self, backend, data):
+        with pytest.raises(JSONDecodeError):
+            loads(data)
+
+    def test_canonical_json(self, backend):
+        document = {
+            "z": [1, 2.5, 1e100],
+            "a": "ü€\U0001f600 </a>  ",
+            "m": {"b": None, "a": True},
+        }
+
+        assert Api.to_canonical_json(document) == json.dumps(
+            document,
+            ensure_ascii=False,
+            separators=(",", ":"),
+            sort_keys=True,
+        )
+
+    def test_default_backend(self):
+        # Importing nio doesn't switch to a faster backend on its own.
+        output = subprocess.check_output([
+            sys.executable,
+            "-c",
+            "import nio; print(nio.json_backend.get_json_backend().value)",
+        ])
+        assert output.decode().strip() == JsonBackend.stdlib.value
+
+    def test_auto_backend(self):
+        previous = get_json_backend()
+
+        try:
+            set_json_backend(JsonBackend.auto)
+            assert get_json_backend() == available_backends()[0]
+        finally:
+            set_json_backend(previous)
+
+        assert available_backends()[-1] == JsonBackend.stdlib
+
+    def test_client_config(self, backend):
+        set_json_backend(JsonBackend.stdlib)
+
+        Client("ephemeral", config=ClientConfig(json_backend=backend))
+        assert get_json_backend() == backend
+
+        Client("ephemeral")
+        assert get_json_backend() == backend
+
+    def test_sync_parse_benchmark(self, backend, benchmark):
+        data = json.dumps(large_sync_response(100, 100)).encode("utf-8")
+
+        result = benchmark(loads, data)
+
+        assert len(result["rooms"]["join"]) == 100
+
+    def test_room_send_encode_benchmark(self, backend, benchmark):
+        content = {
+            "msgtype": "m.text",
+            "body": "Hello world ü " * 20,
+            "format": "org.matrix.custom.html",
+            "formatted_body": "<b>Hello world ü</b> " * 20,
+            "m.relates_to": {"m.in_reply_to": {"event_id": "$abc:example.org"}},
+        }
+
+        def encode():
+            for i in range(1000):
+                Api.room_send(
+                    "token",
+                    "!room:example.org",
+                    "m.room.message",
+                    content,
+                    str(i),
+                )
+
+        benchmark(encode)
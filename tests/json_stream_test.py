@@ -0,0 +1,73 @@
+import json
+from json import JSONDecodeError
+
+import pytest
+
+from helpers import large_sync_response
+from nio.json_stream import iter_object_members
+
+SYNC_PATHS = [("rooms", "invite"), ("rooms", "join"), ("rooms", "leave")]
+
+
+async def chunked(data, size):
+    for index in range(0, len(data), size):
+        yield data[index:index + size]
+
+
+async def collect(chunks, split_paths):
+    return [
+        member async for member in iter_object_members(chunks, split_paths)
+    ]
+
+
+class TestClass:
+    @pytest.mark.parametrize("chunk_size", [1, 7, 4096, 1 << 24])
+    async def test_sync_members(self, chunk_size):
+        sync = large_sync_response(3, 5)
+        data = json.dumps(sync, ensure_ascii=False).encode("utf-8")
+
+        members = await collect(chunked(data, chunk_size), SYNC_PATHS)
+
+        assert (("next_batch", ), sync["next_batch"]) in members
+
+        for room_id, room in sync["rooms"]["join"].items():
+            assert (("rooms", "join", room_id), room) in members
+
+        rebuilt = {}
+
+        for path, value in members:
+            parent = rebuilt
+
+            for key in path[:-1]:
+                parent = parent.setdefault(key, {})
+
+            parent[path[-1]] = value
+
+        rebuilt["rooms"].setdefault("invite", {})
+        rebuilt["rooms"].setdefault("leave", {})
+
+        assert rebuilt == sync
+
+    async def test_unicode_and_numbers(self):
+        document = {"a": "ü€\U0001f600", "b": 12345678901234567890,
+                    "c": {"d": [1.5, True, None]}}
+        data = json.dumps(document, ensure_ascii=False).encode("utf-8")
+
+        members = await collect(chunked(data, 1), [("c", )])
+
+        assert members == [
+            (("a", ), document["a"]),
+            (("b", ), document["b"]),
+            (("c", "d"), [1.5, True, None]),
+        ]
+
+    @pytest.mark.parametrize("data", [
+        b'{"a": 1,',
+        b'{"a": 1} trailing',
+        b'[1, 2]',
+        b'{"rooms": {"join": {"!a:b": {}',
+        b'',
+    ])
+    async def test_invalid_documents(self, data):
+        with pytest.raises(JSONDecodeError):
+            await collect(chunked(data, 3), SYNC_PATHS)
@@ -1,14 +1,21 @@
+import gc
+import resource
+import time
+
 from helpers import ephemeral, ephemeral_dir, faker
-from nio.crypto import (GroupSessionStore, InboundGroupSession, OlmAccount,
+from nio.crypto import (GroupSessionStore, InboundGroupSession,
+                        LazyGroupSessionStore, LazySessionStore, OlmAccount,
                         OutboundGroupSession, OutboundSession, SessionStore,
                         DeviceStore)
 from nio.exceptions import OlmTrustError
-from nio.store import Ed25519Key, Key, KeyStore, MatrixStore
+from nio.store import (DefaultStore, Ed25519Key, Key, KeyStore,
+                       MatrixStore, OlmSessions)
 
 BOB_ID = "@bob:example.org"
 BOB_DEVICE = "AGMTSWVYML"
 BOB_CURVE = "T9tOKF+TShsn6mk1zisW2IBsBbTtzDNvw99RBFMJOgI"
 BOB_ONETIME = "6QlQw3mGUveS735k/JDaviuoaih5eEi6S1J65iHjfgU"
+ALICE_CURVE = "Xjuu9d2KjHLGIHpCOCHS7hONQahapiwI1MhVmlPlCFM"
 TEST_ROOM = "!test:example.org"
 
 class TestClass:
@@ -99,3 +106,154 @@ class TestClass:
         assert not store.add(session)
 
         assert store[TEST_ROOM] == {BOB_CURVE: {session.id: session}}
+
+    def test_lazy_group_session_store(self, tempdir):
+        database = DefaultStore("ephemeral", "DEVICEID", tempdir)
+        account = OlmAccount()
+        database.save_account(account)
+
+        sessions = [
+            InboundGroupSession(
+                OutboundGroupSession().session_key,
+                account.identity_keys["ed25519"],
+                BOB_CURVE,
+                TEST_ROOM
+            ) for _ in range(3)
+        ]
+        database.save_inbound_group_sessions(sessions[:2])
+
+        unsaved = {sessions[2].id: sessions[2]}
+        store = LazyGroupSessionStore(database, 2, unsaved)
+        assert not list(store)
+
+        for session in sessions:
+            loaded = store.get(TEST_ROOM, BOB_CURVE, session.id)
+            assert loaded.id == session.id
+
+        # Only the most recently used sessions are kept.
+        assert len(store) == 2
+        assert store[TEST_ROOM][BOB_CURVE].keys() == {
+            sessions[1].id, sessions[2].id
+        }
+
+        assert not store.get(TEST_ROOM, BOB_CURVE, "missing")
+        assert not store.get("!other:example.org", BOB_CURVE, sessions[0].id)
+
+        session = InboundGroupSession(
+            OutboundGroupSession().session_key,
+            account.identity_keys["ed25519"],
+            BOB_CURVE,
+            TEST_ROOM
+        )
+        assert store.add(session)
+        assert not store.add(session)
+        assert store.get(TEST_ROOM, BOB_CURVE, session.id) is session
+
+    def test_lazy_session_store(self, tempdir):
+        database = DefaultStore("ephemeral", "DEVICEID", tempdir)
+        account = OlmAccount()
+        database.save_account(account)
+
+        sessions = [
+            OutboundSession(account, BOB_CURVE, BOB_ONETIME)
+            for _ in range(3)
+        ]
+        alice_session = OutboundSession(account, ALICE_CURVE, BOB_ONETIME)
+
+        database.save_sessions([
+            (BOB_CURVE, sessions[0]),
+            (BOB_CURVE, sessions[1]),
+            (ALICE_CURVE, alice_session),
+        ])
+
+        unsaved = {sessions[2].id: (BOB_CURVE, sessions[2])}
+        store = LazySessionStore(database, 1, unsaved)
+        assert not list(store)
+
+        assert store.get(BOB_CURVE).id == sessions[2].id
+        assert {s.id for s in store[BOB_CURVE]} == {s.id for s in sessions}
+
+        use_times = [s.use_time for s in store[BOB_CURVE]]
+        assert use_times == sorted(use_times, reverse=True)
+
+        # Only the sessions of the most recently used key are kept.
+        assert store.get(ALICE_CURVE).id == alice_session.id
+        assert len(store) == 1
+        assert [s.id for s in store] == [alice_session.id]
+
+        assert not store.add(BOB_CURVE, sessions[0])
+        assert len(store[BOB_CURVE]) == 3
+
+        session = OutboundSession(account, BOB_CURVE, BOB_ONETIME)
+        assert store.add(BOB_CURVE, session)
+        assert store.get(BOB_CURVE) is session
+        assert len(store[BOB_CURVE]) == 4
+
+        assert not store.get("missing")
+
+    def test_lazy_session_store_benchmark(self, tempdir, slow_benchmark):
+        database = DefaultStore("ephemeral", "DEVICEID", tempdir)
+        account = OlmAccount()
+        database.save_account(account)
+
+        # Every device gets ten different sessions.
+        sessions = [
+            OutboundSession(account, BOB_CURVE, BOB_ONETIME)
+            for _ in range(10)
+        ]
+        pickles = [s.pickle(database.pickle_key) for s in sessions]
+
+        with database.database.bind_ctx(database.models):
+            db_account = database._get_account()
+            rows = [
+                (db_account, "curve{}".format(i % 5000), pickles[i // 5000],
+                 "session{}".format(i), sessions[0].creation_time,
+                 sessions[0].use_time)
+                for i in range(50000)
+            ]
+
+            with database.database.atomic():
+                for idx in range(0, len(rows), 100):
+                    OlmSessions.insert_many(rows[idx:idx + 100], fields=[
+                        OlmSessions.account,
+                        OlmSessions.sender_key,
+                        OlmSessions.session,
+                        OlmSessions.session_id,
+                        OlmSessions.creation_time,
+                        OlmSessions.last_usage_date
+                    ]).execute()
+
+        def load(lazy):
+            gc.collect()
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = time.perf_counter()
+
+            if lazy:
+                store = LazySessionStore(database, 100)
+                store.get("curve0")
+            else:
+                store = database.load_sessions()
+
+            return (
+                store,
+                time.perf_counter() - start,
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - max_rss
+            )
+
+        # The lazy store is loaded first, the maximum RSS only grows.
+        store, lazy_time, lazy_rss = slow_benchmark.pedantic(
+            load,
+            args=(True, ),
+            rounds=1
+        )
+        assert len(store["curve1"]) == 10
+
+        store, eager_time, eager_rss = load(False)
+        assert len(list(store)) == 50000
+
+        slow_benchmark.extra_info["lazy_time"] = lazy_time
+        slow_benchmark.extra_info["eager_time"] = eager_time
+        slow_benchmark.extra_info["lazy_rss"] = lazy_rss
+        slow_benchmark.extra_info["eager_rss"] = eager_rss
+
+        assert lazy_time < eager_time
@@ -3,7 +3,12 @@
 from __future__ import unicode_literals
 
 import json
+from copy import deepcopy
 
+import pytest
+
+from helpers import large_sync_response
+from nio.events import BadEvent, RoomMessageText
 from nio.responses import (DeleteDevicesAuthResponse, DevicesResponse,
                            DownloadResponse, DownloadError,
                            ErrorResponse, JoinedMembersError,
@@ -21,6 +26,7 @@ from nio.responses import (DeleteDevicesAuthResponse, DevicesResponse,
                            SyncResponse, ThumbnailResponse, ThumbnailError,
                            ToDeviceError, ToDeviceResponse,
                            UploadResponse, _ErrorWithRoomId, LoginInfoResponse)
+from nio.schemas import use_compiled_validators
 
 TEST_ROOM_ID = "!test:example.org"
 
@@ -299,3 +305,38 @@ class TestClass:
             "tests/data/login_info.json")
         response = LoginInfoResponse.from_dict(parsed_dict)
         assert isinstance(response, LoginInfoResponse)
+
+    def test_sync_parse_compiled_validators(self):
+        parsed_dict = large_sync_response(10, 20)
+        bad_event = parsed_dict["rooms"]["join"]["!room0:example.org"][
+            "timeline"]["events"][0]
+        bad_event["content"]["body"] = 1
+
+        expected = SyncResponse.from_dict(deepcopy(parsed_dict))
+
+        use_compiled_validators()
+        try:
+            response = SyncResponse.from_dict(deepcopy(parsed_dict))
+        finally:
+            use_compiled_validators(False)
+
+        assert response == expected
+
+        events = response.rooms.join["!room0:example.org"].timeline.events
+        assert isinstance(events[0], BadEvent)
+        assert isinstance(events[1], RoomMessageText)
+
+    @pytest.mark.parametrize("compiled", [False, True])
+    def test_sync_parse_benchmark(self, benchmark, compiled):
+        parsed_dict = large_sync_response(100, 100)
+
+        def parse(parsed_dict):
+            return SyncResponse.from_dict(deepcopy(parsed_dict))
+
+        use_compiled_validators(compiled)
+        try:
+            response = benchmark(parse, parsed_dict)
+        finally:
+            use_compiled_validators(False)
+
+        assert isinstance(response, SyncResponse)
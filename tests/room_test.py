@@ -1,14 +1,20 @@
+import gc
+import json
+import tracemalloc
+
 import pytest
 
 from helpers import faker
 from nio.events import (InviteAliasEvent, InviteMemberEvent, InviteNameEvent,
-                        RoomAvatarEvent,
+                        MegolmEvent, RoomAvatarEvent, RoomMessageText,
                         RoomCreateEvent, RoomGuestAccessEvent,
                         RoomHistoryVisibilityEvent, RoomJoinRulesEvent,
-                        RoomMemberEvent, RoomNameEvent, TypingNoticeEvent,
+                        RoomMemberEvent, RoomNameEvent, RoomTopicEvent,
+                        TypingNoticeEvent,
                         Receipt, ReceiptEvent)
 from nio.responses import RoomSummary
-from nio.rooms import MatrixInvitedRoom, MatrixRoom
+from nio.rooms import (MatrixInvitedRoom, MatrixRoom, MatrixUser,
+                       MemberNames, MemberTable, RoomTimeline, TimelineCache)
 
 TEST_ROOM = "!test:example.org"
 BOB_ID = "@bob:example.org"
@@ -24,10 +30,24 @@ class TestClass:
 
     @property
     def test_room(self):
-        room = MatrixRoom(TEST_ROOM, BOB_ID)
+        return self._test_room()
+
+    @staticmethod
+    def _test_room(compact_members=False):
+        room = MatrixRoom(TEST_ROOM, BOB_ID, compact_members=compact_members)
         room.update_summary(RoomSummary(0, 0, []))
         return room
 
+    @staticmethod
+    def _message(event_id, timestamp, body="Hello"):
+        return RoomMessageText.from_dict({
+            "event_id": event_id,
+            "sender": ALICE_ID,
+            "origin_server_ts": timestamp,
+            "type": "m.room.message",
+            "content": {"msgtype": "m.text", "body": body},
+        })
+
     def test_room_creation(self):
         room = self.test_room
         assert room
@@ -53,6 +73,49 @@ class TestClass:
         assert member.display_name == name
         assert member.avatar_url == avatar
 
+    def test_lazy_members(self):
+        room = self.test_room
+        mx_id, name, avatar = self.new_user
+
+        assert room.missing_members([mx_id, BOB_ID, mx_id]) == [mx_id, BOB_ID]
+
+        assert room.add_lazy_member(mx_id, name, avatar)
+        assert not room.add_lazy_member(mx_id, name, avatar)
+        assert room.missing_members([mx_id]) == []
+        assert mx_id in room.lazy_members
+
+        fetched = room.lazy_members[mx_id]
+        assert room.evict_lazy_members(60, now=fetched + 30) == []
+        assert room.evict_lazy_members(60, now=fetched + 60) == [mx_id]
+        assert mx_id not in room.users
+        assert not room.lazy_members
+        assert not room.names[name]
+
+    def test_lazy_member_state_update(self):
+        room = self.test_room
+        room.add_lazy_member(ALICE_ID, "Alice", None)
+
+        event = RoomMemberEvent(
+            {"event_id": "event1", "sender": ALICE_ID, "origin_server_ts": 1},
+            ALICE_ID,
+            "join",
+            None,
+            {"membership": "join"},
+        )
+        room.handle_membership(event)
+
+        assert ALICE_ID in room.users
+        assert not room.lazy_members
+        assert room.evict_lazy_members(0) == []
+
+    def test_lazy_members_encrypted_room(self):
+        room = self.test_room
+        room.encrypted = True
+        room.add_lazy_member(ALICE_ID, "Alice", None)
+
+        assert room.evict_lazy_members(0) == []
+        assert ALICE_ID in room.users
+
     def test_summary_details(self):
         room = self.test_room
 
@@ -205,6 +268,67 @@ class TestClass:
 
         assert room.display_name == "Empty Room"
 
+    def test_display_name_cache(self, monkeypatch):
+        room = self.test_room
+        room.summary = None
+        room.add_member(BOB_ID, "Bob", None)  # us
+        room.add_member(ALICE_ID, "Alice", None)
+
+        calls = []
+        group_name = room.group_name
+
+        def counting_group_name():
+            calls.append(1)
+            return group_name()
+
+        monkeypatch.setattr(room, "group_name", counting_group_name)
+
+        assert room.display_name == "Alice"
+        assert room.display_name == "Alice"
+        assert len(calls) == 1
+
+        # Events that don't change the name keep the cached name.
+        room.handle_event(
+            RoomTopicEvent(
+                {"event_id": "event1", "sender": BOB_ID,
+                 "origin_server_ts": 0},
+                "new topic"
+            )
+        )
+        assert room.display_name == "Alice"
+        assert len(calls) == 1
+
+        room.handle_membership(RoomMemberEvent(
+            {"event_id": "event2", "sender": ALICE_ID, "origin_server_ts": 1},
+            ALICE_ID,
+            "join",
+            None,
+            {"membership": "join", "displayname": "Alice Margatroid"},
+        ))
+        assert room.display_name == "Alice Margatroid"
+        assert len(calls) == 2
+
+        room.add_member("@malory:example.org", "Alice Margatroid", None)
+        assert room.display_name == (
+            "Alice Margatroid (@alice:example.org) and "
+            "Alice Margatroid (@malory:example.org)"
+        )
+
+        room.handle_event(
+            RoomNameEvent(
+                {"event_id": "event3", "sender": BOB_ID,
+                 "origin_server_ts": 2},
+                "test name"
+            )
+        )
+        assert room.display_name == "test name"
+
+        room.update_summary(RoomSummary(1, 0, [ALICE_ID]))
+        room.name = None
+        assert room.display_name == (
+            "Empty Room (had Alice Margatroid (@alice:example.org))"
+        )
+
     def test_name_calculation_with_canonical_alias(self):
         room = self.test_room
         room.canonical_alias = "#test:termina.org.uk"
@@ -277,8 +401,9 @@ class TestClass:
         room.add_member("@alice:example.org", "Alice", "mxc://baz")
         assert room.gen_avatar_url is None
 
-    def test_user_name_calculation(self):
-        room = self.test_room
+    @pytest.mark.parametrize("compact_members", [False, True])
+    def test_user_name_calculation(self, compact_members):
+        room = self._test_room(compact_members)
         assert room.user_name("@not_in_the_room:example.org") is None
 
         room.add_member("@alice:example.org", "Alice", None)
@@ -500,7 +625,8 @@ class TestClass:
         assert room.remove_member(mx_id)
         assert not room.remove_member(mx_id)
 
-    def test_user_membership_changes(self):
+    @pytest.mark.parametrize("compact_members", [False, True])
+    def test_user_membership_changes(self, compact_members):
         invited_event = RoomMemberEvent(
             {"event_id": "event1", "sender": BOB_ID, "origin_server_ts": 1},
             ALICE_ID,
@@ -537,7 +663,7 @@ class TestClass:
             {"membership": "bad_membership"},
         )
 
-        room = self.test_room
+        room = self._test_room(compact_members)
         assert not room.users
         assert not room.invited_users
 
@@ -584,3 +710,256 @@ class TestClass:
 
         assert not room.handle_membership(leaves_event)
         assert not room.handle_membership(unknown_event)
+
+    def test_member_table(self):
+        table = MemberTable()
+
+        table[ALICE_ID] = MatrixUser(ALICE_ID, "Alice", "mxc://alice", 50)
+        table[BOB_ID] = MatrixUser(BOB_ID, None, None, 0, True)
+
+        assert len(table) == 2
+        assert set(table) == {ALICE_ID, BOB_ID}
+        assert set(table.invited) == {BOB_ID}
+
+        alice = table[ALICE_ID]
+        assert isinstance(alice, MatrixUser)
+        assert alice.name == "Alice"
+        assert alice.avatar_url == "mxc://alice"
+        assert alice.power_level == 50
+
+        alice.display_name = "Alice Margatroid"
+        alice.power_level = 100
+        assert table[ALICE_ID].display_name == "Alice Margatroid"
+        assert table[ALICE_ID].power_level == 100
+
+        del table.invited[BOB_ID]
+        assert not table[BOB_ID].invited
+        assert not table.invited
+
+        removed = table.pop(ALICE_ID)
+        assert removed.display_name == "Alice Margatroid"
+        assert ALICE_ID not in table
+        assert table.pop(ALICE_ID, None) is None
+
+        # The free row is reused.
+        table[ALICE_ID] = MatrixUser(ALICE_ID)
+        assert table[ALICE_ID].display_name is None
+        assert table[ALICE_ID].power_level == 0
+        assert len(table._display_names) == 2
+
+    def test_member_names(self):
+        names = MemberNames()
+
+        names.add("Alice", ALICE_ID)
+        assert names["Alice"] == [ALICE_ID]
+        assert dict.__getitem__(names, "Alice") == ALICE_ID
+
+        names.add("Alice", BOB_ID)
+        assert names["Alice"] == [ALICE_ID, BOB_ID]
+
+        # Looked up lists are copies, changing them doesn't change the index.
+        names["Alice"].append("@carol:example.org")
+        assert names["Alice"] == [ALICE_ID, BOB_ID]
+
+        names.remove("Alice", ALICE_ID)
+        assert names["Alice"] == [BOB_ID]
+
+        names.remove("Alice", BOB_ID)
+        assert "Alice" not in names
+        assert names["Alice"] == []
+
+        with pytest.raises(ValueError):
+            names.remove("Alice", BOB_ID)
+
+    def test_compact_members_memory_benchmark(self, benchmark):
+        members = [
+            ("@user{}:example.org".format(i), "User {}".format(i),
+             "mxc://example.org/{}".format(i))
+            for i in range(100000)
+        ]
+
+        def fill(compact_members):
+            gc.collect()
+            tracemalloc.start()
+
+            try:
+                room = MatrixRoom(
+                    TEST_ROOM, BOB_ID, compact_members=compact_members
+                )
+
+                for user_id, display_name, avatar_url in members:
+                    room.add_member(user_id, display_name, avatar_url)
+
+                return room, tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+
+        room, plain_size = fill(False)
+        del room
+
+        room, compact_size = benchmark.pedantic(
+            fill,
+            args=(True, ),
+            rounds=1
+        )
+
+        benchmark.extra_info["plain_size"] = plain_size
+        benchmark.extra_info["compact_size"] = compact_size
+
+        assert len(room.users) == 100000
+        assert room.user_name("@user5:example.org") == "User 5"
+        assert compact_size < plain_size / 2
+
+    def test_room_timeline(self):
+        timeline = RoomTimeline(max_events=3)
+
+        assert timeline.add_events(
+            [self._message("$1", 1), self._message("$3", 3), None]
+        ) == 2
+        assert not timeline.add(self._message("$1", 1))
+
+        # Older events are put in place.
+        assert timeline.add(self._message("$2", 2))
+        assert [e.event_id for e in timeline] == ["$1", "$2", "$3"]
+
+        assert timeline.add(self._message("$4", 4))
+        assert [e.event_id for e in timeline] == ["$2", "$3", "$4"]
+        assert "$1" not in timeline
+
+        # Events older than a full buffer are dropped right away.
+        assert not timeline.add(self._message("$0", 0))
+        assert len(timeline) == 3
+
+        assert [e.event_id for e in timeline.latest(2)] == ["$3", "$4"]
+        assert timeline.latest(0) == []
+
+        timeline.clear()
+        assert not timeline.events
+        assert "$2" not in timeline
+
+    def test_room_timeline_bytes(self):
+        message = self._message("$1", 1, "a" * 100)
+        size = len(json.dumps(message.source, separators=(",", ":")))
+
+        timeline = RoomTimeline(max_bytes=2 * size + size // 2)
+        timeline.add_events(
+            self._message("${}".format(i), i, "a" * 100) for i in range(10)
+        )
+
+        assert len(timeline) == 2
+        assert timeline.byte_size == 2 * size
+
+    def test_room_timeline_decrypted_replacement(self):
+        encrypted = MegolmEvent.from_dict({
+            "event_id": "$1",
+            "sender": ALICE_ID,
+            "origin_server_ts": 1,
+            "type": "m.room.encrypted",
+            "content": {
+                "algorithm": "m.megolm.v1.aes-sha2",
+                "ciphertext": "ciphertext",
+                "sender_key": "sender_key",
+                "device_id": "DEVICEID",
+                "session_id": "session_id",
+            },
+        })
+        timeline = RoomTimeline()
+
+        assert timeline.add(encrypted)
+        assert not timeline.add(self._message("$1", 1))
+        assert isinstance(timeline.events[0], RoomMessageText)
+
+        assert not timeline.add(encrypted)
+        assert isinstance(timeline.events[0], RoomMessageText)
+
+    def test_timeline_cache(self):
+        cache = TimelineCache(max_events=2, max_total_events=3)
+        first = MatrixRoom("!first:example.org", BOB_ID)
+        second = MatrixRoom("!second:example.org", BOB_ID)
+
+        cache.add_events(first, [self._message("$1", 1)])
+        cache.add_events(second, [self._message("$2", 2)])
+        assert cache.total_events == 2
+        assert len(first.timeline) == 1
+
+        cache.add_events(
+            first, [self._message("$3", 3), self._message("$4", 4)]
+        )
+        assert len(first.timeline) == 2
+        assert cache.total_events == 3
+
+        # The least recently updated room is dropped.
+        cache.add_events(second, [self._message("$5", 5)])
+        assert first.timeline is None
+        assert cache.total_events == 2
+        assert len(cache) == 1
+
+        cache.add_events(second, [self._message("$6", 6)], limited=True)
+        assert [e.event_id for e in second.timeline] == ["$6"]
+        assert cache.total_events == 1
+
+        cache.drop(second.room_id)
+        assert second.timeline is None
+        assert cache.total_events == 0
+
+    def test_timeline_cache_history(self):
+        cache = TimelineCache(max_events=4)
+        room = MatrixRoom(TEST_ROOM, BOB_ID)
+
+        # Nothing is buffered that a page could touch.
+        assert cache.add_history(room, [self._message("$1", 1)]) == 0
+        assert room.timeline is None
+
+        cache.add_events(
+            room, [self._message("$5", 5), self._message("$6", 6)],
+            prev_batch="t5",
+        )
+        assert room.timeline.prev_batch == "t5"
+
+        # Pages from other parts of the history would leave a gap.
+        assert cache.add_history(
+            room, [self._message("$1", 1)], "t1", "t0"
+        ) == 0
+
+        # A page that overlaps the buffered events.
+        assert cache.add_history(
+            room, [self._message("$4", 4), self._message("$5", 5)]
+        ) == 1
+        assert room.timeline.prev_batch == "t5"
+
+        # A page that continues the timeline backwards.
+        assert cache.add_history(
+            room, [self._message("$3", 3)], "t5", "t3"
+        ) == 1
+        assert room.timeline.prev_batch == "t3"
+        assert [e.event_id for e in room.timeline] == ["$3", "$4", "$5", "$6"]
+        assert cache.total_events == 4
+
+        # The timeline is full, older events are dropped right away.
+        assert cache.add_history(
+            room, [self._message("$2", 2)], "t3", "t2"
+        ) == 0
+        assert room.timeline.prev_batch == "t3"
+
+        # Dropping the oldest buffered event invalidates the token.
+        cache.add_events(room, [self._message("$7", 7)])
+        assert room.timeline.prev_batch is None
+
+    def test_room_timeline_event_sizes(self, monkeypatch):
+        sizes = []
+
+        def event_size(event):
+            sizes.append(event.event_id)
+            return 10
+
+        monkeypatch.setattr("nio.rooms._event_size", event_size)
+
+        timeline = RoomTimeline(max_bytes=25)
+        timeline.add_events(
+            self._message("${}".format(i), i) for i in range(5)
+        )
+
+        # Every event is measured once, not again when it's dropped.
+        assert sizes == ["$0", "$1", "$2", "$3", "$4"]
+        assert timeline.byte_size == 20
+        assert len(timeline) == 2
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from jsonschema.exceptions import ValidationError
+
+from nio.schemas import (Schemas, compile_schema, get_validator,
+                         use_compiled_validators, validate_json)
+
+
+class TestClass:
+    def test_validator_cached(self):
+        validator = get_validator(Schemas.room_message_text)
+
+        assert validator is get_validator(Schemas.room_message_text)
+        assert validator is not get_validator(Schemas.room_message_emote)
+
+    def test_validator_unknown_schema(self):
+        schema = {"type": "object", "required": ["foo"]}
+        validator = get_validator(schema)
+
+        assert validator.schema is schema
+        assert validator is not get_validator(schema)
+
+    def test_validate_json(self):
+        validate_json({"room_id": "!test:example.org"}, Schemas.room_id)
+
+        with pytest.raises(ValidationError):
+            validate_json({}, Schemas.room_id)
+
+    def test_user_id_format(self):
+        with pytest.raises(ValidationError):
+            validate_json(
+                {
+                    "user_id": "example",
+                    "device_id": "DEVICEID",
+                    "access_token": "abc123",
+                },
+                Schemas.login,
+            )
+
+    def test_compiled_schema(self):
+        check = compile_schema(Schemas.room_message_text)
+
+        event = {
+            "content": {"msgtype": "m.text", "body": "Hello"},
+            "event_id": "$15163622445EBvZJ:localhost",
+            "origin_server_ts": 1516362244026,
+            "sender": "@example:localhost",
+            "type": "m.room.message",
+        }
+
+        assert check(event)
+
+        event["content"]["body"] = 1
+        assert not check(event)
+
+    def test_compiled_schema_defaults(self):
+        check = compile_schema(Schemas.sync)
+        parsed_dict = {
+            "next_batch": "s526_47314_0_7_1_1_1_11444_1",
+            "device_one_time_keys_count": {},
+            "device_lists": {"changed": [], "left": []},
+            "rooms": {"invite": {}, "join": {}, "leave": {}},
+            "to_device": {"events": []},
+        }
+
+        assert check(parsed_dict)
+        assert parsed_dict["device_one_time_keys_count"] == {
+            "curve25519": 0,
+            "signed_curve25519": 0,
+        }
+
+    def test_compiled_schema_unsupported(self):
+        assert compile_schema({"oneOf": [{"type": "string"}]}) is None
+
+    def test_compiled_validation_error(self):
+        use_compiled_validators()
+        try:
+            validate_json({"room_id": "!test:example.org"}, Schemas.room_id)
+
+            with pytest.raises(ValidationError):
+                validate_json({"room_id": 1}, Schemas.room_id)
+        finally:
+            use_compiled_validators(False)
@@ -13,6 +13,8 @@ from nio.crypto import (InboundGroupSession, OlmAccount, OlmDevice,
                         OutboundGroupSession, OutboundSession,
                         OutgoingKeyRequest, TrustState)
 from nio.exceptions import OlmTrustError
+from nio.responses import RoomSummary
+from nio.rooms import MatrixRoom
 from nio.store import (Ed25519Key, Key, KeyStore, MatrixStore, DefaultStore,
                        SqliteMemoryStore, SqliteStore)
 
@@ -407,6 +409,36 @@ class TestClass:
         assert (sorted(loaded_session.forwarding_chain) ==
                 sorted(TEST_FORWARDING_CHAIN))
 
+    def test_new_store_group_sessions_bulk(self, store):
+        account = store.load_account()
+
+        sessions = [
+            InboundGroupSession(
+                OutboundGroupSession().session_key,
+                account.identity_keys["ed25519"],
+                account.identity_keys["curve25519"],
+                room,
+                TEST_FORWARDING_CHAIN
+            ) for room in (TEST_ROOM, TEST_ROOM_2) for _ in range(150)
+        ]
+        store.save_inbound_group_sessions(sessions)
+        # Saving sessions again only updates them.
+        store.save_inbound_group_sessions(sessions[:10])
+        store.save_inbound_group_sessions([])
+
+        session_store = self.copy_store(store).load_inbound_group_sessions()
+
+        for session in sessions:
+            loaded_session = session_store.get(
+                session.room_id,
+                account.identity_keys["curve25519"],
+                session.id
+            )
+
+            assert loaded_session
+            assert (sorted(loaded_session.forwarding_chain) ==
+                    sorted(TEST_FORWARDING_CHAIN))
+
     def test_new_store_device_keys(self, store):
         account = store.load_account()
 
@@ -761,3 +793,60 @@ class TestClass:
         sqlstore.save_sync_token(token)
         loaded_token = sqlstore.load_sync_token()
         assert token == loaded_token
+
+    def test_filter_id_loading(self, sqlstore):
+        assert sqlstore.load_filter_ids() == {}
+
+        sqlstore.save_filter_id("hash1", "1")
+        sqlstore.save_filter_id("hash2", "2")
+        sqlstore.save_filter_id("hash1", "3")
+
+        assert sqlstore.load_filter_ids() == {"hash1": "3", "hash2": "2"}
+
+    def test_room_state_loading(self, sqlstore):
+        assert sqlstore.load_rooms() == {}
+
+        room = MatrixRoom(TEST_ROOM, "ephemeral", encrypted=True)
+        room.name = "Test room"
+        room.topic = "Testing"
+        room.power_levels.users[BOB_ID] = 100
+        room.power_levels.events["m.room.name"] = 50
+        room.summary = RoomSummary(1, 2, [BOB_ID])
+        room.add_member(BOB_ID, "Bob", None)
+        room.add_member("@alice:example.org", "Alice", "mxc://a", True)
+        room.add_member("@carol:example.org", None, None)
+
+        sqlstore.save_rooms([room])
+
+        loaded = sqlstore.load_rooms()[TEST_ROOM]
+
+        assert loaded.name == "Test room"
+        assert loaded.topic == "Testing"
+        assert loaded.encrypted
+        assert loaded.power_levels == room.power_levels
+        assert loaded.summary == room.summary
+        assert loaded.users.keys() == room.users.keys()
+        assert list(loaded.invited_users) == ["@alice:example.org"]
+        assert loaded.users[BOB_ID].power_level == 100
+        assert loaded.users["@alice:example.org"].avatar_url == "mxc://a"
+        assert loaded.display_name == room.display_name
+
+        room.topic = "Changed"
+        room.remove_member("@carol:example.org")
+        room.users[BOB_ID].display_name = "Bobby"
+        room.add_member("@dave:example.org", "Dave", None)
+
+        sqlstore.save_rooms([room], {
+            TEST_ROOM: {BOB_ID, "@carol:example.org", "@dave:example.org"}
+        })
+
+        loaded = sqlstore.load_rooms(compact_members=True)[TEST_ROOM]
+
+        assert loaded.topic == "Changed"
+        assert set(loaded.users) == {
+            BOB_ID, "@alice:example.org", "@dave:example.org"
+        }
+        assert loaded.users[BOB_ID].display_name == "Bobby"
+
+        sqlstore.delete_room(TEST_ROOM)
+        assert sqlstore.load_rooms() == {}
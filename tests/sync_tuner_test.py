@@ -0,0 +1,81 @@
+import pytest
+
+from helpers import large_sync_response
+from nio import SyncResponse, SyncTuner
+
+LIGHT_FILTER = {"presence": {"types": []}}
+FULL_FILTER = {"room": {"timeline": {"limit": 20}}}
+
+
+def sync_response(room_count, events_per_room):
+    return SyncResponse.from_dict(
+        large_sync_response(room_count, events_per_room)
+    )
+
+
+class TestClass:
+    def test_idle_timeout_growth(self):
+        tuner = SyncTuner(min_timeout=1000, max_timeout=8000)
+        idle = sync_response(0, 0)
+
+        assert tuner.timeout(1500) == 1500
+
+        timeouts = []
+
+        for _ in range(4):
+            tuner.update(idle)
+            timeouts.append(tuner.timeout())
+
+        assert timeouts == [3000, 6000, 8000, 8000]
+        assert tuner.metrics.idle_syncs == 4
+        assert tuner.metrics.timeout_changes == 3
+        assert tuner.metrics.events == 0
+
+    def test_active_timeout(self):
+        tuner = SyncTuner(min_timeout=1000, max_timeout=8000)
+
+        tuner.update(sync_response(0, 0))
+        assert tuner.timeout() == 8000
+
+        # Activity doesn't lower the timeout, the sync returns as soon as
+        # there are events anyway.
+        tuner.update(sync_response(2, 20))
+        assert tuner.metrics.events == 40
+        assert tuner.metrics.idle_syncs == 0
+        assert tuner.timeout() == 8000
+        assert tuner.metrics.timeout_changes == 0
+        assert tuner.metrics.syncs == 2
+
+    def test_filter_switching(self):
+        tuner = SyncTuner(light_filter=LIGHT_FILTER, idle_threshold=2)
+        idle = sync_response(0, 0)
+
+        assert tuner.sync_filter(FULL_FILTER) == FULL_FILTER
+
+        tuner.update(idle)
+        assert tuner.sync_filter(FULL_FILTER) == FULL_FILTER
+
+        tuner.update(idle)
+        assert tuner.sync_filter(FULL_FILTER) == LIGHT_FILTER
+        assert tuner.metrics.light_filter
+
+        tuner.update(sync_response(1, 1))
+        assert tuner.sync_filter(FULL_FILTER) == FULL_FILTER
+        assert tuner.metrics.filter_switches == 2
+
+    def test_no_light_filter(self):
+        tuner = SyncTuner(idle_threshold=1)
+
+        for _ in range(3):
+            tuner.update(sync_response(0, 0))
+
+        assert tuner.sync_filter(FULL_FILTER) == FULL_FILTER
+        assert tuner.metrics.filter_switches == 0
+
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            SyncTuner(min_timeout=2000, max_timeout=1000)
+
+        with pytest.raises(ValueError):
+            SyncTuner(min_timeout=0)
+